@@ -631,20 +631,10 @@ class BackupActions():
             list: list of tuples with the data
         """
         fm1=self.cma.get_file_map(db_map_pair[0])
-        data_list=fm1.db.get_data_from_table(db_map_pair[1],"*",where)
-        if len(data_list)==0:
-            return []
-        if isinstance(id_list,list):
-            if len(id_list)==0:
-                return data_list
-        field_list=fm1.db.get_column_list_of_table(db_map_pair[1])
-        dm1=DataManage(data_list,field_list)
-        # get the selected ids from the list
-        selected_df = dm1.df.loc[(dm1.df['id'].isin(id_list))]
-        if selected_df['id'].size==0:
-            return []
-        # Convert the DataFrame to a list of tuples
-        return selected_df.to_numpy().tolist()
+        if isinstance(id_list,list) and len(id_list)>0:
+            # rows of the ids joined by sqlite
+            return fm1.db.select_by_id_set(db_map_pair[1],id_list,"*",where)
+        return fm1.db.get_data_from_table(db_map_pair[1],"*",where)
         
         
     
@@ -37,7 +37,46 @@ class DataManage():
                 if len(self.fields)!=len(self.data[0]):
                     raise ValueError(f"Number of Fields({len(self.fields)}) do not match with data size({len(self.data[0])})")
                 self.df = pd.DataFrame(self.data, columns=self.fields)
-    
+
+    @staticmethod
+    def iter_dataframes(chunk_iterator,fields:list):
+        """Converts each chunk of rows to a dataframe, only one chunk of tuples is in memory at a time.
+
+        Args:
+            chunk_iterator (iterable): chunks of row tuples, as SQLiteDatabase.iter_data_from_table
+            fields (list): column names of the rows
+
+        Yields:
+            pd.DataFrame: dataframe of the chunk
+        """
+        for chunk in chunk_iterator:
+            if len(chunk)>0:
+                yield pd.DataFrame(chunk, columns=fields)
+
+    @classmethod
+    def from_chunks(cls,chunk_iterator,fields:list):
+        """DataManage of chunks of rows. The rows are converted chunk by chunk,
+        so the whole data is never held as python tuples.
+
+        Args:
+            chunk_iterator (iterable): chunks of row tuples, as SQLiteDatabase.iter_data_from_table
+            fields (list): column names of the rows
+
+        Raises:
+            ValueError: when there are no rows
+
+        Returns:
+            DataManage: data manage with df of all the chunks
+        """
+        df_list=list(cls.iter_dataframes(chunk_iterator,fields))
+        if len(df_list)==0:
+            raise ValueError("No data provided!")
+        d_m=cls.__new__(cls)
+        d_m.data=None
+        d_m.fields=fields
+        d_m.df=pd.concat(df_list,ignore_index=True) if len(df_list)>1 else df_list[0]
+        return d_m
+
     @staticmethod
     def get_df_sorted(df:pd.DataFrame,sort_by,fields_to_tab,ascending=True):
         """Sorts the dataframe
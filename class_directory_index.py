@@ -0,0 +1,135 @@
+"""
+Directory records of the maps for fast rescans
+########################
+# F.garcia
+# creation: 18.10.2026
+########################
+"""
+
+import sqlite3
+
+from class_sqlite_database import SQLiteDatabase
+
+DIRECTORY_INDEX_TABLE = "__File_Mapper_Directories__"
+
+
+class DirectoryIndex:
+    """Stores for each map the directories listed when mapping: (dirpath, parent, mtime_ns, entries).
+    The mtime of a directory changes when entries are added, removed or renamed in it,
+    so a directory with the same mtime and number of entries can be taken from the previous map state.
+    Paths are stored without mount, as the filepath of the map rows.
+    """
+
+    def __init__(self, db: SQLiteDatabase):
+        """Directory index stored in a table of the database
+
+        Args:
+            db (SQLiteDatabase): database of the maps
+        """
+        self.db = db
+        self.create_index_table()
+
+    def create_index_table(self):
+        """Creates the directory table and its key index if not existing"""
+        if self.db.table_exists(DIRECTORY_INDEX_TABLE):
+            return
+        self.db.create_table(
+            DIRECTORY_INDEX_TABLE,
+            [
+                ("tablename", "TEXT", True),
+                ("dirpath", "TEXT", True),
+                ("parent", "TEXT", False),
+                ("mtime_ns", "INTEGER", False),
+                ("entries", "INTEGER", True),
+            ],
+        )
+        self.db.send_sql_command(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {self.db.quotes(DIRECTORY_INDEX_TABLE + '_key')} "
+            f"ON {self.db.quotes(DIRECTORY_INDEX_TABLE)} (tablename, dirpath)"
+        )
+
+    def load(self, table_name: str) -> dict:
+        """Directory records of a map
+
+        Args:
+            table_name (str): map table
+
+        Returns:
+            dict: {dirpath: (parent, mtime_ns, entries)}
+        """
+        records = {}
+        try:
+            c = self.db.conn.cursor()
+            c.execute(
+                f"SELECT dirpath, parent, mtime_ns, entries FROM {self.db.quotes(DIRECTORY_INDEX_TABLE)} "
+                "WHERE tablename = ?",
+                (table_name,),
+            )
+            for dirpath, parent, mtime_ns, entries in c:
+                records[dirpath] = (parent, mtime_ns, entries)
+            c.close()
+        except sqlite3.Error as eee:
+            print(f"Directory index error: {eee}")
+        return records
+
+    @staticmethod
+    def children_of(records: dict) -> dict:
+        """Subdirectories of each directory
+
+        Args:
+            records (dict): {dirpath: (parent, mtime_ns, entries)} as in load
+
+        Returns:
+            dict: {dirpath: [subdirectory dirpath]}
+        """
+        children = {}
+        for dirpath, (parent, _, _) in records.items():
+            if parent is not None:
+                children.setdefault(parent, []).append(dirpath)
+        return children
+
+    def save(self, table_name: str, records: dict) -> bool:
+        """Replaces the directory records of a map in one commit
+
+        Args:
+            table_name (str): map table
+            records (dict): {dirpath: (parent, mtime_ns, entries)}
+
+        Returns:
+            bool: True if saved
+        """
+        try:
+            with self.db.transaction():
+                self.db.delete_data_from_table(DIRECTORY_INDEX_TABLE, f"tablename = {self.db.quotes(table_name)}")
+                self.db.insert_rows(
+                    DIRECTORY_INDEX_TABLE,
+                    [(table_name, dirpath) + record for dirpath, record in records.items()],
+                    ["tablename", "dirpath", "parent", "mtime_ns", "entries"],
+                )
+        except sqlite3.Error as eee:
+            print(f"Directory index error: {eee}")
+            return False
+        return True
+
+    def delete(self, table_name: str):
+        """Removes the directory records of a map"""
+        try:
+            c = self.db.conn.cursor()
+            c.execute(f"DELETE FROM {self.db.quotes(DIRECTORY_INDEX_TABLE)} WHERE tablename = ?", (table_name,))
+            self.db.commit()
+            c.close()
+        except sqlite3.Error as eee:
+            print(f"Directory index error: {eee}")
+
+    def rename(self, table_name: str, new_table_name: str):
+        """Moves the directory records of a map to its new name"""
+        try:
+            c = self.db.conn.cursor()
+            c.execute(
+                f"UPDATE {self.db.quotes(DIRECTORY_INDEX_TABLE)} SET tablename = ? WHERE tablename = ?",
+                (new_table_name, table_name),
+            )
+            self.db.commit()
+            c.close()
+        except sqlite3.Error as eee:
+            print(f"Directory index error: {eee}")
@@ -0,0 +1,270 @@
+"""
+Chunked encrypted container of database files
+########################
+# F.garcia
+# creation: 18.10.2026
+########################
+"""
+
+import io
+import os
+import hmac
+import struct
+import hashlib
+
+from cryptography.fernet import Fernet
+
+CONTAINER_MAGIC = b"FMCRYPT1"
+CONTAINER_BLOCK_SIZE = 1024 * 1024  # plain bytes encrypted in one block
+CONTAINER_SUFFIX = ".fmcrypt"  # the container is kept next to the decrypted database while it is open
+TEMPORARY_SUFFIX = ".tmp"  # new container written next to the old one, it replaces it once complete
+SQLITE_MAGIC = b"SQLite format 3\x00"
+FERNET_MAGIC = b"gAAAAA"  # base64 of the Fernet version byte, files of the whole file encryption
+# magic, block size, plain size, number of blocks
+_HEADER = struct.Struct("<8sIQI")
+# token length, keyed digest of the plain block
+_INDEX_ENTRY = struct.Struct("<I32s")
+
+
+class EncryptedContainer:
+    """File of independently encrypted Fernet blocks.
+    Layout: header | one slot per block | index. All the slots have the size of the token of a full block.
+    The index keeps the token length and a keyed digest of the plain block, when encrypting again only the blocks
+    with a different digest are encrypted, the others are copied from the old container. The new container is
+    written to a temporary file that replaces the old one, so the last good copy is never rewritten in place.
+    """
+
+    def __init__(self, container_path: str, key: bytes, block_size: int = CONTAINER_BLOCK_SIZE):
+        """Container
+
+        Args:
+            container_path (str): container file
+            key (bytes): Fernet key
+            block_size (int, optional): plain bytes per block of a new container. Defaults to CONTAINER_BLOCK_SIZE.
+        """
+        self.container_path = container_path
+        self.key = key
+        self.fernet = Fernet(key)
+        self.block_size = block_size
+
+    @staticmethod
+    def file_format(file_path: str) -> str:
+        """Format of a database file
+
+        Args:
+            file_path (str): file
+
+        Returns:
+            str: "missing", "empty", "sqlite", "container", "fernet" (whole file encryption) or "unknown"
+        """
+        if not os.path.exists(file_path):
+            return "missing"
+        with open(file_path, "rb") as fff:
+            head = fff.read(len(SQLITE_MAGIC))
+        if len(head) == 0:
+            return "empty"
+        if head.startswith(SQLITE_MAGIC):
+            return "sqlite"
+        if head.startswith(CONTAINER_MAGIC):
+            return "container"
+        if head.startswith(FERNET_MAGIC):
+            return "fernet"
+        return "unknown"
+
+    @staticmethod
+    def token_size(plain_size: int) -> int:
+        """Length of the Fernet token of plain_size bytes"""
+        # version + timestamp + iv + padded ciphertext + hmac, base64 encoded
+        raw = 1 + 8 + 16 + (plain_size // 16 + 1) * 16 + 32
+        return 4 * ((raw + 2) // 3)
+
+    def slot_size(self, block_size: int) -> int:
+        """Bytes reserved for each block"""
+        return self.token_size(block_size)
+
+    def digest(self, block: bytes) -> bytes:
+        """Keyed digest of a plain block, equal blocks are not encrypted again"""
+        return hmac.new(self.key, block, hashlib.sha256).digest()
+
+    def read_index(self):
+        """Header and index of the container
+
+        Raises:
+            ValueError: when the file is not a container
+
+        Returns:
+            tuple: (block size, plain size, [(token length, digest)]), None if the container does not exist
+        """
+        if not os.path.exists(self.container_path):
+            return None
+        with open(self.container_path, "rb") as fff:
+            magic, block_size, plain_size, block_count = _HEADER.unpack(fff.read(_HEADER.size))
+            if magic != CONTAINER_MAGIC:
+                raise ValueError(f"{self.container_path} is not an encrypted container")
+            fff.seek(_HEADER.size + block_count * self.slot_size(block_size))
+            data = fff.read(block_count * _INDEX_ENTRY.size)
+        index = [_INDEX_ENTRY.unpack_from(data, iii * _INDEX_ENTRY.size) for iii in range(block_count)]
+        return block_size, plain_size, index
+
+    def iter_plain_blocks(self):
+        """Decrypts the container block by block
+
+        Yields:
+            bytes: plain block
+        """
+        block_size, _, index = self.read_index()
+        slot_size = self.slot_size(block_size)
+        with open(self.container_path, "rb") as f_in:
+            for iii, (length, _) in enumerate(index):
+                f_in.seek(_HEADER.size + iii * slot_size)
+                yield self.fernet.decrypt(f_in.read(length))
+
+    def decrypt_to(self, plain_path: str) -> int:
+        """Decrypts the container block by block into a plain file
+
+        Args:
+            plain_path (str): decrypted file
+
+        Returns:
+            int: plain bytes written
+        """
+        plain_size = 0
+        with open(plain_path, "wb") as f_out:
+            for block in self.iter_plain_blocks():
+                f_out.write(block)
+                plain_size = plain_size + len(block)
+        return plain_size
+
+    def decrypt_bytes(self) -> bytes:
+        """Decrypts the container in memory, nothing is written to disk
+
+        Returns:
+            bytes: plain data
+        """
+        return b"".join(self.iter_plain_blocks())
+
+    def encrypt_from(self, plain_path: str) -> int:
+        """Writes the plain file in the container. Blocks not changed since the container was written are kept.
+
+        Args:
+            plain_path (str): plain file
+
+        Returns:
+            int: blocks encrypted
+        """
+        with open(plain_path, "rb") as f_in:
+            return self.encrypt_stream(f_in)
+
+    def encrypt_bytes(self, plain_data: bytes) -> int:
+        """Writes plain data in the container, as encrypt_from without a plain file
+
+        Args:
+            plain_data (bytes): plain data, as the serialization of a database
+
+        Returns:
+            int: blocks encrypted
+        """
+        with io.BytesIO(plain_data) as f_in:
+            return self.encrypt_stream(f_in)
+
+    def encrypt_stream(self, f_in) -> int:
+        """Writes the plain data of a binary stream in the container, only the changed blocks are encrypted.
+        The container is written to a temporary file, synced to disk and then replaces the old file.
+
+        Args:
+            f_in (BinaryIO): plain data stream
+
+        Returns:
+            int: blocks encrypted
+        """
+        old_index = []
+        try:
+            container_info = self.read_index()
+        except (ValueError, struct.error):
+            container_info = None
+        if container_info is not None and container_info[0] == self.block_size:
+            old_index = container_info[2]
+        slot_size = self.slot_size(self.block_size)
+        index = []
+        written = 0
+        plain_size = 0
+        temporary_path = self.container_path + TEMPORARY_SUFFIX
+        try:
+            with open(temporary_path, "wb") as f_out:
+                f_old = open(self.container_path, "rb") if len(old_index) > 0 else None
+                try:
+                    while True:
+                        block = f_in.read(self.block_size)
+                        if len(block) == 0:
+                            break
+                        plain_size = plain_size + len(block)
+                        iii = len(index)
+                        a_digest = self.digest(block)
+                        f_out.seek(_HEADER.size + iii * slot_size)
+                        if iii < len(old_index) and old_index[iii][1] == a_digest:
+                            # same slot size, the token is copied as it is
+                            f_old.seek(_HEADER.size + iii * slot_size)
+                            f_out.write(f_old.read(old_index[iii][0]))
+                            index.append(old_index[iii])
+                            continue
+                        token = self.fernet.encrypt(block)
+                        f_out.write(token)
+                        index.append((len(token), a_digest))
+                        written = written + 1
+                finally:
+                    if f_old is not None:
+                        f_old.close()
+                f_out.seek(_HEADER.size + len(index) * slot_size)
+                f_out.write(b"".join(_INDEX_ENTRY.pack(*entry) for entry in index))
+                f_out.seek(0)
+                f_out.write(_HEADER.pack(CONTAINER_MAGIC, self.block_size, plain_size, len(index)))
+                f_out.flush()
+                os.fsync(f_out.fileno())
+            os.replace(temporary_path, self.container_path)
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+        self.sync_directory(self.container_path)
+        return written
+
+    @staticmethod
+    def sync_directory(file_path: str):
+        """Syncs the directory of a replaced file, so the rename survives a power loss (not possible on windows)"""
+        try:
+            dir_fd = os.open(os.path.dirname(os.path.abspath(file_path)), os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(dir_fd)
+        except OSError:
+            pass
+        finally:
+            os.close(dir_fd)
+
+    @staticmethod
+    def migrate_fernet_file(file_path: str, key: bytes) -> bool:
+        """Converts a whole file Fernet encrypted database to a container in the same path.
+        The old format is read whole into memory once.
+
+        Args:
+            file_path (str): encrypted database
+            key (bytes): Fernet key
+
+        Returns:
+            bool: True if migrated, False if the file is not in the whole file format
+        """
+        if EncryptedContainer.file_format(file_path) != "fernet":
+            return False
+        plain_path = file_path + ".plain"
+        container_path = file_path + CONTAINER_SUFFIX
+        with open(file_path, "rb") as fff:
+            plain_data = Fernet(key).decrypt(fff.read())
+        with open(plain_path, "wb") as fff:
+            fff.write(plain_data)
+        del plain_data
+        try:
+            EncryptedContainer(container_path, key).encrypt_from(plain_path)
+            os.replace(container_path, file_path)
+        finally:
+            os.remove(plain_path)
+        return True
@@ -482,6 +482,23 @@ class FileManipulate:
             disk_dm_list.append((disk.device,disk.mountpoint))
         return disk_dm_list
     
+    @staticmethod
+    def timestamp_to_datetime(timestamp:float):
+        """Converts a stat time stamp into datetime
+
+        Args:
+            timestamp (float): seconds since epoch, as in os.stat_result.st_mtime
+
+        Returns:
+            datetime: time stamp 
+        """
+        try:
+            dt = datetime.fromtimestamp(timestamp)
+        except (ValueError,OSError,OverflowError,TypeError):
+            # datetime out of range 0== year =>10000
+            dt = datetime.fromisocalendar(3333,33,3)
+        return dt
+
     @staticmethod
     def get_modified_date(file_path):
         """Gets modified date in register
@@ -7,12 +7,12 @@ File Mapping functions for a single database
 """
 
 import os
-import sys
 import time
 from datetime import datetime
-import hashlib
 import threading
+import queue
 import difflib
+import sqlite3
 import keyboard
 
 import concurrent.futures
@@ -20,6 +20,11 @@ from rich import print  # pylint: disable=redefined-builtin
 from rich.progress import Progress
 
 from class_file_structurer import FileStructurer
+from class_file_scanner import FileScanner, SCAN_WORKERS
+from class_directory_index import DirectoryIndex
+from class_map_layout import MapLayout, MAP_LAYOUT, MAP_SEARCH_INDEX
+from class_hash_cache import HashCache
+from class_hash_engine import HashEngine, HASH_UNKNOWN, HASH_NO_PERMISSION, HASH_FILE_NOT_FOUND, SAMPLE_SIZE
 from class_sqlite_database import SQLiteDatabase
 from class_file_manipulate import FileManipulate
 from class_device_monitor import DeviceMonitor
@@ -28,14 +33,19 @@ from class_data_manage import DataManage
 from class_autocomplete_input import AutocompletePathFile, getch, SQL_SG, raw_key_pressed, APP_PATH
 
 # from class_file_explorer import raw_key_pressed
-from thread_queue_calculation_stream import QueueCalcStream
+from thread_queue_calculation_stream import QueueCalcStream, HASH_WORKERS
+from thread_map_writer import MapWriterThread, DATA_WRITE_BATCH
 
 A_C = AutocompletePathFile(None, APP_PATH, False, False, False)
 MD5_CALC = "***Calculate***"
 MD5_SHALLOW = "***Shallow***"
 DATA_ADVANCE = 50  # gather 50 records before writting to db
-SINGLE_MULTIPLE_SEARCH = 15  # use single search or generalized search limit
+# md5 values that are not a hash of the file content, never duplicates or repeats
+MD5_NO_HASH = [MD5_CALC, MD5_SHALLOW, HASH_UNKNOWN, HASH_NO_PERMISSION, HASH_FILE_NOT_FOUND]
+MATCH_TYPES = ["duplicates", "repeated"]
 MAP_TYPES_LIST=["Device Map","Selection Map","Backup Map","Remove","Keep","Sorted Map"]
+# secondary indexes of the map tables, built after the bulk insert of the mapping
+MAP_INDEXES = {"md5": ["md5"], "path": ["filepath", "filename"], "size": ["size"], "modified": ["dt_file_modified"]}
 
 class FileMapper:
     """Class for Mapping functions in a specific database"""
@@ -62,6 +72,20 @@ class FileMapper:
         self.active_devices = []
         self.look_for_active_devices()
         self.mapper_reference_table = "__File_Mapper_Reference__"
+        if self.db.table_exists(self.mapper_reference_table):
+            self.db.create_index(self.mapper_reference_table, ["tablename"])
+        self.hash_cache = HashCache(self.db)
+        self.directory_index = DirectoryIndex(self.db)
+        self.map_layout = MapLayout(self.db)
+        # layout of the maps created, one of MAP_LAYOUTS
+        self.new_map_layout = MAP_LAYOUT
+        # new maps get a trigram search index of filename and filepath
+        self.new_map_search_index = MAP_SEARCH_INDEX
+
+    @staticmethod
+    def is_internal_table(table_name: str) -> bool:
+        """True if the table is used by the mapper and is not a map"""
+        return table_name == "sqlite_sequence" or table_name.startswith("__File_Mapper_")
 
     def look_for_active_devices(self):
         """Looks for devices mounted sets the device, serial list to active_devices"""
@@ -107,10 +131,9 @@ class FileMapper:
                 # Create new encrypted database
                 is_encrypted = True
                 db = SQLiteDatabase(db_path_file, True, None, password)
-                key_generated = db.encrypt_db()
-                if key_generated:
+                # the container is written when the database is closed
+                if db.generate_key():
                     db.save_key_to_file(key_filepath)
-                    db.decrypt_db()
             else:
                 is_encrypted = False
                 db = SQLiteDatabase(db_path_file, False, None, password)
@@ -143,16 +166,7 @@ class FileMapper:
         if leave_to_thread and not shallow_map:
             # time.sleep(0.01) # cant write to db so fast
             return MD5_CALC
-        try:
-            md5 = hashlib.md5()
-            with open(file_path, 'rb') as f:           
-                for chunk in iter(lambda: f.read(4096), b""):
-                    md5.update(chunk)
-            return md5.hexdigest()
-        except FileNotFoundError:
-            print(f"File {file_path} not found.")
-            sys.exit(1)
-        return None
+        return HashEngine.calculate(file_path, "md5")
 
     @staticmethod
     def calculate_sha1(file_path):
@@ -165,17 +179,7 @@ class FileMapper:
         Returns:
             str: The SHA128 hash as a string.
         """
-        try:
-            with open(file_path, "rb") as f:
-                sha1 = hashlib.sha1()
-                while chunk := f.read(4096):
-                    sha1.update(chunk)
-                return sha1.hexdigest()
-
-        except FileNotFoundError:
-            print(f"File {file_path} not found.")
-            sys.exit(1)
-        return None
+        return HashEngine.calculate(file_path, "sha1")
 
     @staticmethod
     def calculate_sha256(file_path):
@@ -188,17 +192,21 @@ class FileMapper:
         Returns:
             str: The SHA256 hash as a string.
         """
-        try:
-            with open(file_path, "rb") as f:
-                sha256 = hashlib.sha256()
-                while chunk := f.read(4096):
-                    sha256.update(chunk)
-                return sha256.hexdigest()
-
-        except FileNotFoundError:
-            print(f"File {file_path} not found.")
-            sys.exit(1)
-        return None
+        return HashEngine.calculate(file_path, "sha256")
+
+    @staticmethod
+    def calculate_hashes(file_path, algorithms: list = None) -> dict:
+        """
+        Calculate MD5, SHA1 and SHA256 for the safety checks reading the file only once.
+
+        Args:
+            file_path (str): The path to the file for which the hashes are calculated.
+            algorithms (list, optional): hashes to calculate. Defaults to None, all of them.
+
+        Returns:
+            dict: {'md5':hash,'sha1':hash,'sha256':hash}
+        """
+        return HashEngine.calculate_multi(file_path, algorithms)
 
     @staticmethod
     def remove_mount_from_path(mount: str, path: str) -> str:
@@ -292,6 +300,7 @@ class FileMapper:
                 ("maptype", "TEXT", True),
             ],
         )
+        db.create_index(self.mapper_reference_table, ["tablename"])
         db_result = DBResult(db.describe_table_in_db(self.mapper_reference_table))
         db_result.set_values(db.get_data_from_table(self.mapper_reference_table, "*", f"tablename={db.quotes(table_name)}"))
         table_indexed = False
@@ -358,13 +367,15 @@ class FileMapper:
         # Map info
         # id=0 'dt_map_created'=1 'dt_map_modified'=2 'mappath'=3 'tablename'=4 'mount'=5 'serial'=6
         # 'mapname'=7 'maptype'=8
-        map_info = self.db.get_data_from_table(self.mapper_reference_table, "*", f"tablename='{a_map}'")
+        map_info = self.db.reader().get_data_from_table(self.mapper_reference_table, "*", f"tablename='{a_map}'")
         if len(map_info) == 0:
             return {}
 
-        data = self.db.get_data_from_table(a_map, "*", where)
         try:
-            d_m1 = DataManage(data, field_list)
+            # chunks of rows to the dataframe, the map is never held as a list of tuples
+            d_m1 = DataManage.from_chunks(
+                self.db.reader().iter_data_sql_command(self.get_search_select(a_map, "*", where)), field_list
+            )
         except ValueError:
             # No data
             return {}
@@ -390,6 +401,27 @@ class FileMapper:
         print(f'Time elapsed: {self.calculate_time_elapsed(start,datetime.now())} s')
         return {mappath: map_list}
     
+    def get_map_search(self, a_map: str, where: str = None, fields_to_tab: list[str] = None) -> tuple:
+        """Query of a search in a map for FileStructureBuilder, through the search index of the map if it has one
+
+        Args:
+            a_map (str): map table
+            where (str, optional): sql filter for the search. Defaults to None.
+            fields_to_tab (list[str], optional): Additional information to 'filename' and 'size' from map
+            into file tuple. Defaults to None.
+
+        Returns:
+            tuple: (map path, sql) with columns filepath, filename, size and fields_to_tab, None if not a map
+        """
+        map_info = self.db.reader().get_data_from_table(self.mapper_reference_table, "*", f"tablename='{a_map}'")
+        if len(map_info) == 0:
+            return None
+        field_list = self.db.get_column_list_of_table(a_map)
+        columns = ["filepath", "filename", "size"]
+        if isinstance(fields_to_tab, list):
+            columns = columns + [field for field in fields_to_tab if field not in columns and field in field_list]
+        return map_info[0][3], self.get_search_select(a_map, ", ".join(columns), where)
+
     def map_to_file_structure_concurrent(self, df) -> list:
         """
         Generates a folder-only file structure from map information.
@@ -499,13 +531,15 @@ class FileMapper:
     #         df['filepath'] = df['filepath'].apply(remove_mappath)
     #     return in_all_paths, df
 
-    def remap_map_in_thread_to_db(self, table_name, progress_bar=None, wait_for_key_press=False):
+    def remap_map_in_thread_to_db(self, table_name, progress_bar=None, wait_for_key_press=False, hash_columns="md5"):
         """Starts a thread that looks inside the table for '***Calculate***' md5.
             Calculates the correspondant md5 and updates the value in the database.
 
         Args:
             table_name (str): table
             progress_bar (object, optional):Object to use for progressbar in GUI. Defaults to None.
+            hash_columns (str | list, optional): hash columns to calculate, a list as ['md5','sha1','sha256']
+            reads each file once for all the hashes. Defaults to "md5".
 
         Returns:
             str: message to print
@@ -522,7 +556,10 @@ class FileMapper:
             kill_ev.clear()
             cycle_time = 0.1
             start_datetime = datetime.now()
-            qstream = QueueCalcStream(db_info, table_name, mount, cycle_time, kill_ev, progress_bar)
+            _, serial = self.find_mount_serial_of_path(mount)
+            qstream = QueueCalcStream(
+                db_info, table_name, mount, cycle_time, kill_ev, progress_bar, hash_columns, serial=serial
+            )
             qstream.start()
             try:
                 was_user_exit = False
@@ -577,11 +614,7 @@ class FileMapper:
         if self.db.table_exists(origin_map) and id_list:
             cols=self.db.get_column_list_of_table(origin_map)
             datasel=str(cols[1:]).replace("[",'').replace("]",'').replace("'",'')
-            map_data=[]
-            for an_id in id_list:
-                data_list=self.db.get_data_from_table(origin_map,datasel,f"id={an_id}")
-                if len(data_list)>0:
-                    map_data.append(data_list[0])
+            map_data=self.db.select_by_id_set(origin_map,id_list,datasel)
             self.map_a_selection(selection_name, origin_map, map_data, map_type)
 
     def map_a_selection(self,selection_name:str, origin_map:str, map_data:list, map_type:str=None):
@@ -605,24 +638,186 @@ class FileMapper:
             an_id=self.get_table_id(selection_name)
             if an_id:
                 self.db.insert_data_to_table(selection_name,map_data)
+                self.index_map(selection_name)
             self.set_mapname(selection_name,origin_map)
 
-    def _create_map_in_db(self,table_name):
-        """Creates map structure with table_name"""
-        self.db.create_table(
-                table_name,
-                [
-                    ("dt_data_created", "DATETIME DEFAULT CURRENT_TIMESTAMP", True),
-                    ("dt_data_modified", "DATETIME", True),
-                    ("filepath", "TEXT", True),
-                    ("filename", "TEXT", True),
-                    ("md5", "TEXT", True),
-                    ("size", "REAL", True),
-                    ("dt_file_created", "DATETIME", False),
-                    ("dt_file_accessed", "DATETIME", False),
-                    ("dt_file_modified", "DATETIME", False),
-                ],
+    def _create_map_in_db(self,table_name,layout:str=None):
+        """Creates map structure with table_name, in layout or the layout of the new maps"""
+        self.map_layout.create_map(table_name,layout or self.new_map_layout)
+
+    def convert_map_layout(self, table_name: str, layout: str) -> bool:
+        """Converts a map to another of the MAP_LAYOUTS keeping its ids, and creates its indexes again
+
+        Args:
+            table_name (str): map table
+            layout (str): one of MAP_LAYOUTS
+
+        Returns:
+            bool: True if the map has the layout
+        """
+        was_converted = self.map_layout.convert_map(table_name, layout)
+        if was_converted:
+            self.index_map(table_name)
+        return was_converted
+
+    def migrate_maps_to_typed(self, table_names: list = None, log_print: bool = True) -> list:
+        """Converts maps to the typed layout: size as INTEGER bytes and dates as INTEGER nanoseconds since epoch.
+        The ids are kept and the indexes of each map are created again.
+
+        Args:
+            table_names (list, optional): maps to convert. Defaults to None, all the maps of the database.
+            log_print (bool, optional): print progress. Defaults to True.
+
+        Returns:
+            list: maps converted
+        """
+        if table_names is None:
+            table_names = [a_map for a_map in self.get_referenced_attribute("tablename") if self.db.table_exists(a_map)]
+        converted = []
+        for iii, table_name in enumerate(table_names):
+            layout = self.map_layout.get_layout(table_name)
+            if layout in [None, "typed"]:
+                continue
+            if log_print:
+                print(f"{iii + 1}/{len(table_names)} Converting {table_name} from {layout} to typed")
+            start = datetime.now()
+            if self.convert_map_layout(table_name, "typed"):
+                converted.append(table_name)
+                if log_print:
+                    print(f"{table_name} converted in {self.calculate_time_elapsed(start, datetime.now())} s")
+            elif log_print:
+                print(f"[red]{table_name} not converted")
+        return converted
+
+    @staticmethod
+    def get_map_index_name(table_name: str, index_key: str) -> str:
+        """Name of a secondary index of a map, index_key in MAP_INDEXES"""
+        return f"idx_{table_name}_{index_key}"
+
+    def index_map(self, table_name: str) -> list:
+        """Creates the secondary indexes of a map that do not exist, and its search index if new_map_search_index.
+        Build them after inserting the map rows, inserting in an indexed table is slower.
+
+        Args:
+            table_name (str): map table
+
+        Returns:
+            list: index names
+        """
+        index_list = []
+        if not self.db.table_exists(table_name):
+            return index_list
+        # normalized and typed maps are indexed on their storage table, partitioned maps share the indexes of their table
+        storage_table = self.map_layout.get_storage_table(table_name)
+        index_owner = storage_table if self.map_layout.get_layout(table_name) == "partitioned" else table_name
+        self.map_layout.create_storage_indexes(table_name)
+        for index_key, column_list in MAP_INDEXES.items():
+            index_name = self.db.create_index(
+                storage_table,
+                self.map_layout.get_storage_columns(table_name, column_list),
+                self.get_map_index_name(index_owner, index_key),
             )
+            if index_name:
+                index_list.append(index_name)
+        if self.new_map_search_index:
+            self.map_layout.create_search_index(table_name)
+        return index_list
+
+    def get_search_where(self, a_map: str, where: str) -> str:
+        """Where of a search in a map, through the search index of the map when it has one
+
+        Args:
+            a_map (str): map table
+            where (str): sql of SQL_SG.get_sql_from_text_input
+
+        Returns:
+            str: where sql
+        """
+        if where and self.map_layout.has_search_index(a_map):
+            return SQL_SG.route_to_search_index(where, self.db.quotes(self.map_layout.get_search_table(a_map)))
+        return where
+
+    def get_search_select(self, a_map: str, column_filter: str = "*", where: str = None) -> str:
+        """Query of a search in a map, through its search index when it has one.
+        A typed map is searched on its storage with numeric date comparisons, so its date indexes are used.
+
+        Args:
+            a_map (str): map table
+            column_filter (str, optional): columns. Defaults to "*".
+            where (str, optional): sql of SQL_SG.get_sql_from_text_input. Defaults to None.
+
+        Returns:
+            str: query
+        """
+        where = self.get_search_where(a_map, where)
+        if where and self.map_layout.get_layout(a_map) == "typed":
+            view_select = self.map_layout.get_view_select(a_map, SQL_SG.route_to_typed_storage(where), "typed")
+            return f"SELECT {column_filter} FROM ({view_select})"
+        return self.db.get_select_sql(a_map, column_filter, where)
+
+    def list_map_indexes(self, table_name: str = None) -> list[tuple]:
+        """Indexes of a map or of all the tables in the database
+
+        Args:
+            table_name (str, optional): map table. Defaults to None, all tables.
+
+        Returns:
+            list[tuple]: (index name, table, [columns])
+        """
+        if table_name is None:
+            return self.db.list_indexes()
+        return self.db.list_indexes(self.map_layout.get_storage_table(table_name))
+
+    def rebuild_map_indexes(self, table_name: str) -> list:
+        """Drops and creates again the secondary indexes of a map, and updates its statistics.
+        Use when an index is missing or damaged, for partitioned maps it rebuilds the indexes shared by all of them.
+
+        Args:
+            table_name (str): map table
+
+        Returns:
+            list: index names
+        """
+        for index_name, _, _ in self.list_map_indexes(table_name):
+            self.db.drop_index(index_name)
+        index_list = self.index_map(table_name)
+        self.db.rebuild_indexes(self.map_layout.get_storage_table(table_name))
+        return index_list
+
+    def rename_map_indexes(self, table_name: str, new_table_name: str) -> list:
+        """Renames the secondary indexes of a renamed map, their names follow the map name.
+        Partitioned maps share the indexes of their table, nothing is renamed.
+
+        Args:
+            table_name (str): old map name
+            new_table_name (str): map table, already renamed
+
+        Returns:
+            list: new index names
+        """
+        index_list = []
+        if self.map_layout.get_layout(new_table_name) == "partitioned":
+            return index_list
+        storage_table = self.map_layout.get_storage_table(new_table_name)
+        existing_indexes = [index_name for index_name, _, _ in self.list_map_indexes(new_table_name)]
+        try:
+            with self.db.transaction():
+                for index_key, column_list in MAP_INDEXES.items():
+                    old_index_name = self.get_map_index_name(table_name, index_key)
+                    if old_index_name not in existing_indexes:
+                        continue
+                    self.db.drop_index(old_index_name)
+                    index_list.append(
+                        self.db.create_index(
+                            storage_table,
+                            self.map_layout.get_storage_columns(new_table_name, column_list),
+                            self.get_map_index_name(new_table_name, index_key),
+                        )
+                    )
+        except sqlite3.Error as eee:
+            print(f"Indexes of {new_table_name} not renamed: {eee}")
+            return []
+        return index_list
 
     def map_a_path_to_db(
         self,
@@ -632,6 +827,7 @@ class FileMapper:
         progress_bar=None,
         shallow_map=False,
         press_to_continue=True,
+        scan_workers=SCAN_WORKERS,
     ):
         """Maps a path in a device into a table in the database.
 
@@ -642,50 +838,61 @@ class FileMapper:
             log_print (bool, optional): print logs. Defaults to True.
             shallow_map (bool, optional): Make shallow map (Does not calculate md5,does not run thread).
             Defaults to False.
+            scan_workers (int, optional): scanning threads, rows are written by a writer thread.
+            Set 1 to scan and write in this thread. Defaults to SCAN_WORKERS.
         """
         db = self.db
+        line_data_tup = None
         try:
             self.add_table_to_mapper_index(table_name, path_to_map)
             self._create_map_in_db(table_name)
             data = []
             iii = 0
-            files_processed = 0
             mount, _ = self.find_mount_serial_of_path(path_to_map)
             start_datetime = datetime.now()
-            num_files, num_folders = self.count_files_in_path(path_to_map)
+            scanner = FileScanner(log_print=log_print)
             with Progress() as progress:
                 exit_key = "ctrl+c"
                 if os.name == "nt":
                     exit_key = "F12"
-                task1 = progress.add_task(f"[blue]Initial Mapping [red]({exit_key} to Exit)", total=num_files)
-                delta = datetime.now() - start_datetime
-                print(f"Counted: {num_files} files and {num_folders} folders in {delta.total_seconds()} sec")
-                for dirpath, _, filenames in os.walk(path_to_map):
-                    # Get the data for each file
-                    for file in filenames:
-                        line_data_tup = self.get_mapping_info_data_from_file(
-                            mount, dirpath, file, log_print, f"{files_processed}. ", shallow_map
-                        )
-                        data.append(line_data_tup)
-                        iii = iii + 1
-                        if os.name == "nt":
-                            if keyboard.is_pressed("F12"):
-                                return "[red] User Interrupt"
-                        if iii >= DATA_ADVANCE:
-                            if log_print:
-                                delta = datetime.now() - start_datetime
-                                print("+" * 10 + f" Time elapsed: {str(delta).split('.',  maxsplit=1)[0]}" + "+" * 10)
-                            was_inserted = db.insert_data_to_table(table_name, data)
-                            if not was_inserted:
-                                time.sleep(0.333)
-                                if not db.insert_data_to_table(table_name, data):
-                                    raise ValueError(f"Could not insert data in {table_name}")
-                            progress.update(task1, advance=DATA_ADVANCE)
-                            data = []
-                            iii = 0
-                        files_processed = files_processed + 1
+                task1 = progress.add_task(f"[blue]Initial Mapping [red]({exit_key} to Exit)", total=None)
+                if scan_workers > 1:
+                    was_user_exit = self._map_path_pipelined(
+                        scanner, table_name, mount, path_to_map, log_print, shallow_map, scan_workers, progress, task1
+                    )
+                    if was_user_exit:
+                        return "[red] User Interrupt"
+                    data_iterator = []
+                else:
+                    data_iterator = self.scan_path_to_map_rows(scanner, mount, path_to_map, log_print, shallow_map)
+                for line_data_tup in data_iterator:
+                    data.append(line_data_tup)
+                    iii = iii + 1
+                    if os.name == "nt":
+                        if keyboard.is_pressed("F12"):
+                            return "[red] User Interrupt"
+                    if iii >= DATA_ADVANCE:
+                        if log_print:
+                            delta = datetime.now() - start_datetime
+                            print("+" * 10 + f" Time elapsed: {str(delta).split('.',  maxsplit=1)[0]}" + "+" * 10)
+                        was_inserted = db.insert_data_to_table(table_name, data)
+                        if not was_inserted:
+                            time.sleep(0.333)
+                            if not db.insert_data_to_table(table_name, data):
+                                raise ValueError(f"Could not insert data in {table_name}")
+                        # total grows while the scanner discovers files
+                        progress.update(task1, total=scanner.files_found, completed=scanner.files_scanned)
+                        data = []
+                        iii = 0
                 db.insert_data_to_table(table_name, data)
-                progress.update(task1, completed=num_files)
+                progress.update(task1, total=scanner.files_found, completed=scanner.files_found)
+            self.hash_cache.flush()
+            self.directory_index.save(table_name, self.get_directory_records(mount, scanner))
+            self.index_map(table_name)
+            delta = datetime.now() - start_datetime
+            print(f"Scanned: {scanner.files_found} files and {scanner.folders_found} folders in {delta.total_seconds()} sec")
+            if log_print:
+                print(f"Hash cache: {self.hash_cache.hits} hits, {self.hash_cache.misses} misses")
             time.sleep(0.333)
             # db.print_all_rows(table_name)
             if not shallow_map:
@@ -758,35 +965,31 @@ class FileMapper:
                 self.add_table_to_mapper_index(table_name+"_FP_"+str(iii), path_to_map)
                 self._create_map_in_db(table_name+"_FP_"+str(iii))
                 fp_list.append(table_name+"_FP_"+str(iii))
-                num_files, num_folders = self.count_files_in_path(path_to_map)
+                scanner = FileScanner(log_print=log_print)
                 with Progress() as progress:
                     exit_key = "ctrl+c"
                     if os.name == "nt":
                         exit_key = "F12"
-                    task1 = progress.add_task(f"[blue]Initial Mapping [red]({exit_key} to Exit)", total=num_files)
-                    delta = datetime.now() - start_datetime
-                    print(f"Counted: {num_files} files and {num_folders} folders in {delta.total_seconds()} sec")
+                    task1 = progress.add_task(f"[blue]Initial Mapping [red]({exit_key} to Exit)", total=None)
                     if not file_to_map:
-                        for dirpath, _, filenames in os.walk(path_to_map):
-                            # Get the data for each file
-                            for file in filenames:
-                                line_data_tup = self.get_mapping_info_data_from_file(
-                                    mount, dirpath, file, log_print, f"{files_processed}. ", shallow_map
-                                )
-                                data.append(line_data_tup)
-                                
-                                files_processed = files_processed + 1
-                                progress.update(task1, advance=DATA_ADVANCE)
+                        for line_data_tup in self.scan_path_to_map_rows(
+                            scanner, mount, path_to_map, log_print, shallow_map, files_processed
+                        ):
+                            data.append(line_data_tup)
+                            files_processed = files_processed + 1
+                            progress.update(task1, total=scanner.files_found, completed=scanner.files_scanned)
                     else:
                         line_data_tup = self.get_mapping_info_data_from_file(
                                     mount, path_to_map, file_to_map, log_print, f"{files_processed}. ", shallow_map
                                 )
                         data.append(line_data_tup)
-                        progress.update(task1, advance=DATA_ADVANCE)
+                        progress.update(task1, total=1, completed=1)
                         files_processed = files_processed + 1
                     db.insert_data_to_table(table_name+"_FP_"+str(iii), data)
+                    self.hash_cache.flush()
+                    self.index_map(table_name+"_FP_"+str(iii))
+                    data = []
                     iii = iii + 1
-                progress.update(task1, completed=num_files)
                 time.sleep(0.333)
                 # db.print_all_rows(table_name)
                 if not shallow_map:
@@ -816,6 +1019,103 @@ class FileMapper:
             return f"[red]Error Mapping: {eee}"
         return ''
 
+    def _map_path_pipelined(
+        self,
+        scanner: FileScanner,
+        table_name: str,
+        mount: str,
+        path_to_map: str,
+        log_print: bool,
+        shallow_map: bool,
+        scan_workers: int,
+        progress: Progress,
+        task_id,
+    ) -> bool:
+        """Maps a path with scan_workers scanning threads feeding a bounded queue,
+        a single writer thread owns the database connection and commits large batches.
+
+        Args:
+            scanner (FileScanner): scanner
+            table_name (str): table to map the path
+            mount (str): the mount
+            path_to_map (str): path to map on the device
+            log_print (bool): print logs
+            shallow_map (bool): Make shallow map (Does not calculate md5)
+            scan_workers (int): number of scanning threads
+            progress (Progress): progress to update
+            task_id (TaskID): progress task
+
+        Raises:
+            ValueError: when the writer could not insert data
+
+        Returns:
+            bool: True if user exit
+        """
+        kill_ev = threading.Event()
+        kill_ev.clear()
+        row_queue = queue.Queue(maxsize=2 * DATA_WRITE_BATCH)
+
+        def row_function(dirpath, file, stat_result):
+            """map row of a scanned file"""
+            return self.get_mapping_info_data_from_file(
+                mount, dirpath, file, log_print, f"{scanner.files_scanned}. ", shallow_map, stat_result
+            )
+
+        writer = MapWriterThread(self.db, table_name, row_queue, kill_ev)
+        scan_thread = threading.Thread(
+            target=scanner.scan_parallel,
+            args=(path_to_map, row_function, row_queue, scan_workers, kill_ev),
+            name="Scan controller",
+            daemon=True,
+        )
+        writer.start()
+        scan_thread.start()
+        was_user_exit = False
+        try:
+            while writer.is_alive():
+                if os.name == "nt":
+                    if keyboard.is_pressed("F12"):
+                        was_user_exit = True
+                        kill_ev.set()
+                progress.update(task_id, total=scanner.files_found, completed=writer.rows_written)
+                writer.join(0.5)
+        except KeyboardInterrupt:
+            was_user_exit = True
+            kill_ev.set()
+            writer.join()
+        scan_thread.join()
+        progress.update(task_id, total=scanner.files_found, completed=writer.rows_written)
+        if writer.error:
+            raise ValueError(f"Could not insert data in {table_name}: {writer.error}")
+        return was_user_exit
+
+    def scan_path_to_map_rows(
+        self,
+        scanner: FileScanner,
+        mount: str,
+        path_to_map: str,
+        log_print: bool = False,
+        shallow_map: bool = False,
+        count_start: int = 0,
+    ):
+        """Generator of map rows, walks the path a single time reusing the scandir stat of each file.
+
+        Args:
+            scanner (FileScanner): scanner, its counters can be read while iterating for progress
+            mount (str): the mount
+            path_to_map (str): path to map on the device
+            log_print (bool, optional): print logs. Defaults to False.
+            shallow_map (bool, optional): Make shallow map (Does not calculate md5). Defaults to False.
+            count_start (int, optional): count to start printing. Defaults to 0.
+
+        Yields:
+            tuple: map row as in get_mapping_info_data_from_file
+        """
+        for count, (dirpath, file, stat_result) in enumerate(scanner.scan(path_to_map), count_start):
+            yield self.get_mapping_info_data_from_file(
+                mount, dirpath, file, log_print, f"{count}. ", shallow_map, stat_result
+            )
+
     @staticmethod
     def count_files_in_path(path):
         """Calculate the number of files and folders in a path.
@@ -872,7 +1172,14 @@ class FileMapper:
         return SQL_SG.to_bytes(uc, size_to_calculate) / SQL_SG.to_bytes(us, size_sample) * time_sample_sec
 
     def get_mapping_info_data_from_file(
-        self, mount: str, dirpath: str, file: str, log_print: bool = False, count_print="", shallow_map=False
+        self,
+        mount: str,
+        dirpath: str,
+        file: str,
+        log_print: bool = False,
+        count_print="",
+        shallow_map=False,
+        stat_result: os.stat_result = None,
     ) -> tuple:
         """gets tuple with map table info from inputs
 
@@ -883,6 +1190,8 @@ class FileMapper:
             log_print (bool, optional): If you want to print. Defaults to False.
             count_print (int | str, optional): If you want to print the count. Defaults to ''.
             shallow_map (bool, optional): Make shallow map (Does not calculate md5). Defaults to False.
+            stat_result (os.stat_result, optional): stat of the file if already known (from scandir).
+            Defaults to None, stats the file once.
         Returns:
             tuple: (dt_data_created,dt_data_modified,dirpath_nm,file,the_md5,the_size,dt_file_c,dt_file_a,dt_file_m)
         """
@@ -896,24 +1205,37 @@ class FileMapper:
             dt_data_modified = dt_data_created
             # join
             joined_file = os.path.join(dirpath, file)
+            # a single stat for size and dates
+            if stat_result is None:
+                stat_result = os.stat(joined_file)
             # size
-            the_size = f_m.get_file_size(joined_file)
+            the_size = stat_result.st_size
+            if not the_size:
+                the_size = -1
+            # md5 from the hash cache when the file did not change
+            serial = None
+            if not shallow_map:
+                _, serial = self.find_mount_serial_of_path(dirpath)
+                the_md5 = self.hash_cache.get(serial, stat_result, "md5")
             # md5 calculate
-            if the_size > 349175808 and log_print and not shallow_map:  # 333*1024*1024=349175808
-                str_size = f_m.get_size_str_formatted(the_size)
-                t_est = self.time_seconds_to_hhmmss(
-                    self.estimate_mapping_time_sec(904.29, 16.08, the_size, "MB", "bytes")
-                )
-                print(f"Calculating md5 for {file}...{str_size} Estimating: {t_est}")
-            if the_size > 50 * 1024 * 1024:  # leave to calculate with the thread
-                the_md5 = self.calculate_md5(joined_file, True, shallow_map)
-            else:
-                the_md5 = self.calculate_md5(joined_file, False, shallow_map)
+            if not the_md5:
+                if the_size > 349175808 and log_print and not shallow_map:  # 333*1024*1024=349175808
+                    str_size = f_m.get_size_str_formatted(the_size)
+                    t_est = self.time_seconds_to_hhmmss(
+                        self.estimate_mapping_time_sec(904.29, 16.08, the_size, "MB", "bytes")
+                    )
+                    print(f"Calculating md5 for {file}...{str_size} Estimating: {t_est}")
+                if the_size > 50 * 1024 * 1024:  # leave to calculate with the thread
+                    the_md5 = self.calculate_md5(joined_file, True, shallow_map)
+                else:
+                    the_md5 = self.calculate_md5(joined_file, False, shallow_map)
+                    if not shallow_map:
+                        self.hash_cache.put(serial, stat_result, {"md5": the_md5})
             dt_data_modified = datetime.now()
             # get file dates
-            dt_file_a = f_m.get_accessed_date(joined_file)
-            dt_file_c = f_m.get_created_date(joined_file)
-            dt_file_m = f_m.get_modified_date(joined_file)
+            dt_file_a = f_m.timestamp_to_datetime(stat_result.st_atime)
+            dt_file_c = f_m.timestamp_to_datetime(stat_result.st_ctime)
+            dt_file_m = f_m.timestamp_to_datetime(stat_result.st_mtime)
             if log_print:
                 str_size = f_m.get_size_str_formatted(the_size, 11)
                 # use () not [] because rich looks for commands inside []
@@ -923,7 +1245,7 @@ class FileMapper:
         except (FileExistsError, PermissionError, FileNotFoundError, NotADirectoryError, TypeError, OSError) as eee:
             print(f"{mount}{dirpath}{file} Error: {eee}")
             if not the_md5:
-                the_md5 = "::UNKNOWN::"
+                the_md5 = HASH_UNKNOWN
             if not the_size:
                 the_size = -1
             if not dt_file_c:
@@ -948,70 +1270,178 @@ class FileMapper:
 
         return (dt_data_created, dt_data_modified, dirpath_nm, file, the_md5, the_size, dt_file_c, dt_file_a, dt_file_m)
 
-    def get_repeated_files(self, db: SQLiteDatabase, table_name) -> dict[list]:
-        """Gets repeated files in map
+    def hash_duplicate_candidates(self, table_name: str, log_print: bool = True, sample_size: int = SAMPLE_SIZE) -> int:
+        """Calculates the md5 only of the files that can have duplicates, in tiers:
+            1. files sharing the exact size with a file without md5 are candidates.
+            2. the head and tail of the candidates are hashed, files with a unique sample are discarded.
+            3. the files whose samples collide are fully hashed and the md5 is written in the map.
+        Files with a unique size or sample keep their '***Shallow***'/'***Calculate***' md5.
 
         Args:
-            db (SQLiteDatabase): database
-            table_name (_type_): table
+            table_name (str): map
+            log_print (bool, optional): print information. Defaults to True.
+            sample_size (int, optional): bytes hashed at head and tail. Defaults to SAMPLE_SIZE.
 
         Returns:
-            dict[list]: repeated file ids
-                        md5sum:[id of files repeated]
+            int: number of md5 written in the map
         """
-        return self.get_repeated_file_multiple_db_tables([db], [table_name], ["id", "md5"], 1)
+        mount, mount_active, mappath_exists = self.check_if_map_device_active(self.db, table_name, False)
+        if not (mount_active and mappath_exists):
+            if log_print:
+                print(f"[yellow]Device of {table_name} is not active, using the md5 in the map")
+            return 0
+        t_q = self.db.quotes(table_name)
+        no_md5 = f"({self.db.quotes(MD5_CALC)}, {self.db.quotes(MD5_SHALLOW)})"
+        # Tier 1: sizes shared by more than one file where at least one file has no md5
+        candidates = self.db.get_data_sql_command(
+            f"SELECT id, filepath, filename, size, md5 FROM {t_q} WHERE size > 0 AND size IN "
+            f"(SELECT size FROM {t_q} WHERE size > 0 GROUP BY size HAVING COUNT(*) > 1 "
+            f"AND SUM(md5 IN {no_md5}) > 0) ORDER BY size"
+        )
+        if len(candidates) == 0:
+            return 0
+
+        def file_of(row):
+            """full path of a map row"""
+            return os.path.join(mount, row[1], row[2])
+
+        def sample_of(row):
+            """sample hash of a map row"""
+            return HashEngine.get_thread_engine("md5").hash_file_sample(file_of(row), sample_size)
+
+        _, serial = self.find_mount_serial_of_path(mount)
+
+        def full_of(row):
+            """md5 of a map row, from the hash cache if the file did not change"""
+            stat_result = FileScanner.stat_file(mount, os.path.join(row[1], row[2]))
+            the_md5 = self.hash_cache.get(serial, stat_result, "md5")
+            if not the_md5:
+                the_md5 = HashEngine.calculate(file_of(row), "md5")
+                self.hash_cache.put(serial, stat_result, {"md5": the_md5})
+            return the_md5
+
+        id_md5_list = []
+        with Progress() as progress:
+            task1 = progress.add_task("[blue]Hashing duplicate candidates", total=len(candidates))
+            with concurrent.futures.ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+                # Tier 2: head+tail samples, small files are completely hashed by the sample
+                sample_list = []
+                for row, sample in zip(candidates, executor.map(sample_of, candidates)):
+                    sample_list.append(sample)
+                    progress.advance(task1)
+                groups = {}
+                for row, sample in zip(candidates, sample_list):
+                    if HashEngine.is_hash_error(sample):
+                        continue
+                    groups.setdefault((row[3], sample), []).append(row)
+                # Tier 3: full md5 for files without md5 whose samples collide
+                to_hash = []
+                for (size, sample), rows in groups.items():
+                    if len(rows) < 2:
+                        continue
+                    for row in rows:
+                        if row[4] in [MD5_CALC, MD5_SHALLOW]:
+                            if size <= 2 * sample_size:
+                                id_md5_list.append((row[0], sample))  # sample is the full md5
+                            else:
+                                to_hash.append(row)
+                task2 = progress.add_task("[blue]Hashing colliding samples", total=len(to_hash))
+                for row, the_md5 in zip(to_hash, executor.map(full_of, to_hash)):
+                    id_md5_list.append((row[0], the_md5))
+                    progress.advance(task2)
+        self.hash_cache.flush()
+        if len(id_md5_list) > 0:
+            self.db.edit_values_in_table(table_name, "md5", id_md5_list)
+        if log_print:
+            print(f"Candidates: {len(candidates)} same size, {len(id_md5_list)} md5 calculated")
+        return len(id_md5_list)
 
     @staticmethod
-    def get_repeated_file_multiple_db_tables(
-        db_list: list[SQLiteDatabase], table_name_list: list, column_list: list = None, order_by=1
-    ) -> dict[list]:
-        """Gets repeated files in multiple maps. Maps can be is same or different db.
+    def iter_repeated_across_maps(db_list: list[SQLiteDatabase], table_name_list: list, across_maps: bool = True):
+        """Streams the files with the same md5 in multiple maps, maps can be in the same or different db.
+        The other databases are attached to a read only connection of the first one, and the repeats are found
+        with one UNION ALL + GROUP BY query, so the maps are not loaded in memory.
+        SQLite attaches up to 10 databases by default.
 
         Args:
             db_list (list[SQLiteDatabase]): database list (same length as table_name_list)
-            table_name_list (list): list of tables (all tables must contain the columns in colunm_list)
-            column_list (list): columns in tables, default None -> ['id','md5']
-            order_by (int): 0 indexed column to be used. Default 1 -> 'md5'
+            table_name_list (list): list of maps
+            across_maps (bool, optional): only md5 present in more than one map, else also repeats inside a map.
+            Defaults to True.
 
-        Returns:
-            dict[list]: {(ordered column name):(list of other columns repeated)..}
-            repeated file ids
-            default:  md5sum:[id of files repeated]
+        Yields:
+            tuple: (md5, [(index of the (db, map) pair, id), ...])
         """
-        if not column_list:
-            column_list = ["id", "md5"]
-        repeated = {}
+        if len(db_list) == 0 or len(db_list) != len(table_name_list):
+            return
+        a_reader = db_list[0].reader()
+        map_layout = MapLayout(a_reader)
+        schemas = {}
+        attached = []
         try:
-            data_list = []
-            cols = str(column_list).replace("[", "").replace("'", "").replace("]", "")
+            selects = []
+            # partitioned maps of the first database: {map_id: pair}, read together from their shared table
+            partition_pairs = {}
             for index, (db, table_name) in enumerate(zip(db_list, table_name_list)):
-                data = db.get_data_sql_command(
-                    f"SELECT {cols} FROM {db.quotes(table_name)} ORDER BY {column_list[order_by]}"
+                db_key = os.path.normcase(os.path.abspath(db.db_path))
+                if len(schemas) == 0 or schemas.get(db_key) == "main":
+                    map_id = map_layout.get_map_id(table_name)
+                    if map_id is not None and map_id not in partition_pairs:
+                        schemas[db_key] = "main"
+                        partition_pairs[map_id] = index
+                        continue
+                if db_key not in schemas:
+                    if len(schemas) == 0:
+                        schemas[db_key] = "main"
+                    else:
+                        schema = f"map_db_{len(schemas)}"
+                        if not a_reader.attach_database(db.db_path, schema):
+                            return
+                        schemas[db_key] = schema
+                        attached.append(schema)
+                selects.append(
+                    f"SELECT {index} AS pair, id, md5 FROM {a_reader.quotes(schemas[db_key])}.{a_reader.quotes(table_name)}"
+                )
+            if len(partition_pairs) > 0:
+                selects.append(map_layout.get_partition_md5_select(partition_pairs))
+            no_md5 = ", ".join(a_reader.quotes(a_md5) for a_md5 in MD5_NO_HASH)
+            having = "COUNT(DISTINCT pair) > 1" if across_maps else "COUNT(*) > 1"
+            c = a_reader.conn.cursor()
+            try:
+                c.execute(
+                    f"SELECT md5, group_concat(pair || ':' || id) FROM ({' UNION ALL '.join(selects)}) "
+                    f"WHERE md5 NOT IN ({no_md5}) GROUP BY md5 HAVING {having}"
                 )
-                for ddd in data:
-                    data_list.append((index,) + ddd)  # add [db,table] index to tuple
+                for a_md5, pair_ids in c:
+                    pair_id_list = []
+                    for pair_id in pair_ids.split(","):
+                        pair, an_id = pair_id.split(":")
+                        pair_id_list.append((int(pair), int(an_id)))
+                    yield a_md5, pair_id_list
+            finally:
+                c.close()
+        except sqlite3.Error as eee:
+            print(f"Error: {eee}")
+        finally:
+            for schema in attached:
+                a_reader.detach_database(schema)
 
-            iii = 0
-            last_anmd5 = None
-            last_an_id = None
-            last_db = None
-            for dbtable, an_id, anmd5 in data_list:
-                if last_anmd5 == anmd5:
-                    if anmd5 in repeated:
-                        rep_list = repeated[anmd5]
-                        if isinstance(rep_list, list):
-                            rep_list.append((dbtable, an_id))
-                            repeated.update({anmd5: rep_list})
-                    else:
-                        repeated.update({anmd5: [(last_db, last_an_id), (dbtable, an_id)]})
-                last_anmd5 = anmd5
-                last_an_id = an_id
-                last_db = dbtable
-                iii = iii + 1
-        except Exception as e:
-            print(f"Error: {e}")
-            # db.close_connection()
-        return repeated
+    @staticmethod
+    def get_repeated_file_multiple_db_tables(
+        db_list: list[SQLiteDatabase], table_name_list: list, across_maps: bool = False
+    ) -> dict[list]:
+        """Gets repeated files in multiple maps. Maps can be is same or different db.
+
+        Args:
+            db_list (list[SQLiteDatabase]): database list (same length as table_name_list)
+            table_name_list (list): list of tables
+            across_maps (bool, optional): only md5 present in more than one map. Defaults to False.
+
+        Returns:
+            dict[list]: repeated file ids
+            md5sum:[(index of [db,table], id of files repeated)]
+        """
+        return dict(FileMapper.iter_repeated_across_maps(db_list, table_name_list, across_maps))
 
     def validate_new_map_name(self, new_table_name: str):
         """Check if New table name is Correct"""
@@ -1090,12 +1520,15 @@ class FileMapper:
                 return False
 
             # Rename table
-            self.db.send_sql_command(f"ALTER TABLE '{table_name}' RENAME TO '{new_table_name}'")
+            self.map_layout.rename_map(table_name, new_table_name)
             time.sleep(0.1)
             if self.db.table_exists(new_table_name):
                 print(f"Editing table {table_name}")
                 self.db.edit_value_in_table(self.mapper_reference_table, an_id, "dt_map_modified", datetime.now())
                 self.db.edit_value_in_table(self.mapper_reference_table, an_id, "tablename", new_table_name)
+                self.directory_index.rename(table_name, new_table_name)
+                # index names follow the map name
+                self.rename_map_indexes(table_name, new_table_name)
             old_ref = self.db.get_data_from_table(self.mapper_reference_table, "*", f"tablename='{table_name}'")
             new_ref = self.db.get_data_from_table(self.mapper_reference_table, "*", f"tablename='{new_table_name}'")
             if len(old_ref) == 0 and len(new_ref) == 1:
@@ -1186,6 +1619,211 @@ class FileMapper:
                 tablename_list.append(getattr(dbr, attr))
         return tablename_list
 
+    @staticmethod
+    def stat_signature(the_size, dt_file_created, dt_file_modified) -> tuple:
+        """Signature of a file to know if it changed since it was mapped.
+        Map rows have no inode, the creation date of the map (st_ctime) changes when the inode changes.
+
+        Args:
+            the_size (float|int|str): size as stored in the map
+            dt_file_created (datetime|str): st_ctime date as stored in the map
+            dt_file_modified (datetime|str): st_mtime date as stored in the map
+
+        Returns:
+            tuple: (size, created, modified) comparable between disk and map rows
+        """
+        try:
+            the_size = float(the_size)
+        except (TypeError, ValueError):
+            the_size = -1.0
+        return (the_size, str(dt_file_created), str(dt_file_modified))
+
+    def get_directory_records(self, mount: str, scanner: FileScanner, kept_records: dict = None) -> dict:
+        """Directory records of a scan without mount, to save in the directory index
+
+        Args:
+            mount (str): the mount
+            scanner (FileScanner): scanner after scanning
+            kept_records (dict, optional): records taken from the previous map state. Defaults to None.
+
+        Returns:
+            dict: {dirpath: (parent, mtime_ns, entries)}
+        """
+        records = {}
+        if kept_records:
+            records.update(kept_records)
+        for dirpath, parent, mtime_ns, entries in scanner.dir_records:
+            if parent is not None:
+                parent = self.remove_mount_from_path(mount, parent)
+            records[self.remove_mount_from_path(mount, dirpath)] = (parent, mtime_ns, entries)
+        return records
+
+    def get_map_deltas(
+        self, table_name: str, mount: str, path_to_map: str, log_print: bool = True, trust_dir_mtimes: bool = False
+    ) -> dict:
+        """Compares the files on disk with the rows of a map, streaming the scan of the path.
+        Only the (id, path, signature) of the stored rows are kept in memory.
+
+        Args:
+            table_name (str): map table
+            mount (str): the mount of the map
+            path_to_map (str): path of the map with mount
+            log_print (bool, optional): print progress. Defaults to True.
+            trust_dir_mtimes (bool, optional): directories with the same mtime and number of entries as in the
+            directory index are not listed, their rows are kept as they are. Files changed in place inside them
+            are not detected. Defaults to False.
+
+        Returns:
+            dict: {"+": new rows, "~": [(id, row)] changed rows, "-": ids of removed files,
+            "dirs": directory records} rows as in get_mapping_info_data_from_file.
+        """
+        stored = {}
+        files_in_dir = {}
+        try:
+            c = self.db.conn.cursor()
+            c.execute(
+                f"SELECT id, filepath, filename, size, dt_file_created, dt_file_modified FROM {self.db.quotes(table_name)}"
+            )
+            for an_id, filepath, filename, the_size, dt_c, dt_m in c:
+                stored[(filepath, filename)] = (an_id, self.stat_signature(the_size, dt_c, dt_m))
+                files_in_dir.setdefault(filepath, []).append(filename)
+            c.close()
+        except sqlite3.Error as eee:
+            print(eee)
+            return {"+": [], "~": [], "-": [], "dirs": {}}
+        _, serial = self.find_mount_serial_of_path(path_to_map)
+        deltas = {"+": [], "~": [], "-": [], "dirs": {}}
+        dir_records = self.directory_index.load(table_name)
+        dir_children = self.directory_index.children_of(dir_records)
+        kept_records = {}
+
+        def prune_function(dirpath):
+            """subdirectories of an unchanged directory, None to list it"""
+            rel_dirpath = self.remove_mount_from_path(mount, dirpath)
+            record = dir_records.get(rel_dirpath)
+            if record is None:
+                return None
+            try:
+                if os.stat(dirpath).st_mtime_ns != record[1]:
+                    return None
+            except OSError:
+                return None
+            children = dir_children.get(rel_dirpath, [])
+            files = files_in_dir.get(rel_dirpath, [])
+            # the previous map state must hold every entry listed then
+            if record[2] != len(children) + len(files):
+                return None
+            for filename in files:
+                stored.pop((rel_dirpath, filename), None)
+            kept_records[rel_dirpath] = record
+            return [os.path.join(mount, child) for child in children]
+
+        scanner = FileScanner(log_print=log_print)
+        with Progress() as progress:
+            task1 = progress.add_task(f"[blue]Comparing {table_name}", total=None)
+            a_scan = scanner.scan(path_to_map, prune_function if trust_dir_mtimes else None)
+            for count, (dirpath, file, stat_result) in enumerate(a_scan):
+                # md5 is left to the thread, rows are built without reading the files
+                row = self.get_mapping_info_data_from_file(mount, dirpath, file, False, "", True, stat_result)
+                an_id, signature = stored.pop((row[2], row[3]), (None, None))
+                if an_id is not None and signature == self.stat_signature(row[5], row[6], row[8]):
+                    continue
+                the_md5 = self.hash_cache.get(serial, stat_result, "md5") or MD5_CALC
+                row = row[:4] + (the_md5,) + row[5:]
+                if an_id is None:
+                    deltas["+"].append(row)
+                else:
+                    deltas["~"].append((an_id, row))
+                if count % DATA_WRITE_BATCH == 0:
+                    progress.update(task1, total=scanner.files_found, completed=scanner.files_scanned)
+            progress.update(task1, total=scanner.files_found, completed=scanner.files_found)
+        deltas["-"] = [an_id for an_id, _ in stored.values()]
+        deltas["dirs"] = self.get_directory_records(mount, scanner, kept_records)
+        if log_print and trust_dir_mtimes:
+            print(f"{len(kept_records)} unchanged directories were not listed")
+        return deltas
+
+    def apply_map_deltas(self, table_name: str, deltas: dict) -> bool:
+        """Applies the deltas of get_map_deltas in a single transaction, ids of unchanged files are kept.
+        Safety hashes of changed files are cleared to be calculated again.
+
+        Args:
+            table_name (str): map table
+            deltas (dict): {"+": new rows, "~": [(id, row)] changed rows, "-": ids of removed files,
+            "dirs": directory records}
+
+        Returns:
+            bool: True if applied
+        """
+        column_list = self.db.get_column_list_of_table(table_name)
+        map_columns = [
+            "dt_data_created",
+            "dt_data_modified",
+            "filepath",
+            "filename",
+            "md5",
+            "size",
+            "dt_file_created",
+            "dt_file_accessed",
+            "dt_file_modified",
+        ]
+        # changed files: new stat values, safety hashes cleared
+        hash_columns = [column for column in ["sha1", "sha256"] if column in column_list]
+        update_columns = map_columns[1:2] + map_columns[4:] + hash_columns
+        id_value_list = [
+            (an_id, (row[1],) + tuple(row[4:]) + (None,) * len(hash_columns)) for an_id, row in deltas["~"]
+        ]
+        try:
+            with self.db.transaction():
+                self.db.delete_rows(table_name, deltas["-"])
+                self.db.edit_values_in_table(table_name, update_columns, id_value_list)
+                self.db.insert_rows(table_name, deltas["+"], map_columns)
+        except sqlite3.Error as eee:
+            print(f"[red]Map {table_name} not updated: {eee}")
+            return False
+        # only when the rows are updated, or unchanged directories would hide the changes not applied
+        self.directory_index.save(table_name, deltas["dirs"])
+        return True
+
+    def update_map_incremental(
+        self, table_name: str, log_print: bool = True, confirm=None, trust_dir_mtimes: bool = False
+    ) -> dict:
+        """Updates a device map with the changes on disk, without remapping unchanged files.
+
+        Args:
+            table_name (str): map table
+            log_print (bool, optional): print progress. Defaults to True.
+            confirm (callable, optional): confirm(deltas)->bool called before applying the deltas. Defaults to None.
+            trust_dir_mtimes (bool, optional): skip listing unchanged directories, see get_map_deltas.
+            Defaults to False.
+
+        Returns:
+            dict: applied deltas as in get_map_deltas, None if the device is not active or not applied.
+        """
+        mount, mount_active, mappath_exists = self.check_if_map_device_active(self.db, table_name, False)
+        if not mount_active or not mappath_exists:
+            return None
+        info = self.db.get_data_from_table(
+            self.mapper_reference_table, "id, mappath", f"tablename={self.db.quotes(table_name)}"
+        )
+        if len(info) == 0:
+            return None
+        deltas = self.get_map_deltas(
+            table_name, mount, os.path.join(mount, info[0][1]), log_print, trust_dir_mtimes
+        )
+        if log_print:
+            print(f"{table_name}: {len(deltas['+'])} new, {len(deltas['~'])} changed, {len(deltas['-'])} removed files")
+        if len(deltas["+"]) + len(deltas["~"]) + len(deltas["-"]) == 0:
+            self.directory_index.save(table_name, deltas["dirs"])
+            return deltas
+        if confirm is not None and not confirm(deltas):
+            return None
+        if not self.apply_map_deltas(table_name, deltas):
+            return None
+        self.hash_cache.flush()
+        self.db.edit_value_in_table(self.mapper_reference_table, info[0][0], "dt_map_modified", datetime.now())
+        return deltas
+
     def delete_map(self, table_name,log_print=True):
         """Removes a map from index and its referenced table from db.
 
@@ -1208,9 +1846,9 @@ class FileMapper:
                         print(f"{table_name} reference was deleted!!")
                 else:
                     print(f"{table_name} Not found in reference!")
+            self.directory_index.delete(table_name)
             if self.db.table_exists(table_name):
-                self.db.delete_data_from_table(table_name, None)  # remove all data
-                self.db.delete_table_from_db(table_name,log_print)
+                self.map_layout.drop_map(table_name,log_print)
                 if log_print:
                     print(f"{table_name} was deleted!!")
 
@@ -1397,7 +2035,7 @@ class FileMapper:
     def find_duplicates(self, tablename):
         """Returns a list of tuple with the dictionaries of file information of each repeated file.
         Duplicates are the files in the same folder,with different file names but with the same md5 sum.
-        Excludes Repeated (different folder).
+        Excludes Repeated (different folder). Only files that can be duplicates are hashed when the map has no md5.
 
         Args:
             tablename (str): table in database
@@ -1406,19 +2044,14 @@ class FileMapper:
             list: list of tuples, each dictionary in the tuple contains the duplicate files
             [({Dupfileinfo1},{Dupfileinfo2}..{DupfileinfoN}), ...({DupfileinfoX1},{DupfileinfoX2}..{DupfileinfoXN})]
         """
-        repeated_dict = self.get_repeated_files(self.db, tablename)
-        item_list = ["filepath", "filename"]  # ,'id', 'md5', 'size' ]
-        match_list = [
-            True,
-            False,
-        ]  # , False, True, True] same md5 implicit in repeated : if same md5-> same size, id is always different
-        # return self.find_matching_data(repeated_dict,tablename,item_list,match_list)
-        return self.find_matching_dbresult(repeated_dict, tablename, item_list, match_list)
+        self.index_map(tablename)
+        self.hash_duplicate_candidates(tablename)
+        return self.collect_match_groups(tablename, "duplicates")
 
     def find_repeated(self, tablename):
         """Returns a list of tuple with the dictionaries of file information of each repeated file.
         Repeated are files with the same md5 sum, in different folders within the map.
-        Excludes Duplicates (same folder).
+        Excludes Duplicates (same folder). Only files that can be repeated are hashed when the map has no md5.
 
          Args:
              tablename (str): table in database
@@ -1427,195 +2060,99 @@ class FileMapper:
              list: list of tuples, each dictionary in the tuple contains the repeat files
              [({Repfileinfo1},{Repfileinfo2}..{RepfileinfoN}), ...({RepfileinfoX1},{RepfileinfoX2}..{RepfileinfoXN})]
         """
-        repeated_dict = self.get_repeated_files(self.db, tablename)
+        self.index_map(tablename)
+        self.hash_duplicate_candidates(tablename)
+        return self.collect_match_groups(tablename, "repeated")
+
+    def get_match_groups_sql(self, table_name: str, match_type: str) -> str:
+        """Query returning the rows of the duplicate or repeated groups ordered by group, in one pass.
+        The first column is the group key, the rest are the map columns.
+            duplicates: same md5 and same filepath, the group key is md5 + filepath.
+            repeated: same md5 in more than one filepath, one file per filepath (lowest id), the group key is md5.
+
+        Args:
+            table_name (str): map
+            match_type (str): one of MATCH_TYPES
+
+        Returns:
+            str: sql query
+        """
+        if match_type not in MATCH_TYPES:
+            raise ValueError(f"Match type {match_type} not in {MATCH_TYPES}")
+        t_q = self.db.quotes(table_name)
+        no_md5 = ", ".join(self.db.quotes(a_md5) for a_md5 in MD5_NO_HASH)
+        if match_type == "duplicates":
+            return (
+                f"SELECT * FROM (SELECT md5 || '/' || filepath AS group_key, "
+                "COUNT(*) OVER (PARTITION BY md5, filepath) AS group_count, t.* "
+                f"FROM {t_q} AS t WHERE md5 NOT IN ({no_md5})) "
+                "WHERE group_count > 1 ORDER BY group_key, filename, id"
+            )
+        return (
+            "SELECT * FROM (SELECT md5 AS group_key, "
+            "ROW_NUMBER() OVER (PARTITION BY md5, filepath ORDER BY id) AS folder_row, t.* "
+            f"FROM {t_q} AS t WHERE md5 IN (SELECT md5 FROM {t_q} WHERE md5 NOT IN ({no_md5}) "
+            "GROUP BY md5 HAVING COUNT(DISTINCT filepath) > 1)) "
+            "WHERE folder_row = 1 ORDER BY group_key, filepath, filename"
+        )
 
-        item_list = ["filename", "filepath"]  # ,'id', 'md5', 'size']
-        match_list = [False, False]  # , False, True, True]
-        # return self.find_matching_data(repeated_dict,tablename,item_list,match_list)
-        return self.find_matching_dbresult(repeated_dict, tablename, item_list, match_list)
+    def iter_match_groups(self, table_name: str, match_type: str):
+        """Streams the duplicate or repeated groups of a map from a single query on a read only connection.
 
-    def find_matching_dbresult(self, repeated_dict: dict, table_name: str, item_list: list, match_list: list):
-        """Finds matching item and match items in a database
+        Args:
+            table_name (str): map
+            match_type (str): one of MATCH_TYPES
+
+        Yields:
+            tuple[dict]: files of a group, {column name: value} for each file
+        """
+        c = self.db.reader().conn.cursor()
+        try:
+            c.execute(self.get_match_groups_sql(table_name, match_type))
+            columns = [item[0] for item in c.description]
+            last_key = None
+            group = ()
+            for row in c:
+                if row[0] != last_key and len(group) > 0:
+                    yield group
+                    group = ()
+                last_key = row[0]
+                group = group + (dict(zip(columns[2:], row[2:])),)
+            if len(group) > 1:
+                yield group
+        except sqlite3.Error as eee:
+            print(f"Error: {eee}")
+        finally:
+            c.close()
+
+    def collect_match_groups(self, table_name: str, match_type: str) -> list:
+        """Gathers the groups of iter_match_groups for the selection menus, can be cancelled.
 
         Args:
-            repeated_dict (dict): repeated dictionary
-            dbresult_list (list): list of databases
-            item_list (list[str]): list of items to compare
-            match_list (list[bool]): comparison criteria match
+            table_name (str): map
+            match_type (str): one of MATCH_TYPES
 
         Returns:
             list: list of tuples, each dictionary in the tuple contains the matching files
-            [({Matfileinfo1},{Matfileinfo2}..{MatfileinfoN}), ...({MatfileinfoX1},{MatfileinfoX2}..{MatfileinfoXN})]
         """
-        a_key = None
-        db_result = DBResult(self.db.describe_table_in_db(table_name))
         repeat_list = []
         try:
             with Progress() as progress:
                 exit_key = "ctrl+c"
                 if os.name == "nt":
                     exit_key = "F12"
-                total_count = len(repeated_dict)
-                task1 = progress.add_task(f"[blue]Calculating Match [red]({exit_key} to Exit)", total=total_count)
-                for count_processed, (a_key, db_id_tup_list) in enumerate(repeated_dict.items()):
-                    msg1 = f"{count_processed+1}/{total_count} found {len(repeat_list)}"
-                    msg2 = f" looking at {a_key}={repeated_dict[a_key]}"
-                    print(f"{msg1}{msg2}")
-                    data_same_md5 = []
-                    if len(db_id_tup_list) <= SINGLE_MULTIPLE_SEARCH:
-                        for db_id_tup in db_id_tup_list:
-                            data_same_md5 = data_same_md5 + self.db.get_data_from_table(
-                                table_name, "*", f"id={db_id_tup[1]}"
-                            )
-                    else:
-                        data_same_md5 = self.db.get_data_from_table(
-                            table_name, "*", f"md5={self.db.quotes(a_key)}"
-                        )  # makes a search in all db -> slow if few, fast if many
-                    db_result.clear_values()
-                    if raw_key_pressed("\xe0\x86"):  # F12
+                task1 = progress.add_task(f"[blue]Finding {match_type} [red]({exit_key} to Exit)", total=None)
+                for group in self.iter_match_groups(table_name, match_type):
+                    repeat_list.append(group)
+                    progress.update(task1, description=f"[blue]Found {len(repeat_list)} {match_type} [red]({exit_key} to Exit)")
+                    if len(repeat_list) % DATA_ADVANCE == 0 and raw_key_pressed("\xe0\x86"):  # F12
                         raise KeyboardInterrupt("User Cancel")
-                    if len(data_same_md5) > 0:
-                        db_result.set_values(data_same_md5)
-                        for iii, _ in enumerate(data_same_md5):
-                            comp_dict = {}
-                            if iii == 0:
-                                node_1 = db_result.dbr[iii]  # Node object
-                                repeat_node = None
-                            else:
-                                node_2 = db_result.dbr[iii]  # Node object
-                                comp_dict = db_result.compare_nodes(node_1, node_2, "==")
-
-                                repeat_file = True
-                                for aaa, bbb in zip(item_list, match_list):
-                                    if bbb != comp_dict[aaa]:
-                                        repeat_file = False
-                                        break
-                                if repeat_file:
-                                    if not repeat_node:
-                                        repeat_node = (node_1.to_dict(), node_2.to_dict())
-                                    else:
-                                        repeat_node = repeat_node + (node_2.to_dict(),)
-                            if repeat_node:
-                                repeat_list.append(repeat_node)
-                    progress.update(task1, completed=count_processed + 1)
-                progress.update(task1, completed=total_count)
         except KeyboardInterrupt:
             print("[magenta]User cancel")
             print("@" * 100, "\nPress any Key to continue\n", "@" * 100)
             getch()
         return repeat_list
 
-    @staticmethod
-    def compare_data_tuple(comp_dict: dict, data1: tuple, data2: tuple) -> bool:
-        for index, result in comp_dict.items():
-            comp = data1[index] == data2[index]
-            if comp != result:
-                return False
-        return True
-
-    def find_matching_data(self, repeated_dict: dict, table_name: str, item_list: list, match_list: list):
-        """Finds matching item and match items in a database
-
-        Args:
-            repeated_dict (dict): repeated dictionary
-            dbresult_list (list): list of databases
-            item_list (list[str]): list of items to compare
-            match_list (list[bool]): comparison criteria match
-
-        Returns:
-            list: list of tuples, each dictionary in the tuple contains the matching files
-            [({Matfileinfo1},{Matfileinfo2}..{MatfileinfoN}), ...({MatfileinfoX1},{MatfileinfoX2}..{MatfileinfoXN})]
-        """
-        a_key = None
-        comp_dict = {}
-        field_list = self.db.get_column_list_of_table(table_name)
-        for item, match in zip(item_list, match_list):
-            for iii, fff in enumerate(field_list):
-                if fff == item:
-                    comp_dict.update({iii: match})
-
-        repeat_list = []
-        with Progress() as progress:
-            exit_key = "F12"
-            if os.name == "nt":
-                exit_key = "F12"
-            total_count = len(repeated_dict)
-            task1 = progress.add_task(f"[blue]Calculating Match [red]({exit_key} to Exit)", total=total_count)
-            for count_processed, (a_key, db_id_tup_list) in enumerate(repeated_dict.items()):
-                msg1 = f"{count_processed+1}/{total_count} found "
-                msg2 = f"{len(repeat_list)} looking at {a_key}={repeated_dict[a_key]}"
-                print(f"{msg1}{msg2}")
-                data_same_md5 = []
-                if len(db_id_tup_list) < 10:
-                    for db_id_tup in db_id_tup_list:
-                        data_same_md5 = data_same_md5 + self.db.get_data_from_table(
-                            table_name, "*", f"id={db_id_tup[1]}"
-                        )
-                else:
-                    data_same_md5 = self.db.get_data_from_table(
-                        table_name, "*", f"md5={self.db.quotes(a_key)}"
-                    )  # makes a search in all db -> slow if few, fast if many
-                if raw_key_pressed("\xe0\x86"):  # F12
-                    return repeat_list
-                if len(data_same_md5) > 0:
-                    repeat_node = self.combinatorial_compare(field_list, comp_dict, data_same_md5)
-                    if repeat_node:
-                        repeat_list.append(repeat_node)
-                progress.update(task1, completed=count_processed + 1)
-            progress.update(task1, completed=total_count)
-        return repeat_list
-
-    def combinatorial_compare(self, field_list: list, comp_dict: dict, d_list: list[tuple]) -> tuple[dict]:
-        """Compares all combinations in list.
-
-        Args:
-            field_list (list): fields of the data in data_list tuples
-            comp_dict (dict): dictionary of comparisons
-            d_list (list[tuple]): list of database data tuples
-
-        Returns:
-            tuple[dict]: if a combination matches the comp_dict criteria, the data is added as dictionary in a tuple
-        """
-        repeat_node = None
-        # if len(d_list)>=2:
-        #     # d_list=data_list.copy()
-        lendlist = len(d_list)
-        total = lendlist
-        iii = 0
-        while lendlist > 1:
-            data1 = d_list.pop(0)
-            if total > 100:
-                A_C.print_cycle(iii, total)
-            for data2 in d_list:
-                if self.compare_data_tuple(comp_dict, data1, data2):
-                    if not repeat_node:
-                        repeat_node = (
-                            self.data_to_field_dict(field_list, data1),
-                            self.data_to_field_dict(field_list, data2),
-                        )
-                    else:
-                        repeat_node = repeat_node + (self.data_to_field_dict(field_list, data2),)
-            lendlist = len(d_list)
-            iii = iii + 1
-        return repeat_node
-
-    @staticmethod
-    def data_to_field_dict(field_list: list, data: tuple) -> dict:
-        """Returns a dictionary with fields and data Data in tuple
-
-        Args:
-            field_list (list): fields of data
-            data (tuple): data in tuple
-
-        Returns:
-            dict: {field:data}
-        """
-        result = {}
-        if len(field_list) == len(data):
-            for field, ddd in zip(field_list, data):
-                result.update({field: ddd})
-        return result
-
     def __del__(self):
         """On deletion close correctly"""
         try:
@@ -1624,9 +2161,10 @@ class FileMapper:
             pass
 
     def close(self):
-        """Close db connection"""
-        if hasattr(self, "is_db_encrypted"):
-            if self.is_db_encrypted:
-                self.db.encrypt_db()
-        if hasattr(self, "db"):
+        """Close db connection, closing again (as on deletion after an explicit close) does nothing"""
+        if getattr(self, "hash_cache", None) is not None:
+            self.hash_cache.close()
+            self.hash_cache = None
+        # encrypted databases are encrypted when the connection is closed, only once
+        if hasattr(self, "db") and self.db.conn is not None:
             self.db.close_connection()
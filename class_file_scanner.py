@@ -0,0 +1,244 @@
+"""
+Single pass file system scanner for mapping
+########################
+# F.garcia
+# creation: 18.10.2026
+########################
+"""
+
+import os
+import queue
+import threading
+
+SCAN_WORKERS = 4  # directory scanning threads for the parallel scan
+QUEUE_PUT_TIMEOUT = 0.5  # seconds to wait on a full queue before checking the kill event
+
+
+class FileScanner:
+    """Walks a path once with os.scandir and yields the stat information of every file found.
+    The number of files and folders found grows while walking, so it can be used as progress total.
+    Every directory listed is kept in dir_records as (dirpath, parent, mtime_ns, entries).
+    """
+
+    def __init__(self, follow_links: bool = False, log_print: bool = False):
+        """Scanner
+
+        Args:
+            follow_links (bool, optional): descend into symbolic links to directories. Defaults to False (as os.walk).
+            log_print (bool, optional): print directories that can not be listed. Defaults to False.
+        """
+        self.follow_links = follow_links
+        self.log_print = log_print
+        self.files_found = 0
+        self.folders_found = 0
+        self.files_scanned = 0
+        self.is_finished = False
+        self.dir_records = []
+        self.dir_parents = {}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Resets the counters"""
+        self.files_found = 0
+        self.folders_found = 0
+        self.files_scanned = 0
+        self.is_finished = False
+        self.dir_records = []
+        self.dir_parents = {}
+
+    def list_directory(self, dirpath: str) -> tuple[list, list]:
+        """Lists one directory with a single scandir call.
+
+        Args:
+            dirpath (str): directory to list
+
+        Returns:
+            tuple[list,list]: (subdirectory paths to descend, file DirEntry list)
+        """
+        dirs = []
+        files = []
+        linked_dirs = 0
+        try:
+            # stat before listing, a change while listing leaves a newer mtime
+            mtime_ns = os.stat(dirpath).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        try:
+            with os.scandir(dirpath) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        # os.walk does not descend into linked directories
+                        if self.follow_links or not entry.is_symlink():
+                            dirs.append(entry.path)
+                        else:
+                            linked_dirs = linked_dirs + 1
+                    else:
+                        files.append(entry)
+        except OSError as eee:
+            if self.log_print:
+                print(f"Could not list {dirpath}: {eee}")
+            mtime_ns = None
+        with self._lock:
+            self.folders_found = self.folders_found + len(dirs) + linked_dirs
+            self.files_found = self.files_found + len(files)
+            for a_dir in dirs:
+                self.dir_parents[a_dir] = dirpath
+            if mtime_ns is not None:
+                # entries are the files and directories mapped, linked directories are not descended
+                self.dir_records.append((dirpath, self.dir_parents.get(dirpath), mtime_ns, len(dirs) + len(files)))
+        return dirs, files
+
+    def scan(self, path: str, prune_function=None):
+        """Generator walking the path top down, the same order as os.walk.
+
+        Args:
+            path (str): path to scan
+            prune_function (callable, optional): prune_function(dirpath) returns None to list the directory,
+            or the list of its subdirectories to descend without listing it (its files are not yielded).
+            Defaults to None.
+
+        Yields:
+            tuple: (dirpath, filename, stat_result) stat_result is None when the file can not be stat.
+        """
+        self.reset()
+        if not os.path.exists(path):
+            self.is_finished = True
+            return
+        self.folders_found = 1  # root
+        stack = [path]
+        while stack:
+            dirpath = stack.pop()
+            if prune_function is not None:
+                known_dirs = prune_function(dirpath)
+                if known_dirs is not None:
+                    with self._lock:
+                        for a_dir in known_dirs:
+                            self.dir_parents[a_dir] = dirpath
+                    stack.extend(reversed(known_dirs))
+                    continue
+            dirs, files = self.list_directory(dirpath)
+            for entry in files:
+                try:
+                    stat_result = entry.stat()
+                except OSError:
+                    stat_result = None
+                self.files_scanned = self.files_scanned + 1
+                yield dirpath, entry.name, stat_result
+            # reversed to keep the listing order when popping
+            stack.extend(reversed(dirs))
+        self.is_finished = True
+
+    def scan_parallel(
+        self,
+        path: str,
+        row_function,
+        row_queue: queue.Queue,
+        workers: int = SCAN_WORKERS,
+        kill_event: threading.Event = None,
+    ):
+        """Scans the path with a pool of worker threads, the tree is split by subdirectory:
+        every directory listed puts its subdirectories back in the work queue for any free worker.
+        Blocks until the whole tree is scanned, run it in a thread to monitor the counters.
+
+        Args:
+            path (str): path to scan
+            row_function (callable): row_function(dirpath, filename, stat_result) returns the row to put in queue
+            row_queue (queue.Queue): bounded queue receiving the rows. None is put when the scan finishes.
+            workers (int, optional): number of scanning threads. Defaults to SCAN_WORKERS.
+            kill_event (threading.Event, optional): stops scanning when set. Defaults to None.
+        """
+        self.reset()
+        if kill_event is None:
+            kill_event = threading.Event()
+        dir_queue = queue.Queue()
+        if os.path.exists(path):
+            self.folders_found = 1  # root
+            dir_queue.put(path)
+
+        def scan_worker():
+            """Lists directories from the work queue until the None sentinel"""
+            while True:
+                dirpath = dir_queue.get()
+                try:
+                    if dirpath is None:
+                        return
+                    if kill_event.is_set():
+                        continue
+                    dirs, files = self.list_directory(dirpath)
+                    for a_dir in dirs:
+                        dir_queue.put(a_dir)
+                    for entry in files:
+                        if kill_event.is_set():
+                            break
+                        try:
+                            stat_result = entry.stat()
+                        except OSError:
+                            stat_result = None
+                        if not self.put_in_queue(row_queue, row_function(dirpath, entry.name, stat_result), kill_event):
+                            break
+                        with self._lock:
+                            self.files_scanned = self.files_scanned + 1
+                except Exception as eee:  # pylint: disable=broad-exception-caught
+                    print(f"Scanning error in {dirpath}: {eee}")
+                finally:
+                    dir_queue.task_done()
+
+        thread_list = []
+        for iii in range(max(1, workers)):
+            a_thread = threading.Thread(target=scan_worker, name=f"Scan worker {iii}", daemon=True)
+            a_thread.start()
+            thread_list.append(a_thread)
+        # all directories listed
+        dir_queue.join()
+        for _ in thread_list:
+            dir_queue.put(None)
+        for a_thread in thread_list:
+            a_thread.join()
+        self.is_finished = True
+        self.put_in_queue(row_queue, None, kill_event, True)
+
+    @staticmethod
+    def put_in_queue(a_queue: queue.Queue, item, kill_event: threading.Event, force: bool = False) -> bool:
+        """Puts an item in a bounded queue, waiting while full unless kill_event is set.
+
+        Args:
+            a_queue (queue.Queue): queue
+            item (any): item to put
+            kill_event (threading.Event): event to stop waiting
+            force (bool, optional): keep waiting even if kill_event is set. Defaults to False.
+
+        Returns:
+            bool: True if the item was put in queue
+        """
+        while force or not kill_event.is_set():
+            try:
+                a_queue.put(item, timeout=QUEUE_PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                if force and kill_event.is_set():
+                    # nobody is consuming anymore, drop the oldest item
+                    try:
+                        a_queue.get_nowait()
+                    except queue.Empty:
+                        pass
+        return False
+
+    @staticmethod
+    def stat_file(dirpath: str, file: str):
+        """Stat of a single file
+
+        Args:
+            dirpath (str): path
+            file (str): file name
+
+        Returns:
+            os.stat_result: stat or None if not accessible
+        """
+        try:
+            return os.stat(os.path.join(dirpath, file))
+        except OSError:
+            return None
@@ -0,0 +1,227 @@
+"""
+Persistent cache of file hashes
+########################
+# F.garcia
+# creation: 18.10.2026
+########################
+"""
+
+import os
+import time
+import threading
+import sqlite3
+
+from class_sqlite_database import SQLiteDatabase
+from class_hash_engine import HASH_ALGORITHMS, HashEngine
+
+HASH_CACHE_TABLE = "__File_Mapper_Hash_Cache__"
+HASH_CACHE_MAX_ENTRIES = 5000000  # least recently used entries are evicted above this number
+HASH_CACHE_MAX_AGE_DAYS = 365  # entries not used in this time are evicted
+HASH_CACHE_FLUSH = 1000  # pending entries written in one commit
+
+
+class HashCache:
+    """Cache of hashes keyed by (device serial, inode, size, mtime_ns).
+    A file with the same key on the same device has not changed, so its hash can be reused without reading it.
+    """
+
+    def __init__(
+        self,
+        db: SQLiteDatabase,
+        max_entries: int = HASH_CACHE_MAX_ENTRIES,
+        max_age_days: float = HASH_CACHE_MAX_AGE_DAYS,
+    ):
+        """Hash cache stored in a table of the database
+
+        Args:
+            db (SQLiteDatabase): database holding the cache table, can be the map database or a sidecar database
+            max_entries (int, optional): maximum entries kept. Defaults to HASH_CACHE_MAX_ENTRIES.
+            max_age_days (float, optional): maximum days without use. Defaults to HASH_CACHE_MAX_AGE_DAYS.
+        """
+        self.db = db
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.pending = {}
+        self.pending_touch = set()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+        self.create_cache_table()
+
+    def create_cache_table(self):
+        """Creates the cache table and its unique key index if not existing"""
+        if self.db.table_exists(HASH_CACHE_TABLE):
+            return
+        self.db.create_table(
+            HASH_CACHE_TABLE,
+            [
+                ("serial", "TEXT", True),
+                ("inode", "INTEGER", True),
+                ("size", "INTEGER", True),
+                ("mtime_ns", "INTEGER", True),
+                ("md5", "TEXT", False),
+                ("sha1", "TEXT", False),
+                ("sha256", "TEXT", False),
+                ("last_used", "INTEGER", True),
+            ],
+        )
+        self.db.send_sql_command(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {self.db.quotes(HASH_CACHE_TABLE + '_key')} "
+            f"ON {self.db.quotes(HASH_CACHE_TABLE)} (serial, inode, size, mtime_ns)"
+        )
+
+    @staticmethod
+    def key_of(serial: str, stat_result: os.stat_result):
+        """Cache key of a file
+
+        Args:
+            serial (str): device serial
+            stat_result (os.stat_result): stat of the file
+
+        Returns:
+            tuple: (serial, inode, size, mtime_ns) or None if the file can not be identified
+        """
+        if serial in ["", None, "None"] or stat_result is None:
+            return None
+        if not stat_result.st_ino:
+            # scandir on windows does not give the file index
+            return None
+        return (str(serial), stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+
+    def get(self, serial: str, stat_result: os.stat_result, algorithm: str = "md5") -> str:
+        """Cached hash of a file
+
+        Args:
+            serial (str): device serial
+            stat_result (os.stat_result): stat of the file
+            algorithm (str, optional): one of HASH_ALGORITHMS. Defaults to "md5".
+
+        Returns:
+            str: hash or None if not cached
+        """
+        key = self.key_of(serial, stat_result)
+        if key is None or algorithm not in HASH_ALGORITHMS or self.db.conn is None:
+            return None
+        with self._lock:
+            value = self.pending.get(key, {}).get(algorithm)
+            if value is None:
+                # read only connection of the calling thread, the writer cursor is not shared between threads
+                rows = [
+                    row
+                    for chunk in self.db.reader().iter_data_sql_command(
+                        f"SELECT {algorithm} FROM {self.db.quotes(HASH_CACHE_TABLE)} "
+                        "WHERE serial = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+                        key,
+                    )
+                    for row in chunk
+                ]
+                if len(rows) > 0:
+                    value = rows[0][0]
+                    if value is not None:
+                        self.pending_touch.add(key)
+            if value is None:
+                self.misses = self.misses + 1
+            else:
+                self.hits = self.hits + 1
+            return value
+
+    def put(self, serial: str, stat_result: os.stat_result, hash_dict: dict):
+        """Adds the hashes of a file to the cache, errors and keywords are not cached.
+
+        Args:
+            serial (str): device serial
+            stat_result (os.stat_result): stat of the file when it was hashed
+            hash_dict (dict): {algorithm: hash}
+        """
+        key = self.key_of(serial, stat_result)
+        if key is None:
+            return
+        with self._lock:
+            entry = self.pending.setdefault(key, {})
+            for algorithm, value in hash_dict.items():
+                if algorithm in HASH_ALGORITHMS and self.is_cacheable(value):
+                    entry[algorithm] = value
+            if len(entry) == 0:
+                self.pending.pop(key)
+            if len(self.pending) >= HASH_CACHE_FLUSH:
+                self.flush()
+
+    @staticmethod
+    def is_cacheable(value) -> bool:
+        """Only real hexadecimal hashes are cached"""
+        if not isinstance(value, str) or HashEngine.is_hash_error(value):
+            return False
+        return not value.startswith("***")
+
+    def flush(self):
+        """Writes pending entries and last used times in one commit"""
+        with self._lock:
+            if len(self.pending) == 0 and len(self.pending_touch) == 0:
+                return
+            if self.db.conn is None:
+                print("Hash cache error: database closed, pending entries not written")
+                self.pending = {}
+                self.pending_touch = set()
+                return
+            now = int(time.time())
+            t_q = self.db.quotes(HASH_CACHE_TABLE)
+            rows = []
+            for key, entry in self.pending.items():
+                rows.append(key + (entry.get("md5"), entry.get("sha1"), entry.get("sha256"), now))
+            try:
+                with self.db.transaction():
+                    self.write_pending(t_q, rows, now)
+            except sqlite3.Error as eee:
+                print(f"Hash cache error: {eee}")
+            self.pending = {}
+            self.pending_touch = set()
+
+    def write_pending(self, t_q: str, rows: list, now: int):
+        """Upserts the pending entries and touches the last used time of the entries read"""
+        c = self.db.conn.cursor()
+        try:
+            c.executemany(
+                f"INSERT INTO {t_q} (serial, inode, size, mtime_ns, md5, sha1, sha256, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(serial, inode, size, mtime_ns) DO UPDATE SET "
+                "md5 = COALESCE(excluded.md5, md5), sha1 = COALESCE(excluded.sha1, sha1), "
+                "sha256 = COALESCE(excluded.sha256, sha256), last_used = excluded.last_used",
+                rows,
+            )
+            c.executemany(
+                f"UPDATE {t_q} SET last_used = ? WHERE serial = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+                [(now,) + key for key in self.pending_touch],
+            )
+        finally:
+            c.close()
+
+    def evict(self) -> int:
+        """Removes entries older than max_age_days and the least recently used above max_entries.
+
+        Returns:
+            int: entries removed
+        """
+        with self._lock:
+            if self.db.conn is None:
+                return 0
+            self.flush()
+            t_q = self.db.quotes(HASH_CACHE_TABLE)
+            oldest = int(time.time() - self.max_age_days * 24 * 3600)
+            removed = 0
+            try:
+                with self.db.transaction():
+                    removed = self.db.execute_write(f"DELETE FROM {t_q} WHERE last_used < ?", (oldest,))
+                    # with the write lock held no other writer changes the count
+                    excess = self.db.conn.execute(f"SELECT COUNT(*) FROM {t_q}").fetchone()[0] - self.max_entries
+                    if excess > 0:
+                        removed = removed + self.db.execute_write(
+                            f"DELETE FROM {t_q} WHERE id IN (SELECT id FROM {t_q} ORDER BY last_used LIMIT ?)",
+                            (excess,),
+                        )
+            except sqlite3.Error as eee:
+                print(f"Hash cache error: {eee}")
+                removed = 0
+            return removed
+
+    def close(self):
+        """Writes pending entries and evicts old ones"""
+        self.evict()
@@ -0,0 +1,270 @@
+"""
+Hashing functions for mapping and safety checks
+########################
+# F.garcia
+# creation: 18.10.2026
+########################
+"""
+
+import os
+import mmap
+import hashlib
+import threading
+
+HASH_ALGORITHMS = ["md5", "sha1", "sha256"]
+HASH_BLOCK_SIZE = 1024 * 1024  # bytes read at once into the reusable buffer
+MMAP_THRESHOLD = 64 * 1024 * 1024  # files from this size are mapped in memory when reader is "auto"
+READER_TYPES = ["auto", "buffered", "mmap"]
+SAMPLE_SIZE = 64 * 1024  # bytes hashed from the head and from the tail of a file to find duplicate candidates
+# results written in the hash columns when the file can not be read
+HASH_NO_PERMISSION = ":::NoPermission:::"
+HASH_FILE_NOT_FOUND = ":::FileNotFound:::"
+HASH_UNKNOWN = "::UNKNOWN::"
+
+
+class HashEngine:
+    """Reads files block by block and feeds the blocks to hashlib objects.
+    Each engine owns a reusable read buffer, use one engine per thread.
+    """
+
+    _thread_engines = threading.local()
+
+    def __init__(
+        self,
+        algorithm: str = "md5",
+        block_size: int = HASH_BLOCK_SIZE,
+        reader: str = "auto",
+        mmap_threshold: int = MMAP_THRESHOLD,
+        fadvise: bool = True,
+    ):
+        """Hash engine
+
+        Args:
+            algorithm (str, optional): one of HASH_ALGORITHMS. Defaults to "md5".
+            block_size (int, optional): bytes per read. Defaults to HASH_BLOCK_SIZE.
+            reader (str, optional): "buffered" readinto a reusable buffer, "mmap" maps the file in memory,
+            "auto" uses mmap for files bigger than mmap_threshold. Defaults to "auto".
+            mmap_threshold (int, optional): size to use mmap in "auto". Defaults to MMAP_THRESHOLD.
+            fadvise (bool, optional): tell the OS the file is read sequentially (posix only). Defaults to True.
+        """
+        if algorithm not in HASH_ALGORITHMS:
+            raise ValueError(f"Hash algorithm {algorithm} not in {HASH_ALGORITHMS}")
+        if reader not in READER_TYPES:
+            raise ValueError(f"Reader {reader} not in {READER_TYPES}")
+        self.algorithm = algorithm
+        self.block_size = max(4096, int(block_size))
+        self.reader = reader
+        self.mmap_threshold = mmap_threshold
+        self.fadvise = fadvise and hasattr(os, "posix_fadvise")
+        self.buffer = bytearray(self.block_size)
+
+    @classmethod
+    def get_thread_engine(cls, algorithm: str = "md5") -> "HashEngine":
+        """Returns an engine with default settings owned by the calling thread.
+
+        Args:
+            algorithm (str, optional): one of HASH_ALGORITHMS. Defaults to "md5".
+
+        Returns:
+            HashEngine: engine of the thread
+        """
+        engines = getattr(cls._thread_engines, "engines", None)
+        if engines is None:
+            engines = {}
+            cls._thread_engines.engines = engines
+        if algorithm not in engines:
+            engines[algorithm] = cls(algorithm)
+        return engines[algorithm]
+
+    @staticmethod
+    def calculate(file_path: str, algorithm: str = "md5", kill_event: threading.Event = None) -> str:
+        """Calculate the hash of a file with the engine of the calling thread.
+
+        Args:
+            file_path (str): The path to the file for which the hash is calculated.
+            algorithm (str, optional): one of HASH_ALGORITHMS. Defaults to "md5".
+            kill_event (threading.Event, optional): stop reading when set. Defaults to None.
+
+        Returns:
+            str: hexadecimal hash, error sentinel, or None if killed.
+        """
+        return HashEngine.get_thread_engine(algorithm).hash_file(file_path, kill_event)
+
+    @staticmethod
+    def calculate_multi(file_path: str, algorithms: list, kill_event: threading.Event = None) -> dict:
+        """Calculate several hashes of a file reading it only once, with the engine of the calling thread.
+
+        Args:
+            file_path (str): The path to the file for which the hashes are calculated.
+            algorithms (list[str]): algorithms in HASH_ALGORITHMS
+            kill_event (threading.Event, optional): stop reading when set. Defaults to None.
+
+        Returns:
+            dict: {algorithm: hexadecimal hash or error sentinel}, None if killed.
+        """
+        return HashEngine.get_thread_engine().hash_file_multi(file_path, algorithms, kill_event)
+
+    @staticmethod
+    def is_hash_error(value: str) -> bool:
+        """True if value is one of the error sentinels"""
+        return value in [HASH_NO_PERMISSION, HASH_FILE_NOT_FOUND, HASH_UNKNOWN]
+
+    def new_hash(self):
+        """New hashlib object of the engine algorithm"""
+        return hashlib.new(self.algorithm)
+
+    def use_mmap(self, size: int) -> bool:
+        """If the reader maps a file of this size in memory"""
+        if size <= 0:
+            return False  # empty or special files can not be mapped
+        if self.reader == "mmap":
+            return True
+        return self.reader == "auto" and size >= self.mmap_threshold
+
+    def feed_file(self, file_path: str, update_function_list: list, kill_event: threading.Event = None) -> bool:
+        """Streams the file contents block by block to every update function.
+
+        Args:
+            file_path (str): file to read
+            update_function_list (list[callable]): functions receiving each block, as hash_obj.update
+            kill_event (threading.Event, optional): stop reading when set. Defaults to None.
+
+        Raises:
+            OSError: when the file can not be read
+
+        Returns:
+            bool: True if the whole file was read, False if killed.
+        """
+        with open(file_path, "rb", buffering=0) as f:
+            fileno = f.fileno()
+            if self.fadvise:
+                try:
+                    os.posix_fadvise(fileno, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                except OSError:
+                    pass
+            size = os.fstat(fileno).st_size
+            if self.use_mmap(size):
+                return self._feed_mmap(fileno, size, update_function_list, kill_event)
+            return self._feed_buffered(f, update_function_list, kill_event)
+
+    def _feed_buffered(self, f, update_function_list: list, kill_event: threading.Event) -> bool:
+        """Reads into the reusable buffer"""
+        view = memoryview(self.buffer)
+        try:
+            while True:
+                if kill_event is not None and kill_event.is_set():
+                    return False
+                n_read = f.readinto(view)
+                if not n_read:
+                    return True
+                with view[:n_read] as block:
+                    for update_function in update_function_list:
+                        update_function(block)
+        finally:
+            view.release()
+
+    def _feed_mmap(self, fileno: int, size: int, update_function_list: list, kill_event: threading.Event) -> bool:
+        """Reads a memory map of the file"""
+        with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as a_map:
+            if hasattr(a_map, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                a_map.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(a_map) as view:
+                for start in range(0, size, self.block_size):
+                    if kill_event is not None and kill_event.is_set():
+                        return False
+                    with view[start : start + self.block_size] as block:
+                        for update_function in update_function_list:
+                            update_function(block)
+        return True
+
+    def hash_file(self, file_path: str, kill_event: threading.Event = None) -> str:
+        """Calculate the hash of a file.
+
+        Args:
+            file_path (str): The path to the file for which the hash is calculated.
+            kill_event (threading.Event, optional): stop reading when set. Defaults to None.
+
+        Returns:
+            str: hexadecimal hash, error sentinel, or None if killed.
+        """
+        hash_obj = self.new_hash()
+        try:
+            if not self.feed_file(file_path, [hash_obj.update], kill_event):
+                return None
+        except PermissionError:
+            return HASH_NO_PERMISSION
+        except FileNotFoundError:
+            print(f"File {file_path} not found.")
+            return HASH_FILE_NOT_FOUND
+        except (OSError, ValueError) as eee:
+            print(f"File {file_path} could not be read: {eee}")
+            return HASH_UNKNOWN
+        return hash_obj.hexdigest()
+
+    def hash_file_multi(self, file_path: str, algorithms: list = None, kill_event: threading.Event = None) -> dict:
+        """Calculate several hashes of a file. Each block read is fed to all the algorithms,
+        so the file is read only once.
+
+        Args:
+            file_path (str): The path to the file for which the hashes are calculated.
+            algorithms (list[str], optional): algorithms in HASH_ALGORITHMS. Defaults to None, all algorithms.
+            kill_event (threading.Event, optional): stop reading when set. Defaults to None.
+
+        Returns:
+            dict: {algorithm: hexadecimal hash or error sentinel}, None if killed.
+        """
+        if not algorithms:
+            algorithms = HASH_ALGORITHMS
+        for algorithm in algorithms:
+            if algorithm not in HASH_ALGORITHMS:
+                raise ValueError(f"Hash algorithm {algorithm} not in {HASH_ALGORITHMS}")
+        hash_dict = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+        error = None
+        try:
+            if not self.feed_file(file_path, [hash_obj.update for hash_obj in hash_dict.values()], kill_event):
+                return None
+        except PermissionError:
+            error = HASH_NO_PERMISSION
+        except FileNotFoundError:
+            print(f"File {file_path} not found.")
+            error = HASH_FILE_NOT_FOUND
+        except (OSError, ValueError) as eee:
+            print(f"File {file_path} could not be read: {eee}")
+            error = HASH_UNKNOWN
+        if error:
+            return {algorithm: error for algorithm in algorithms}
+        return {algorithm: hash_obj.hexdigest() for algorithm, hash_obj in hash_dict.items()}
+
+    def hash_file_sample(self, file_path: str, sample_size: int = SAMPLE_SIZE) -> str:
+        """Hash of the head and the tail of a file, to discard files of the same size with different content.
+        Files up to 2*sample_size are hashed completely, then the sample hash is the full hash.
+
+        Args:
+            file_path (str): file to sample
+            sample_size (int, optional): bytes read at the start and at the end. Defaults to SAMPLE_SIZE.
+
+        Returns:
+            str: hexadecimal hash of the sample, or error sentinel.
+        """
+        sample_size = min(sample_size, self.block_size)
+        hash_obj = self.new_hash()
+        try:
+            with open(file_path, "rb", buffering=0) as f:
+                size = os.fstat(f.fileno()).st_size
+                if size <= 2 * sample_size:
+                    return self.hash_file(file_path)
+                with memoryview(self.buffer) as view, view[:sample_size] as sample_view:
+                    for position in [0, size - sample_size]:
+                        f.seek(position)
+                        n_read = f.readinto(sample_view)
+                        with sample_view[:n_read] as block:
+                            hash_obj.update(block)
+        except PermissionError:
+            return HASH_NO_PERMISSION
+        except FileNotFoundError:
+            print(f"File {file_path} not found.")
+            return HASH_FILE_NOT_FOUND
+        except (OSError, ValueError) as eee:
+            print(f"File {file_path} could not be read: {eee}")
+            return HASH_UNKNOWN
+        return hash_obj.hexdigest()
@@ -0,0 +1,703 @@
+"""
+Storage layouts of the maps
+########################
+# F.garcia
+# creation: 18.10.2026
+########################
+"""
+
+import sqlite3
+
+from class_sqlite_database import SQLiteDatabase, DATA_CHUNK_SIZE
+
+# "table": one table per map with the filepath in each row
+# "normalized": the map is a view over a files table referencing a directory tree shared by the maps
+# "partitioned": the map is a view over a files table shared by the maps, keyed by map_id
+# "typed": the map is a view over a table storing size as INTEGER bytes and the dates as INTEGER nanoseconds
+MAP_LAYOUTS = ["table", "normalized", "partitioned", "typed"]
+MAP_LAYOUT = "table"  # layout of the new maps
+# (Column name, Data type, Not null constraint) of a map, without id
+MAP_COLUMNS = [
+    ("dt_data_created", "DATETIME DEFAULT CURRENT_TIMESTAMP", True),
+    ("dt_data_modified", "DATETIME", True),
+    ("filepath", "TEXT", True),
+    ("filename", "TEXT", True),
+    ("md5", "TEXT", True),
+    ("size", "REAL", True),
+    ("dt_file_created", "DATETIME", False),
+    ("dt_file_accessed", "DATETIME", False),
+    ("dt_file_modified", "DATETIME", False),
+]
+# columns of the storage of a typed map, the dates are nanoseconds since epoch
+TYPED_MAP_COLUMNS = [
+    (column, "INTEGER", not_null) if column == "size" or column.startswith("dt_") else (column, data_type, not_null)
+    for column, data_type, not_null in MAP_COLUMNS
+]
+DIRECTORY_TREE_TABLE = "__File_Mapper_Directory_Tree__"
+MAP_FILES_PREFIX = "__File_Mapper_Files_"  # files table of a normalized map: prefix + map + "__"
+MAP_TYPED_PREFIX = "__File_Mapper_Typed_"  # table of a typed map: prefix + map + "__"
+MAP_CONVERT_PREFIX = "__File_Mapper_Convert_"  # table of a map while its layout is converted
+PARTITION_TABLE = "__File_Mapper_Map_Files__"  # files of the partitioned maps: map_id, file_id (id in the map)
+PARTITION_MAPS_TABLE = "__File_Mapper_Map_Partitions__"  # partitioned maps: id is the map_id
+SEARCH_INDEX_PREFIX = "__File_Mapper_Search_"  # trigram index of a map: prefix + map + "__"
+SEARCH_INDEX_COLUMNS = ["filename", "filepath"]
+MAP_SEARCH_INDEX = False  # new maps get a search index
+
+
+class MapLayout:
+    """Creates, converts, renames and drops maps in any of the MAP_LAYOUTS.
+    A normalized map stores each directory once in DIRECTORY_TREE_TABLE (id, parent_id, name, path)
+    and the file rows reference it by dir_id. A partitioned map stores its rows in PARTITION_TABLE with its map_id,
+    so questions over several maps are a single indexed query. A typed map stores size and the dates as integers,
+    so range queries on them use its indexes and the rows are smaller.
+    A map can have a FTS5 trigram search index of its filename and filepath, kept by triggers on its storage.
+    For both the map name is a view with the columns of a map table, its triggers translate the inserts,
+    updates and deletes, so the callers of the map table work on all the layouts.
+    """
+
+    def __init__(self, db: SQLiteDatabase):
+        """Layouts of the maps of a database
+
+        Args:
+            db (SQLiteDatabase): database of the maps
+        """
+        self.db = db
+
+    @staticmethod
+    def get_files_table(table_name: str) -> str:
+        """Files table of a normalized map"""
+        return f"{MAP_FILES_PREFIX}{table_name}__"
+
+    @staticmethod
+    def get_typed_table(table_name: str) -> str:
+        """Storage table of a typed map"""
+        return f"{MAP_TYPED_PREFIX}{table_name}__"
+
+    @staticmethod
+    def is_typed_date(column: str) -> bool:
+        """True if the column of a typed map is a date stored as nanoseconds"""
+        return column.startswith("dt_")
+
+    def get_layout(self, table_name: str) -> str:
+        """Layout of a map
+
+        Args:
+            table_name (str): map
+
+        Returns:
+            str: one of MAP_LAYOUTS, None if the map does not exist
+        """
+        if table_name not in self.db.tables_in_db():
+            return None
+        if table_name not in self.db.views_in_db():
+            return "table"
+        if self.db.table_exists(self.get_files_table(table_name)):
+            return "normalized"
+        if self.db.table_exists(self.get_typed_table(table_name)):
+            return "typed"
+        if self.get_map_id(table_name) is not None:
+            return "partitioned"
+        return "table"
+
+    def get_map_id(self, table_name: str) -> int:
+        """map_id of a partitioned map, None if the map is not partitioned"""
+        if not self.db.table_exists(PARTITION_MAPS_TABLE):
+            return None
+        map_id = self.db.get_data_sql_command(
+            f"SELECT id FROM {self.db.quotes(PARTITION_MAPS_TABLE)} WHERE tablename = {self.db.quotes(table_name)}"
+        )
+        if len(map_id) > 0:
+            return map_id[0][0]
+        return None
+
+    def get_storage_table(self, table_name: str) -> str:
+        """Table holding the rows of a map, where its indexes are created"""
+        layout = self.get_layout(table_name)
+        if layout == "normalized":
+            return self.get_files_table(table_name)
+        if layout == "partitioned":
+            return PARTITION_TABLE
+        if layout == "typed":
+            return self.get_typed_table(table_name)
+        return table_name
+
+    def get_next_available_id(self, table_name: str) -> int:
+        """Next id of a map, after the highest id ever given in it. The ids of the views are given by their storage,
+        the AUTOINCREMENT sequence of the storage table or the seq of a partitioned map."""
+        layout = self.get_layout(table_name)
+        if layout != "partitioned":
+            return self.db.get_next_available_id(table_name, self.get_storage_table(table_name))
+        d_data = self.db.get_data_sql_command(
+            f"SELECT MAX(COALESCE((SELECT MAX(file_id) FROM {self.db.quotes(PARTITION_TABLE)} WHERE map_id = p.id), 0), "
+            f"p.seq) FROM {self.db.quotes(PARTITION_MAPS_TABLE)} AS p WHERE p.tablename = ?",
+            (table_name,),
+        )
+        if len(d_data) > 0 and d_data[0][0] is not None:
+            return d_data[0][0] + 1
+        return 1
+
+    def get_storage_columns(self, table_name: str, column_list: list) -> list:
+        """Columns of the storage table for the columns of a map index.
+        filepath is dir_id on a normalized map, the indexes of the partitioned maps start by map_id."""
+        layout = self.get_layout(table_name)
+        if layout == "normalized":
+            return ["dir_id" if column == "filepath" else column for column in column_list]
+        if layout == "partitioned":
+            return ["map_id"] + list(column_list)
+        return list(column_list)
+
+    def create_directory_tree(self):
+        """Creates the directory tree table, its indexes and the trigger adding the parents, if not existing"""
+        if self.db.table_exists(DIRECTORY_TREE_TABLE):
+            return
+        t_q = self.db.quotes(DIRECTORY_TREE_TABLE)
+        self.db.create_table(
+            DIRECTORY_TREE_TABLE, [("parent_id", "INTEGER", False), ("name", "TEXT", True), ("path", "TEXT", True)]
+        )
+        self.db.create_index(DIRECTORY_TREE_TABLE, ["path"], DIRECTORY_TREE_TABLE + "_path", True)
+        self.db.create_index(DIRECTORY_TREE_TABLE, ["parent_id"], DIRECTORY_TREE_TABLE + "_parent")
+        # a new directory adds its parent, which adds its own parent until an existing one or the root
+        self.db.send_sql_command(
+            f"CREATE TRIGGER IF NOT EXISTS {self.db.quotes(DIRECTORY_TREE_TABLE + '_parents')} "
+            f"AFTER INSERT ON {t_q} WHEN NEW.parent_id IS NULL AND fm_path_parent(NEW.path) IS NOT NULL BEGIN "
+            f"INSERT OR IGNORE INTO {t_q} (parent_id, name, path) "
+            "VALUES (NULL, fm_path_name(fm_path_parent(NEW.path)), fm_path_parent(NEW.path)); "
+            f"UPDATE {t_q} SET parent_id = (SELECT id FROM {t_q} WHERE path = fm_path_parent(NEW.path)) "
+            "WHERE id = NEW.id; END"
+        )
+
+    def create_partition_tables(self):
+        """Creates the shared files table and the table of the partitioned maps, if not existing"""
+        if not self.db.table_exists(PARTITION_MAPS_TABLE):
+            # seq: last file_id given in the map, columns: the columns of its view
+            self.db.create_table(
+                PARTITION_MAPS_TABLE, [("tablename", "TEXT", True), ("seq", "INTEGER", True), ("columns", "TEXT", True)]
+            )
+            self.db.create_index(PARTITION_MAPS_TABLE, ["tablename"], PARTITION_MAPS_TABLE + "_tablename", True)
+        if not self.db.table_exists(PARTITION_TABLE):
+            self.db.create_table(
+                PARTITION_TABLE, [("map_id", "INTEGER", True), ("file_id", "INTEGER", True)] + MAP_COLUMNS
+            )
+        self.create_storage_indexes(None, "partitioned")
+
+    def create_storage_indexes(self, table_name: str, layout: str = None):
+        """Creates the key indexes of the storage of a map, the maps of other layouts have none
+
+        Args:
+            table_name (str): map
+            layout (str, optional): layout of the map. Defaults to None, the layout of table_name.
+        """
+        if layout is None:
+            layout = self.get_layout(table_name)
+        if layout != "partitioned":
+            return
+        # rows of a map by id, and the maps of a hash
+        self.db.create_index(PARTITION_TABLE, ["map_id", "file_id"], PARTITION_TABLE + "_key", True)
+        self.db.create_index(PARTITION_TABLE, ["md5", "map_id"], PARTITION_TABLE + "_md5_map")
+
+    def create_map(self, table_name: str, layout: str = MAP_LAYOUT):
+        """Creates an empty map if not existing
+
+        Args:
+            table_name (str): map
+            layout (str, optional): one of MAP_LAYOUTS. Defaults to MAP_LAYOUT.
+        """
+        if layout not in MAP_LAYOUTS:
+            raise ValueError(f"Unknown map layout {layout}, use one of {MAP_LAYOUTS}")
+        if layout == "table":
+            self.db.create_table(table_name, MAP_COLUMNS)
+            return
+        if self.db.table_exists(table_name):
+            return
+        if layout == "normalized":
+            self.create_directory_tree()
+            self.db.create_table(
+                self.get_files_table(table_name),
+                [("dir_id", "INTEGER", True) if column[0] == "filepath" else column for column in MAP_COLUMNS],
+            )
+        elif layout == "typed":
+            self.db.create_table(self.get_typed_table(table_name), TYPED_MAP_COLUMNS)
+        else:
+            self.create_partition_tables()
+            self.db.insert_rows(
+                PARTITION_MAPS_TABLE,
+                [(table_name, 0, ",".join([column[0] for column in MAP_COLUMNS]))],
+                ["tablename", "seq", "columns"],
+            )
+        self.create_map_view(table_name, layout)
+
+    def get_map_columns(self, table_name: str, layout: str) -> list:
+        """Stored columns of a normalized, partitioned or typed map, without id. dir_id on a normalized map."""
+        if layout == "partitioned":
+            columns = self.db.get_data_sql_command(
+                f"SELECT columns FROM {self.db.quotes(PARTITION_MAPS_TABLE)} "
+                f"WHERE tablename = {self.db.quotes(table_name)}"
+            )
+            if len(columns) == 0:
+                return []
+            return columns[0][0].split(",")
+        storage_table = self.get_typed_table(table_name) if layout == "typed" else self.get_files_table(table_name)
+        return [column for column in self.db.get_column_list_of_table(storage_table) if column != "id"]
+
+    def get_view_select(self, table_name: str, where: str = None, layout: str = None) -> str:
+        """SELECT of the view of a normalized, partitioned or typed map, the columns of the map table in the same order
+
+        Args:
+            table_name (str): map
+            where (str, optional): condition on the files "f" and directories "d". On a typed map the dates of
+            the condition are nanoseconds. Defaults to None.
+            layout (str, optional): layout of the map. Defaults to None, the layout of table_name.
+
+        Returns:
+            str: query
+        """
+        if layout is None:
+            layout = self.get_layout(table_name)
+        columns = self.get_map_columns(table_name, layout)
+        if layout == "partitioned":
+            select_list = ["f.file_id AS id"] + [f"f.{column} AS {column}" for column in columns]
+            sql = (
+                f"SELECT {', '.join(select_list)} FROM {self.db.quotes(PARTITION_TABLE)} AS f "
+                f"WHERE f.map_id = {self.get_map_id(table_name)}"
+            )
+            if where:
+                sql = sql + " AND " + where
+            return sql
+        if layout == "typed":
+            select_list = ["f.id AS id"] + [
+                f"fm_ns_to_datetime(f.{column}) AS {column}" if self.is_typed_date(column) else f"f.{column} AS {column}"
+                for column in columns
+            ]
+            sql = f"SELECT {', '.join(select_list)} FROM {self.db.quotes(self.get_typed_table(table_name))} AS f"
+            if where:
+                sql = sql + " WHERE " + where
+            return sql
+        select_list = ["f.id AS id"]
+        for column in columns:
+            if column == "dir_id":
+                select_list.append("d.path AS filepath")
+            else:
+                select_list.append(f"f.{column} AS {column}")
+        sql = (
+            f"SELECT {', '.join(select_list)} FROM {self.db.quotes(self.get_files_table(table_name))} AS f "
+            f"JOIN {self.db.quotes(DIRECTORY_TREE_TABLE)} AS d ON d.id = f.dir_id"
+        )
+        if where:
+            sql = sql + " WHERE " + where
+        return sql
+
+    def create_map_view(self, table_name: str, layout: str):
+        """Creates the view of a normalized, partitioned or typed map and the triggers writing through it"""
+        v_q = self.db.quotes(table_name)
+        columns = self.get_map_columns(table_name, layout)
+        if layout == "partitioned":
+            map_id = self.get_map_id(table_name)
+            f_q = self.db.quotes(PARTITION_TABLE)
+            p_q = self.db.quotes(PARTITION_MAPS_TABLE)
+            values_txt = ", ".join([f"NEW.{column}" for column in columns])
+            set_txt = ", ".join([f"{column} = NEW.{column}" for column in columns])
+            # the ids of a map are given by its seq, as AUTOINCREMENT they are not reused
+            insert_txt = (
+                f"UPDATE {p_q} SET seq = CASE WHEN NEW.id IS NULL THEN seq + 1 WHEN NEW.id > seq THEN NEW.id "
+                f"ELSE seq END WHERE id = {map_id}; "
+                f"INSERT INTO {f_q} (map_id, file_id, {', '.join(columns)}) VALUES ({map_id}, "
+                f"COALESCE(NEW.id, (SELECT seq FROM {p_q} WHERE id = {map_id})), {values_txt}); "
+            )
+            update_txt = f"UPDATE {f_q} SET file_id = NEW.id, {set_txt} WHERE map_id = {map_id} AND file_id = OLD.id; "
+            delete_txt = f"DELETE FROM {f_q} WHERE map_id = {map_id} AND file_id = OLD.id; "
+        elif layout == "typed":
+            f_q = self.db.quotes(self.get_typed_table(table_name))
+
+            def typed_value(column):
+                if self.is_typed_date(column):
+                    return f"fm_datetime_to_ns(NEW.{column})"
+                if column == "size":
+                    return f"CAST(NEW.{column} AS INTEGER)"
+                return f"NEW.{column}"
+
+            values_txt = ", ".join([typed_value(column) for column in columns])
+            set_txt = ", ".join([f"{column} = {typed_value(column)}" for column in columns])
+            insert_txt = f"INSERT INTO {f_q} (id, {', '.join(columns)}) VALUES (NEW.id, {values_txt}); "
+            update_txt = f"UPDATE {f_q} SET id = NEW.id, {set_txt} WHERE id = OLD.id; "
+            delete_txt = f"DELETE FROM {f_q} WHERE id = OLD.id; "
+        else:
+            f_q = self.db.quotes(self.get_files_table(table_name))
+            t_q = self.db.quotes(DIRECTORY_TREE_TABLE)
+            dir_id_txt = f"(SELECT id FROM {t_q} WHERE path = NEW.filepath)"
+            values_txt = ", ".join([dir_id_txt if column == "dir_id" else f"NEW.{column}" for column in columns])
+            set_txt = ", ".join(
+                [f"dir_id = {dir_id_txt}" if column == "dir_id" else f"{column} = NEW.{column}" for column in columns]
+            )
+            add_directory_txt = f"INSERT OR IGNORE INTO {t_q} (parent_id, name, path) "
+            insert_txt = (
+                f"{add_directory_txt}VALUES (NULL, fm_path_name(NEW.filepath), NEW.filepath); "
+                f"INSERT INTO {f_q} (id, {', '.join(columns)}) VALUES (NEW.id, {values_txt}); "
+            )
+            update_txt = (
+                f"{add_directory_txt}SELECT NULL, fm_path_name(NEW.filepath), NEW.filepath "
+                "WHERE NEW.filepath IS NOT OLD.filepath; "
+                f"UPDATE {f_q} SET id = NEW.id, {set_txt} WHERE id = OLD.id; "
+            )
+            delete_txt = f"DELETE FROM {f_q} WHERE id = OLD.id; "
+        with self.db.transaction():
+            self.db.send_sql_command(
+                f"CREATE VIEW IF NOT EXISTS {v_q} AS {self.get_view_select(table_name, None, layout)}"
+            )
+            for operation, trigger_txt in [("insert", insert_txt), ("update", update_txt), ("delete", delete_txt)]:
+                self.db.send_sql_command(
+                    f"CREATE TRIGGER IF NOT EXISTS {self.db.quotes(table_name + '_' + operation)} "
+                    f"INSTEAD OF {operation.upper()} ON {v_q} BEGIN {trigger_txt}END"
+                )
+
+    def drop_map_view(self, table_name: str):
+        """Drops the view of a normalized, partitioned or typed map, its triggers are dropped with it"""
+        self.db.send_sql_command(f"DROP VIEW IF EXISTS {self.db.quotes(table_name)}")
+
+    def add_map_column(self, table_name: str, column: str, column_type: str):
+        """Adds a column to a map, on a normalized, partitioned or typed map to its storage and view
+
+        Args:
+            table_name (str): map
+            column (str): column name
+            column_type (str): type as in SQLiteDatabase.add_column_to_table
+        """
+        layout = self.get_layout(table_name)
+        if layout == "table":
+            self.db.add_column_to_table(table_name, column, column_type)
+            return
+        with self.db.transaction():
+            if layout == "normalized":
+                self.db.add_column_to_table(self.get_files_table(table_name), column, column_type)
+            elif layout == "typed":
+                self.db.add_column_to_table(self.get_typed_table(table_name), column, column_type)
+            else:
+                # the shared table may have it from another map
+                if column not in self.db.get_column_list_of_table(PARTITION_TABLE):
+                    self.db.add_column_to_table(PARTITION_TABLE, column, column_type)
+                columns = self.get_map_columns(table_name, layout)
+                self.db.execute_write(
+                    f"UPDATE {self.db.quotes(PARTITION_MAPS_TABLE)} SET columns = ? WHERE tablename = ?",
+                    (",".join(columns + [column]), table_name),
+                )
+            self.drop_map_view(table_name)
+            self.create_map_view(table_name, layout)
+
+    def rename_map(self, table_name: str, new_table_name: str):
+        """Renames the table of a map, or the view and storage of a normalized, partitioned or typed map.
+        The search index refers to the map by name, it is built again for the new name."""
+        layout = self.get_layout(table_name)
+        has_search_index = self.has_search_index(table_name)
+        self.drop_search_index(table_name)
+        if layout == "table":
+            self.db.send_sql_command(
+                f"ALTER TABLE {self.db.quotes(table_name)} RENAME TO {self.db.quotes(new_table_name)}"
+            )
+        else:
+            with self.db.transaction():
+                self.drop_map_view(table_name)
+                if layout == "normalized":
+                    self.db.send_sql_command(
+                        f"ALTER TABLE {self.db.quotes(self.get_files_table(table_name))} "
+                        f"RENAME TO {self.db.quotes(self.get_files_table(new_table_name))}"
+                    )
+                elif layout == "typed":
+                    self.db.send_sql_command(
+                        f"ALTER TABLE {self.db.quotes(self.get_typed_table(table_name))} "
+                        f"RENAME TO {self.db.quotes(self.get_typed_table(new_table_name))}"
+                    )
+                else:
+                    self.db.execute_write(
+                        f"UPDATE {self.db.quotes(PARTITION_MAPS_TABLE)} SET tablename = ? WHERE tablename = ?",
+                        (new_table_name, table_name),
+                    )
+                self.create_map_view(new_table_name, layout)
+        if has_search_index:
+            self.create_search_index(new_table_name)
+
+    def drop_map(self, table_name: str, log_print: bool = True):
+        """Removes the rows and the table of a map, or the view and storage of a normalized, partitioned or typed map.
+        The directories stay in the tree, they are shared by the maps."""
+        layout = self.get_layout(table_name)
+        self.drop_search_index(table_name)
+        if layout in ["normalized", "typed"]:
+            storage_table = self.get_storage_table(table_name)
+            self.drop_map_view(table_name)
+            self.db.delete_table_from_db(storage_table, log_print)
+            return
+        if layout == "partitioned":
+            map_id = self.get_map_id(table_name)
+            with self.db.transaction():
+                self.drop_map_view(table_name)
+                self.db.execute_write(f"DELETE FROM {self.db.quotes(PARTITION_TABLE)} WHERE map_id = ?", (map_id,))
+                self.db.execute_write(f"DELETE FROM {self.db.quotes(PARTITION_MAPS_TABLE)} WHERE id = ?", (map_id,))
+            if log_print:
+                print(f"Map {table_name} deleted")
+            return
+        self.db.delete_data_from_table(table_name, None)  # remove all data
+        self.db.delete_table_from_db(table_name, log_print)
+
+    def convert_map(self, table_name: str, layout: str) -> bool:
+        """Converts a map to another layout keeping the ids. The indexes of the map have to be created again.
+
+        Args:
+            table_name (str): map
+            layout (str): one of MAP_LAYOUTS
+
+        Returns:
+            bool: True if the map has the layout
+        """
+        old_layout = self.get_layout(table_name)
+        if old_layout is None or layout not in MAP_LAYOUTS:
+            return False
+        if old_layout == layout:
+            return True
+        convert_table = f"{MAP_CONVERT_PREFIX}{table_name}__"
+        has_search_index = self.has_search_index(table_name)
+        self.drop_search_index(table_name)
+        try:
+            with self.db.transaction():
+                if old_layout == "table":
+                    self.db.send_sql_command(
+                        f"ALTER TABLE {self.db.quotes(table_name)} RENAME TO {self.db.quotes(convert_table)}"
+                    )
+                else:
+                    self.db.delete_table_from_db(convert_table, False)
+                    self.db.create_table(convert_table, MAP_COLUMNS)
+                    self.copy_map_rows(table_name, convert_table)
+                    self.drop_map(table_name, False)
+                if layout == "table":
+                    self.db.send_sql_command(
+                        f"ALTER TABLE {self.db.quotes(convert_table)} RENAME TO {self.db.quotes(table_name)}"
+                    )
+                else:
+                    self.create_map(table_name, layout)
+                    self.copy_map_rows(convert_table, table_name)
+                    self.db.delete_table_from_db(convert_table, False)
+        except sqlite3.Error as eee:
+            print(f"Map {table_name} not converted to {layout}: {eee}")
+            return False
+        finally:
+            if has_search_index:
+                self.create_search_index(table_name)
+        return self.get_layout(table_name) == layout
+
+    def copy_map_rows(self, from_table: str, to_table: str):
+        """Copies the rows of a map into another one with its ids, adding the missing columns"""
+        to_columns = self.db.get_column_list_of_table(to_table)
+        for column in self.db.get_column_list_of_table(from_table):
+            if column not in to_columns:
+                self.add_map_column(to_table, column, "TEXT")
+        columns_txt = ", ".join(self.db.get_column_list_of_table(from_table))
+        self.db.execute_write(
+            f"INSERT INTO {self.db.quotes(to_table)} ({columns_txt}) "
+            f"SELECT {columns_txt} FROM {self.db.quotes(from_table)}"
+        )
+
+    @staticmethod
+    def get_search_table(table_name: str) -> str:
+        """FTS5 search index of a map"""
+        return f"{SEARCH_INDEX_PREFIX}{table_name}__"
+
+    @staticmethod
+    def is_search_index_available() -> bool:
+        """True if the sqlite library has FTS5 with the trigram tokenizer (sqlite 3.34)"""
+        if sqlite3.sqlite_version_info < (3, 34, 0):
+            return False
+        try:
+            with sqlite3.connect(":memory:") as conn:
+                conn.execute("CREATE VIRTUAL TABLE temp.fts_check USING fts5(a, tokenize='trigram')")
+        except sqlite3.Error:
+            return False
+        return True
+
+    def has_search_index(self, table_name: str) -> bool:
+        """True if the map has a search index"""
+        return self.db.table_exists(self.get_search_table(table_name))
+
+    def get_search_trigger_sql(self, table_name: str, layout: str) -> list:
+        """Triggers keeping the search index of a map, on the table holding its rows.
+        The index has the map as external content, so a removed row is given with its old values.
+
+        Args:
+            table_name (str): map
+            layout (str): layout of the map
+
+        Returns:
+            list[str]: trigger statements
+        """
+        s_q = self.db.quotes(self.get_search_table(table_name))
+        columns_txt = ", ".join(SEARCH_INDEX_COLUMNS)
+        # "{row}" is NEW or OLD
+        values_txt = "{row}.id, {row}.filename, {row}.filepath"
+        when_txt = ""
+        storage_table = table_name
+        update_columns = ["id"] + SEARCH_INDEX_COLUMNS
+        if layout == "normalized":
+            storage_table = self.get_files_table(table_name)
+            values_txt = (
+                "{row}.id, {row}.filename, "
+                f"(SELECT path FROM {self.db.quotes(DIRECTORY_TREE_TABLE)} WHERE id = {{row}}.dir_id)"
+            )
+            update_columns = ["id", "filename", "dir_id"]
+        elif layout == "typed":
+            storage_table = self.get_typed_table(table_name)
+        elif layout == "partitioned":
+            storage_table = PARTITION_TABLE
+            values_txt = "{row}.file_id, {row}.filename, {row}.filepath"
+            when_txt = f"WHEN {{row}}.map_id = {self.get_map_id(table_name)} "
+            update_columns = ["file_id"] + SEARCH_INDEX_COLUMNS
+        insert_txt = f"INSERT INTO {s_q} (rowid, {columns_txt}) VALUES ({values_txt.format(row='NEW')}); "
+        delete_txt = (
+            f"INSERT INTO {s_q} ({s_q}, rowid, {columns_txt}) VALUES ('delete', {values_txt.format(row='OLD')}); "
+        )
+        t_name = self.get_search_table(table_name)
+        f_q = self.db.quotes(storage_table)
+        return [
+            f"CREATE TRIGGER IF NOT EXISTS {self.db.quotes(t_name + '_insert')} AFTER INSERT ON {f_q} "
+            f"{when_txt.format(row='NEW')}BEGIN {insert_txt}END",
+            f"CREATE TRIGGER IF NOT EXISTS {self.db.quotes(t_name + '_delete')} AFTER DELETE ON {f_q} "
+            f"{when_txt.format(row='OLD')}BEGIN {delete_txt}END",
+            f"CREATE TRIGGER IF NOT EXISTS {self.db.quotes(t_name + '_update')} "
+            f"AFTER UPDATE OF {', '.join(update_columns)} ON {f_q} "
+            f"{when_txt.format(row='OLD')}BEGIN {delete_txt}{insert_txt}END",
+        ]
+
+    def create_search_index(self, table_name: str) -> bool:
+        """Creates the trigram search index of a map if not existing, and fills it with the rows of the map.
+        Build it after inserting the map rows, the triggers keep it on the inserts, updates and deletes.
+
+        Args:
+            table_name (str): map
+
+        Returns:
+            bool: True if the map has a search index
+        """
+        layout = self.get_layout(table_name)
+        if layout is None:
+            return False
+        if self.has_search_index(table_name):
+            return True
+        if not self.is_search_index_available():
+            print("Search index not created, sqlite has no FTS5 trigram tokenizer")
+            return False
+        s_q = self.db.quotes(self.get_search_table(table_name))
+        try:
+            with self.db.transaction():
+                self.db.send_sql_command(
+                    f"CREATE VIRTUAL TABLE {s_q} USING fts5({', '.join(SEARCH_INDEX_COLUMNS)}, "
+                    f"content={self.db.quotes(table_name)}, content_rowid='id', tokenize='trigram')"
+                )
+                for trigger_txt in self.get_search_trigger_sql(table_name, layout):
+                    self.db.send_sql_command(trigger_txt)
+                self.db.execute_write(f"INSERT INTO {s_q} ({s_q}) VALUES ('rebuild')")
+        except sqlite3.Error as eee:
+            print(f"Search index of {table_name} not created: {eee}")
+            return False
+        return True
+
+    def drop_search_index(self, table_name: str):
+        """Drops the search index of a map and its triggers, if existing"""
+        t_name = self.get_search_table(table_name)
+        with self.db.transaction():
+            for operation in ["insert", "delete", "update"]:
+                self.db.send_sql_command(f"DROP TRIGGER IF EXISTS {self.db.quotes(t_name + '_' + operation)}")
+            self.db.send_sql_command(f"DROP TABLE IF EXISTS {self.db.quotes(t_name)}")
+
+    def get_partition_md5_select(self, map_id_pairs: dict) -> str:
+        """One query over the rows of several partitioned maps, as the per map selects of the repeat searches
+
+        Args:
+            map_id_pairs (dict): {map_id: pair}, pair is the index of the map in the search
+
+        Returns:
+            str: query with the columns pair, id, md5
+        """
+        cases = " ".join([f"WHEN {map_id} THEN {pair}" for map_id, pair in map_id_pairs.items()])
+        map_ids = ", ".join([str(map_id) for map_id in map_id_pairs])
+        return (
+            f"SELECT CASE map_id {cases} END AS pair, file_id AS id, md5 FROM {self.db.quotes(PARTITION_TABLE)} "
+            f"WHERE map_id IN ({map_ids})"
+        )
+
+    def get_maps_with_md5(self, md5: str) -> list:
+        """Partitioned maps containing a hash, one indexed query over all the maps
+
+        Args:
+            md5 (str): hash
+
+        Returns:
+            list[str]: maps
+        """
+        if not self.db.table_exists(PARTITION_TABLE):
+            return []
+        maps = self.db.get_data_sql_command(
+            f"SELECT p.tablename FROM {self.db.quotes(PARTITION_MAPS_TABLE)} AS p WHERE p.id IN "
+            f"(SELECT map_id FROM {self.db.quotes(PARTITION_TABLE)} WHERE md5 = {self.db.quotes(md5)}) "
+            "ORDER BY p.tablename"
+        )
+        return [a_map for (a_map,) in maps]
+
+    def get_subtree_sql(self, table_name: str, dirpath: str, column_filter: str = "*") -> tuple:
+        """Query of the rows of a map in a directory and its subdirectories.
+        On a normalized map the subdirectories are found by parent_id and the files by dir_id,
+        on the other layouts by filepath ranges, so the filepath indexes are used.
+
+        Args:
+            table_name (str): map
+            dirpath (str): directory, as the filepath of the rows
+            column_filter (str, optional): columns. Defaults to "*".
+
+        Returns:
+            tuple: (sql, parameters)
+        """
+        if self.get_layout(table_name) == "normalized":
+            t_q = self.db.quotes(DIRECTORY_TREE_TABLE)
+            subtree_txt = (
+                f"WITH RECURSIVE subtree(id) AS (SELECT id FROM {t_q} WHERE path = ? "
+                f"UNION ALL SELECT t.id FROM {t_q} AS t JOIN subtree ON t.parent_id = subtree.id) "
+            )
+            view_select = self.get_view_select(table_name, "f.dir_id IN (SELECT id FROM subtree)")
+            return f"{subtree_txt}SELECT {column_filter} FROM ({view_select})", (dirpath,)
+        prefix = dirpath.rstrip("/\\")
+        if prefix == "":
+            # the root of the map
+            return f"SELECT {column_filter} FROM {self.db.quotes(table_name)}", ()
+        # "0" and "]" follow the separators "/" and "\"
+        return (
+            f"SELECT {column_filter} FROM {self.db.quotes(table_name)} WHERE filepath = ? "
+            "OR (filepath >= ? AND filepath < ?) OR (filepath >= ? AND filepath < ?)",
+            (dirpath, prefix + "/", prefix + "0", prefix + "\\", prefix + "]"),
+        )
+
+    def iter_subtree(self, table_name: str, dirpath: str, column_filter: str = "*", chunk_size: int = DATA_CHUNK_SIZE):
+        """Streams the rows of a map in a directory and its subdirectories in chunks, from a read only connection
+
+        Args:
+            table_name (str): map
+            dirpath (str): directory, as the filepath of the rows
+            column_filter (str, optional): columns. Defaults to "*".
+            chunk_size (int, optional): rows per chunk. Defaults to DATA_CHUNK_SIZE.
+
+        Yields:
+            list[tuple]: chunk of rows
+        """
+        sql, parameters = self.get_subtree_sql(table_name, dirpath, column_filter)
+        yield from self.db.reader().iter_data_sql_command(sql, parameters, chunk_size)
+
+    def get_directory_tree(self, table_name: str) -> list:
+        """Directories of a normalized map and their parents up to the root, to build trees by id
+
+        Args:
+            table_name (str): map
+
+        Returns:
+            list[tuple]: (id, parent_id, name), empty for other layouts
+        """
+        if self.get_layout(table_name) != "normalized":
+            return []
+        t_q = self.db.quotes(DIRECTORY_TREE_TABLE)
+        return self.db.reader().get_data_sql_command(
+            f"WITH RECURSIVE used(id) AS (SELECT DISTINCT dir_id FROM {self.db.quotes(self.get_files_table(table_name))} "
+            f"UNION SELECT t.parent_id FROM {t_q} AS t JOIN used ON t.id = used.id WHERE t.parent_id IS NOT NULL) "
+            f"SELECT t.id, t.parent_id, t.name FROM {t_q} AS t JOIN used ON t.id = used.id ORDER BY t.id"
+        )
@@ -4,6 +4,7 @@ from __future__ import print_function, unicode_literals
 
 import os
 import getpass
+import sqlite3
 import pandas as pd
 
 from datetime import datetime
@@ -14,6 +15,7 @@ from class_file_mapper import *
 from class_data_manage import DataManage
 from class_file_explorer import *
 from class_dataframe_compare import DataFrameCompare
+from class_search_executor import SearchExecutor, FileStructureBuilder
 
 
 F_M=FileManipulate()
@@ -232,7 +234,7 @@ class MappingActions():
         # print(referenced_tables)
         maps=[]
         for ttt in tables:
-            if ttt not in [fm.mapper_reference_table,'sqlite_sequence']:
+            if not fm.is_internal_table(ttt):
                 maps.append(ttt)
         for ref_map in referenced_tables:
             if ref_map not in maps:
@@ -267,7 +269,7 @@ class MappingActions():
         map_info_str=''
         fm=self.get_file_map(a_database)
         if isinstance(fm,FileMapper):
-            table_list=fm.db.get_data_from_table(fm.mapper_reference_table,'*')
+            table_list=fm.db.reader().get_data_from_table(fm.mapper_reference_table,'*')
             table_list_size=[]
             for table_info in table_list:
                 #field_list=['id','dt_map_created','dt_map_modified','mappath','tablename','mount','serial','mapname','maptype']
@@ -303,7 +305,7 @@ class MappingActions():
         map_info_dict={}
         fm=self.get_file_map(a_database)
         if isinstance(fm,FileMapper):
-            table_list=fm.db.get_data_from_table(fm.mapper_reference_table,'*',f'tablename="{a_map}"')
+            table_list=fm.db.reader().get_data_from_table(fm.mapper_reference_table,'*',f'tablename="{a_map}"')
             if len(table_list)>0:
                 #field_list=['id','dt_map_created','dt_map_modified','mappath','tablename','mount','serial','mapname','maptype']
                 field_list=fm.db.get_column_list_of_table(fm.mapper_reference_table)
@@ -318,12 +320,12 @@ class MappingActions():
             fm=a_db['mapdb']
             if isinstance(fm,FileMapper):
                 print(f"{iii+1}. [yellow]Maps in {a_db['file']}:")
-                table_list=fm.db.get_data_from_table(fm.mapper_reference_table,'*',where)
+                table_list=fm.db.reader().get_data_from_table(fm.mapper_reference_table,'*',where)
                 table_list_size=[]
                 for table_info in table_list:
                     #field_list=['id','dt_map_created','dt_map_modified','mappath','tablename','mount','serial','mapname','maptype']
-                    data=fm.db.get_data_from_table(table_info[4],'*',f'md5="{MD5_CALC}"')
-                    shallow_data=fm.db.get_data_from_table(table_info[4],'*',f'md5="{MD5_SHALLOW}"')
+                    data=fm.db.reader().get_data_from_table(table_info[4],'*',f'md5="{MD5_CALC}"')
+                    shallow_data=fm.db.reader().get_data_from_table(table_info[4],'*',f'md5="{MD5_SHALLOW}"')
                     num_rows=str(fm.db.get_number_or_rows_in_table(table_info[4]))
                     if len(data)>0:
                         num_rows=f'{num_rows}({len(data)})'
@@ -376,7 +378,7 @@ class MappingActions():
             list(tuple): information on reference table
         """
         fm=self.get_file_map(database)
-        return fm.db.get_data_from_table(fm.mapper_reference_table,'*',f"tablename='{a_map}'")
+        return fm.db.reader().get_data_from_table(fm.mapper_reference_table,'*',f"tablename='{a_map}'")
 
     def get_maps_by_type(self,type_list=None,in_list=True):
         """Finds all maps of specific types (or not of specific types) in all loaded databases
@@ -412,21 +414,13 @@ class MappingActions():
             int: size in bytes
         """
         fm=self.get_file_map(db_map_pair[0])
-        id_size_list=fm.db.get_data_from_table(db_map_pair[1],"id, size",None)
-        use_all=True
-        if isinstance(id_list,list):
-            if len(id_list)>0:
-                use_all=False
-        total_size=0
-        if use_all:
-            for (_,a_size) in id_size_list:
-                if a_size>=0:
-                    total_size=total_size+a_size
-        else:
-            for (an_id,a_size) in id_size_list:
-                if a_size>=0 and an_id in id_list:
-                    total_size=total_size+a_size
-        return total_size
+        if isinstance(id_list,list) and len(id_list)>0:
+            # sum of the selected ids joined by sqlite
+            return fm.db.sum_by_id_set(db_map_pair[1],"size",id_list,"size>=0")
+        size_data=fm.db.reader().get_data_from_table(db_map_pair[1],"COALESCE(SUM(size),0)","size>=0")
+        if len(size_data)>0:
+            return size_data[0][0]
+        return 0
             
     def remove_file_from_mount_and_map(self,dupli_dict,db_map_pair):   
         """Removes a file and its map reference"""
@@ -483,6 +477,47 @@ class MappingActions():
             return fm.map_to_file_structure(a_map,where,fields_to_tab,sort_by,ascending)
         return {}
 
+    def search_maps(self,db_map_pair_list:list,where=None,fields_to_tab:list[str]=None)->tuple:
+        """Searches the maps in parallel, each on its own read connection, and builds their file structures
+        while the rows arrive.
+
+        Args:
+            db_map_pair_list (list): database map pairs to search
+            where (str, optional): sql filter for the database search. Defaults to None.
+            fields_to_tab (list[str], optional): Additional information to 'filename' and 'size' from map into file tuple. Defaults to None.
+
+        Returns:
+            tuple(list,list): (file structures, database map pairs) of the maps with results, in the order of db_map_pair_list
+        """
+        start=datetime.now()
+        job_list=[]
+        job_pairs=[]
+        builders=[]
+        for db_map_pair in db_map_pair_list:
+            fm=self.get_file_map(db_map_pair[0])
+            if fm is None or db_map_pair[1] not in self.get_maps_in_db(db_map_pair[0]):
+                continue
+            map_search=fm.get_map_search(db_map_pair[1],where,fields_to_tab)
+            if map_search is None:
+                continue
+            mappath,sql=map_search
+            job_list.append((fm.db.db_path,sql))
+            job_pairs.append(db_map_pair)
+            builders.append(FileStructureBuilder(mappath))
+        s_e=SearchExecutor()
+        for job_index,chunk in s_e.iter_search(job_list):
+            if chunk is None:
+                print(f'Found {builders[job_index].files_added} in {job_pairs[job_index][1]} ({self.calculate_time_elapsed(start,datetime.now())} s)')
+                continue
+            builders[job_index].add_rows(chunk)
+        fs_list=[]
+        db_map_list=[]
+        for db_map_pair,builder in zip(job_pairs,builders):
+            if builder.files_added>0:
+                fs_list.append(builder.get_file_structure())
+                db_map_list.append(db_map_pair)
+        return fs_list,db_map_list
+
     def shallow_to_deep(self,db_map_pair,id_list:list=None):
         """Convert Shallow map into a calculation Map can be done for specific ids
 
@@ -493,30 +528,13 @@ class MappingActions():
         
         fm=self.get_file_map(db_map_pair[0])
         if id_list:
-            # Edit one by one
-            id_query="id IN {"+', '.join(id_list)+"}"
-            data_np=fm.db.get_data_from_table(db_map_pair[1],"*",f"md5={fm.db.quotes(MD5_SHALLOW)} AND {id_query}")
-            # data=[]
-            # for a_row in data_np:
-            #     if a_row[0] in id_list:
-            #         data.append(a_row)
-            # else:
-            data=data_np
-            for iii,a_row in enumerate(data):
-                A_C.print_cycle(iii,len(data))
-                fm.db.edit_value_in_table(db_map_pair[1],a_row[0],'md5',MD5_CALC)
+            # all the ids in a single statement
+            fm.db.update_by_id_set(db_map_pair[1],'md5',MD5_CALC,id_list,f"md5={fm.db.quotes(MD5_SHALLOW)}")
             return
-        def change_shallow_to_calc(md5:str):
-            """Sets calc where there is shallow"""
-            if md5==MD5_SHALLOW:
-                return MD5_CALC
-            return md5
-        field_list=fm.db.get_column_list_of_table(db_map_pair[1])
-        data_np=fm.db.get_data_from_table(db_map_pair[1])
-        data_manage=DataManage(data_np,field_list)
-        data_manage.df['md5'] = data_manage.df['md5'].apply(change_shallow_to_calc)
-        new_values = data_manage.df['md5'].tolist()
-        fm.db.edit_column_in_table(db_map_pair[1], 'md5', new_values)
+        # set based, sqlite changes shallow to calc without loading the map
+        fm.db.send_sql_command(
+            f"UPDATE {fm.db.quotes(db_map_pair[1])} SET md5={fm.db.quotes(MD5_CALC)} WHERE md5={fm.db.quotes(MD5_SHALLOW)}"
+        )
 
 
     def shallow_compare_maps(self,db_map_pair_1:tuple,db_map_pair_2:tuple):
@@ -554,21 +572,27 @@ class MappingActions():
                 what=", ".join(field_list)
             else:
                 what="*"
-            table_list_1=fm_1.db.get_data_from_table(db_map_pair_1[1],what)
-            if len(table_list_1)>0:
+            try:
+                # the dataframe is built chunk by chunk
+                data_manage_1=DataManage.from_chunks(fm_1.db.reader().iter_data_from_table(db_map_pair_1[1],what),field_list)
+            except ValueError:
+                data_manage_1=None
+            if data_manage_1 is not None:
                 # field_list= fm_1.db.get_column_list_of_table(db_map_pair_1[1])
-                data_manage_1=DataManage(table_list_1,field_list)
                 data_manage_1.df['filepath'] = data_manage_1.df['filepath'].apply(fix_separators)
                 data_manage_1.df['size'] = data_manage_1.df['size'].apply(int)#F_M.get_size_str_formatted)
                 if use_difflib:
                     text1=data_manage_1.get_tab_separated_fields(None,sort_by=['filepath','filename'],separator='|',header=False,index=False).splitlines(keepends=False)
             else:
                 return {} , f"No data in {db_map_pair_1}"
-            table_list_2=fm_2.db.get_data_from_table(db_map_pair_2[1],what)
-            if len(table_list_2)>0:
+            try:
+                # the dataframe is built chunk by chunk
+                data_manage_2=DataManage.from_chunks(fm_2.db.reader().iter_data_from_table(db_map_pair_2[1],what),field_list)
+            except ValueError:
+                data_manage_2=None
+            if data_manage_2 is not None:
                 
                 # field_list=fm_2.db.get_column_list_of_table(db_map_pair_2[1])
-                data_manage_2=DataManage(table_list_2,field_list)
                 data_manage_2.df['filepath'] = data_manage_2.df['filepath'].apply(fix_separators)
                 data_manage_2.df['size'] = data_manage_2.df['size'].apply(int)#F_M.get_size_str_formatted)
                 if use_difflib:
@@ -725,7 +749,7 @@ class MappingActions():
             addsep=added.split('|')
             fp=fm_2.db.quotes('%'+addsep[len(addsep)-1][1:-1]+'%')
             where=f"size = {addsep[1]} AND dt_file_modified = {fm_2.db.quotes(addsep[0])} AND filename = {fm_2.db.quotes(addsep[2])} AND filepath LIKE {fp}"
-            id_list_2=fm_2.db.get_data_from_table(db_map_pair_2[1],'*',where)
+            id_list_2=fm_2.db.reader().get_data_from_table(db_map_pair_2[1],'*',where)
             if len(id_list_2)>0:
                 differences.update({'+_id':differences['+_id']+[id_list_2[0][0]]})
                 differences.update({'diff_fs':differences['diff_fs']+[tuple(db_map_pair_2)+('+',)+id_list_2[0]]})
@@ -734,7 +758,7 @@ class MappingActions():
             addsep=added.split('|')
             fp=fm_1.db.quotes('%'+addsep[len(addsep)-1][1:-1]+'%')
             where=f"size = {addsep[1]} AND dt_file_modified = {fm_2.db.quotes(addsep[0])} AND filename = {fm_2.db.quotes(addsep[2])} AND filepath LIKE {fp}"
-            id_list_1=fm_1.db.get_data_from_table(db_map_pair_1[1],'*',where)
+            id_list_1=fm_1.db.reader().get_data_from_table(db_map_pair_1[1],'*',where)
             if len(id_list_1)>0:
                 differences.update({'-_id':differences['-_id']+[id_list_1[0][0]]})
                 differences.update({'diff_fs':differences['diff_fs']+[tuple(db_map_pair_1)+('-',)+id_list_1[0]]})
@@ -850,6 +874,34 @@ class MappingActions():
         fm=self.get_file_map(database)
         return fm.find_duplicates(a_map)
 
+    def find_repeated_across_databases(self,db_map_pair_list:list[tuple]=None,across_maps:bool=True):
+        """Streams the files with the same md5 sum in several maps of the active databases.
+        The databases are attached to one connection and searched with a single query.
+
+            Args:
+                db_map_pair_list (list[tuple], optional): (database,map) pairs. Defaults to None, all maps of the active databases.
+                across_maps (bool, optional): only files present in more than one map. Defaults to True.
+
+            Yields:
+                tuple: md5, [(database,map,id),...]
+        """
+        if not db_map_pair_list:
+            db_map_pair_list=[]
+            for a_db in self.active_databases:
+                for a_map in self.get_maps_in_db(a_db['file']):
+                    if a_db['mapdb'].db.table_exists(a_map):
+                        db_map_pair_list.append((a_db['file'],a_map))
+        db_list=[]
+        for database,_ in db_map_pair_list:
+            fm=self.get_file_map(database)
+            if not isinstance(fm,FileMapper):
+                print(f"[red]Database {database} is not active!")
+                return
+            db_list.append(fm.db)
+        table_list=[a_map for _,a_map in db_map_pair_list]
+        for the_md5,pair_id_list in FileMapper.iter_repeated_across_maps(db_list,table_list,across_maps):
+            yield the_md5,[db_map_pair_list[pair]+(an_id,) for pair,an_id in pair_id_list]
+
     def export_map_file_directories(self,db_map_pair,the_file,export_type,where=None,style=None,fields_to_tab=None):
         """_summary_
 
@@ -864,12 +916,12 @@ class MappingActions():
         # Map info
         # id=0 'dt_map_created'=1 'dt_map_modified'=2 'mappath'=3 'tablename'=4 'mount'=5 'serial'=6
         # 'mapname'=7 'maptype'=8
-        map_info = fm.db.get_data_from_table(fm.mapper_reference_table, "*", f"tablename='{db_map_pair[1]}'")
+        map_info = fm.db.reader().get_data_from_table(fm.mapper_reference_table, "*", f"tablename='{db_map_pair[1]}'")
         if export_type == 'list':
             info_field_list = fm.db.get_column_list_of_table(fm.mapper_reference_table)
             if len(map_info) == 0:
                 return 'Could not find Map!'
-            data = fm.db.get_data_from_table(db_map_pair[1], "*", where)
+            data = fm.db.reader().get_data_from_table(db_map_pair[1], "*", where)
             try:
                 d_m1 = DataManage(data, field_list)
             except ValueError:
@@ -1004,9 +1056,15 @@ class MappingActions():
                 new_data=[]
                 for ddd in data:
                     new_data=new_data+ddd
-                fm.db.delete_data_from_table(a_map)
-                if fm.db.insert_data_to_table(a_map,new_data):
+                try:
+                    # the map is replaced only if all the selection is inserted
+                    with fm.db.transaction():
+                        fm.db.delete_data_from_table(a_map)
+                        if not fm.db.insert_data_to_table(a_map,new_data):
+                            raise ValueError("Selected data does not match the map")
                     return f"{a_map} has been edited!"
+                except (sqlite3.Error,ValueError) as eee:
+                    print(f"[red]{a_map} was not edited: {eee}")
         return ""
 
     def find_repeated_in_database(self,database,a_map):
@@ -1051,7 +1109,7 @@ class MappingActions():
             # directories do not have an id in map, and no info on file_structure so not allowing to select directories
             selected_id=selected_node.info[2]
             fm=self.get_file_map(selected_db_map_pair[0])
-            data=fm.db.get_data_from_table(selected_db_map_pair[1],"*",f'id={selected_id}')
+            data=fm.db.reader().get_data_from_table(selected_db_map_pair[1],"*",f'id={selected_id}')
         # else: # only used if allow_dir_selection=True
         #     if not self.ask_confirmation("Not valid selection, do you want to exit?",True):
         #         selected_db_map_pair, selected_id, data = self.explore_one_file_search(search,fs_list,db_map_list)
@@ -1120,7 +1178,7 @@ class MappingActions():
                 fm=self.get_file_map(selected_db_map_pair[0]) #last appended to list
                 cols=fm.db.get_column_list_of_table(selected_db_map_pair[1])
                 datasel=str(cols[1:]).replace("[",'').replace("]",'').replace("'",'')
-                data.append(fm.db.get_data_from_table(selected_db_map_pair[1],datasel,f'id={selected_node.info[2]}'))
+                data.append(fm.db.reader().get_data_from_table(selected_db_map_pair[1],datasel,f'id={selected_node.info[2]}'))
             
         return selected_db_map_pair_list, selected_id_list, data
 
@@ -1174,12 +1232,12 @@ class MappingActions():
                 # same db
                 if selected_db == db_map_pair[0]:
                     fm.db.clone_table(db_map_pair[1],table_name)
+                    fm.index_map(table_name)
                     return f'Successfully cloned {db_map_pair[1]} to {table_name} in {db_map_pair[0]}' 
                 else:
                     fmfrom=self.get_file_map(db_map_pair[0])
                     cols=fmfrom.db.get_column_list_of_table(db_map_pair[1])
                     datasel=str(cols[1:]).replace("[",'').replace("]",'').replace("'",'')
-                    all_data=fmfrom.db.get_data_from_table(db_map_pair[1],datasel)
                     fm.db.create_table(table_name,[('dt_data_created', 'DATETIME DEFAULT CURRENT_TIMESTAMP', True),
                                         ('dt_data_modified', 'DATETIME', True),
                                         ('filepath','TEXT',True), 
@@ -1190,7 +1248,18 @@ class MappingActions():
                                         ('dt_file_accessed','DATETIME',False),
                                         ('dt_file_modified','DATETIME',False),
                                         ])
-                    if fm.db.insert_data_to_table(table_name,all_data):
+                    try:
+                        # copied chunk by chunk in one commit
+                        with fm.db.transaction():
+                            for chunk in fmfrom.db.reader().iter_data_from_table(db_map_pair[1],datasel):
+                                if not fm.db.insert_data_to_table(table_name,chunk):
+                                    raise ValueError(f"Could not copy {db_map_pair[1]}")
+                        was_copied=True
+                    except (sqlite3.Error,ValueError) as eee:
+                        print(f"[red]{eee}")
+                        was_copied=False
+                    if was_copied:
+                        fm.index_map(table_name)
                         newdb_map_pair=(selected_db,table_name)
                         if return_pair:
                             return newdb_map_pair
@@ -1202,7 +1271,8 @@ class MappingActions():
 
 
     def update_map(self,db_map_pair:tuple):
-        """Updates a map
+        """Updates a map with the files added, changed or removed since it was mapped.
+        Unchanged files keep their id and md5, new and changed files are hashed by the thread.
 
         Args:
             db_map_pair (tuple): database and map pair
@@ -1210,87 +1280,26 @@ class MappingActions():
         Returns:
             str: message
         """
-        map_info_1=self.get_map_info(db_map_pair[0],db_map_pair[1])
-        # field list in map
-        # id=0	dt_data_created'=1	'dt_data_modified'=2	'filepath'=3	'filename'=4	'md5'=5	'size'=6	
-        # 'dt_file_created'=7	'dt_file_accessed'=8	'dt_file_modified'=9
-        # Map info
-        # id=0	'dt_map_created'=1	'dt_map_modified'=2	'mappath'=3	'tablename'=4	'mount'=5	'serial'=6	'mapname'=7	'maptype'=8
-        mappath=map_info_1[0][3]
-        new_tablename=db_map_pair[1]+'_update'
-        # check mount exist
         fm=self.get_file_map(db_map_pair[0])
-        mount, mount_active, mappath_exists=fm.check_if_map_device_active(fm.db,db_map_pair[1],False)
-        print("Check result:", mount, mount_active, mappath_exists)
-        # get file name and path 
-        filepath=None
-        if mount_active and mappath_exists:
-            filepath=os.path.join(mount,mappath)
-            print(filepath)
-        if not filepath:
-            return f'Mount or device is not active for {db_map_pair}'
-        # Make a shallow map
         try:
-            if not fm.db.table_exists(new_tablename):
-                fm.map_a_path_to_db(new_tablename,filepath,True,None,shallow_map=True)
-            db_map_pair_1=db_map_pair
-            db_map_pair_2=(db_map_pair[0],new_tablename)
-            differences, msg = self.shallow_compare_maps(db_map_pair_1,db_map_pair_2)
-            # Delete the shallow map
-            contains_differences=False
-            if '+' in differences.keys() and '-' in differences.keys():
-                print(differences['+'])
-                print(differences['-']) 
-                contains_differences=True
-            print(msg)
-            if not contains_differences:
-                msg= "[yellow]No Comparison Made[\yellow]\n"+msg
-                return msg
-            found_differences=False
-            for _,value in differences.items():
-                if len(value)>0:
-                    found_differences=True
-                    break
-            if not found_differences:
-                # # reorganize ids in table
-                fm.db.reenumerate_id_sequence(db_map_pair_1[1])
-                # delete shallow map
-                fm.delete_map(new_tablename)
-                msg= "[yellow]No differences Found[/yellow]\n"+msg
-                return msg
-            if not self.ask_confirmation(f"Replace differences in map {db_map_pair_1[1]}?",False):
-                fm.db.reenumerate_id_sequence(db_map_pair_1[1])
-                fm.db.reenumerate_id_sequence(new_tablename)
-                return '[yellow] Map not Updated! keeping shallow map for update. Delete map manually or restart update to use map already created.'
-            data_to_add=[]
-
-            
-            fields=fm.db.get_column_list_of_table(new_tablename)
-            nf=[iii for iii in fields if iii!='id']
-            self.shallow_to_deep(db_map_pair_2)
-            where = "id IN ("+', '.join([str(ddd) for ddd in differences['+_id']])+")"
-            what = ', '.join(nf)
-            new_data=fm.db.get_data_from_table(new_tablename,what,where)
-            if len(new_data)>0:
-                data_to_add=new_data
-            # remove files in - from db
-            for an_id in differences['-_id']:
-                where=f'id = {an_id}'
-                fm.db.delete_data_from_table(db_map_pair_1[1],where) 
-            # Add new data to table    
-            if fm.db.insert_data_to_table(db_map_pair_1[1],data_to_add):
-                print(f"Inserted {len(data_to_add)} new data to the table")
-            # update map data modified
-            fm.db.edit_value_in_table(fm.mapper_reference_table,map_info_1[0][0],'dt_map_modified',datetime.now())
-            # delete shallow map
-            fm.delete_map(new_tablename)
-            # # reorganize ids in table
-            fm.db.reenumerate_id_sequence(db_map_pair[1])
+            trust_dir_mtimes=self.ask_confirmation(
+                "Trust directory modification dates? (faster, files changed inside unchanged directories are not detected)",False
+            )
+            deltas=fm.update_map_incremental(
+                db_map_pair[1],True,lambda _: self.ask_confirmation(f"Replace differences in map {db_map_pair[1]}?",False),
+                trust_dir_mtimes
+            )
+            if deltas is None:
+                return f'[yellow]Map {db_map_pair[1]} not Updated! Mount or device is not active, or update was cancelled'
+            msg=f"{len(deltas['+'])} new, {len(deltas['~'])} changed, {len(deltas['-'])} removed files"
+            if len(deltas['+'])+len(deltas['~'])==0:
+                if len(deltas['-'])==0:
+                    return "[yellow]No differences Found[/yellow]\n"+msg
+                return "[green]Map Updated[/green]\n"+msg
             # start thread
-            msg = fm.remap_map_in_thread_to_db(db_map_pair[1],None,True)
+            msg = msg+"\n"+str(fm.remap_map_in_thread_to_db(db_map_pair[1],None,True))
         except (KeyboardInterrupt,ValueError,TypeError) as eee:
             print(f'Something Wrong:{eee}')
-            fm.delete_map(new_tablename)
             msg="Update interrupted"
         return msg
     
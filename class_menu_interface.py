@@ -883,7 +883,7 @@ class TerminalMenuInterface():
                                 where=where+f' OR filepath LIKE "%{trace}%"'
                         cols=fm.db.get_column_list_of_table(db_map_pair[1])
                         datasel=str(cols[1:]).replace("[",'').replace("]",'').replace("'",'')
-                        selected_data=fm.db.get_data_from_table(db_map_pair[1],datasel,where)
+                        selected_data=fm.db.reader().get_data_from_table(db_map_pair[1],datasel,where)
                         if len(selected_data)>0:
                             fm.map_a_selection(selection_name,db_map_pair[1],selected_data,MAP_TYPES_LIST[1])
                             return f'[green] Following selection maps built:{selection_name}'
@@ -1045,19 +1045,9 @@ class TerminalMenuInterface():
         (ans_txt, msg, is_valid)=A_C.get_sql_input()
         print(f'Searching for:{ans_txt}')
         if ans_txt not in ['',None] and is_valid:
-            fs_list=[]
-            db_map_list=[]
-            # data_list=[]
             search=f'{ans_txt} search'
-            for db_map_pair in selected_db_map_pair_list:
-                where=ans_txt #f"filename LIKE '%{ans_txt}%'"
-                # including Id is important
-                fs=self.cma.map_to_file_structure(db_map_pair[0],db_map_pair[1],where=where,fields_to_tab=['id'],sort_by=None,ascending=True)
-                print(f'Found {len(fs)==1} in {db_map_pair[1]}')
-                if len(fs)>0:
-                    fs_list.append(fs.copy())
-                    db_map_list.append(db_map_pair)
-                    del fs
+            # all the maps at once, including Id is important
+            fs_list,db_map_list=self.cma.search_maps(selected_db_map_pair_list,where=ans_txt,fields_to_tab=['id'])
             if explore:
                 if len(fs_list)==0:
                     fs_list=[(f'Nothing Found for {ans_txt}',0)]
@@ -1364,6 +1354,7 @@ class TerminalMenuInterface():
         """Interactive menu backups"""
         choices_hints = {
             'Map A 2 Map B compare':'Compares two maps to find which files are present in A, in B and A&B',
+            'Find Repeated Across Maps':'Files with the same md5 sum present in more than one of the selected maps, in any database',
             'Backup of Map base': "Maps the actual end directory and compares it to the backup map and makes changes of differences from actual base directory of the map to the backup.",
             'Backup of Selection Map': "Makes backup of files in map, unless there are already files in the end directory. If so compares end directory with the map and makes actions",
             'Backup compare': "Maps actual backup folder and compares to backup map",
@@ -1410,9 +1401,42 @@ class TerminalMenuInterface():
                 self.ba.backup_compare(db_map_pair)
             elif answers['backup']=='Map A 2 Map B compare':
                 return self.selection_of_2maps_to_compare()
+            elif answers['backup']=='Find Repeated Across Maps':
+                msg=self.menu_find_repeated_across_maps()
             elif answers['backup']=='Back':
                 return ''
     
+    def menu_find_repeated_across_maps(self):
+        """Finds the files repeated in several maps and browses them to make selection maps"""
+        selected_db_map_pair_list=self.menu_select_multiple_database_map()
+        if len(selected_db_map_pair_list)<2:
+            return 'Select at least two maps!'
+        ids_per_pair={}
+        md5_count=0
+        for _,db_map_id_list in self.cma.find_repeated_across_databases(selected_db_map_pair_list):
+            md5_count=md5_count+1
+            for database,a_map,an_id in db_map_id_list:
+                ids_per_pair.setdefault((database,a_map),[]).append(an_id)
+        if md5_count==0:
+            return '[green]No Repeated Files across the selected maps'
+        print(f'Found {md5_count} files repeated across {len(ids_per_pair)} maps')
+        fs_list=[]
+        db_map_list=[]
+        for db_map_pair,id_list in ids_per_pair.items():
+            where="id IN ("+', '.join([str(an_id) for an_id in id_list])+")"
+            fs=self.cma.map_to_file_structure(db_map_pair[0],db_map_pair[1],where=where,fields_to_tab=['id'],sort_by=None,ascending=True)
+            if len(fs)>0:
+                fs_list.append(fs.copy())
+                db_map_list.append(db_map_pair)
+        search='Repeated Across Maps'
+        selected_db_map_pair, _, data=self.cma.explore_multiple_file_search(search,fs_list,db_map_list)
+        selection_name=str(datetime.now()).replace(" ","_").replace("-","").replace(":","").replace(".","")
+        selection_name=selection_name+"_selection"
+        selections=self.cma.make_selection_maps(selection_name,selected_db_map_pair,data)
+        if selections:
+            return f'[green] Following selection maps built:{selections}'
+        return ''
+
     def get_filter_for_map(self,db_map_pair):
         """Select a filter for a map. Will check if filtered map has elements
 
@@ -1430,7 +1454,7 @@ class TerminalMenuInterface():
             if ans_txt not in ['',None] and is_valid:
                 where1=ans_txt
                 fm=self.cma.get_file_map(db_map_pair[0])
-                data=fm.db.get_data_from_table(db_map_pair[1],"*",where1)
+                data=fm.db.reader().get_data_from_table(db_map_pair[1],"*",where1)
                 if len(data) == 0:
                     print(f'[red]Map {db_map_pair[1]} has No files with {ans_txt} filter!')
                 else:
@@ -2052,7 +2076,7 @@ class TerminalMenuInterface():
             (ans_txt, msg, is_valid)=A_C.get_sql_input()
             if is_valid:
                 fm=self.cma.get_file_map(db_map_pair[0])
-                data=fm.db.get_data_from_table(db_map_pair[1],'filepath, filename',ans_txt)
+                data=fm.db.reader().get_data_from_table(db_map_pair[1],'filepath, filename',ans_txt)
                 if len(data)>0:
                     files_list=[]
                     for (filepath, filename) in data:
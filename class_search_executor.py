@@ -0,0 +1,166 @@
+"""
+Parallel search of several maps with streamed results
+########################
+# F.garcia
+# creation: 18.10.2026
+########################
+"""
+
+import queue
+import threading
+import concurrent.futures
+
+from class_sqlite_database import SQLiteDatabase, DATA_CHUNK_SIZE
+
+SEARCH_WORKERS = 6  # maps searched at the same time, each on its own read connection
+SEARCH_QUEUE_SIZE = 4  # chunks waiting per worker before the searches wait for the consumer
+QUEUE_PUT_TIMEOUT = 0.5  # seconds to wait on a full queue before checking the kill event
+
+
+class FileStructureBuilder:
+    """Builds the file structure of a map row by row, as FileStructurer does from a whole dataframe.
+    Directories are {name: [children]} dictionaries and files (filename, size, *additional) tuples.
+    """
+
+    def __init__(self, name: str):
+        """Builder
+
+        Args:
+            name (str): name of the structure, the map path
+        """
+        self.name = name
+        self.file_list = []
+        # children list of every directory added, by its standard path
+        self._dirs = {"": self.file_list}
+        self.files_added = 0
+
+    @staticmethod
+    def get_standard_path(path: str) -> str:
+        """Path separated by single "/", without leading or trailing separators"""
+        if not path:
+            return ""
+        path = str(path).replace("\\", "/")
+        return "/".join([part for part in path.split("/") if part != ""])
+
+    def get_children(self, path: str) -> list:
+        """Children list of a directory, adding it and its parents if missing
+
+        Args:
+            path (str): standard path
+
+        Returns:
+            list: children of the directory
+        """
+        children = self._dirs.get(path)
+        if children is not None:
+            return children
+        parent, _, name = path.rpartition("/")
+        children = []
+        self.get_children(parent).append({name: children})
+        self._dirs[path] = children
+        return children
+
+    def add_rows(self, rows: list):
+        """Adds files to the structure
+
+        Args:
+            rows (list[tuple]): (filepath, filename, size, *additional)
+        """
+        for row in rows:
+            self.get_children(self.get_standard_path(row[0])).append(tuple(row[1:]))
+        self.files_added = self.files_added + len(rows)
+
+    def get_file_structure(self) -> dict:
+        """File structure as map_to_file_structure
+
+        Returns:
+            dict: {name: [file structure list]}
+        """
+        return {self.name: self.file_list}
+
+
+class SearchExecutor:
+    """Runs the search of each map on its own read only connection in a thread pool.
+    The chunks of rows are streamed to the caller as they arrive, so several maps take about
+    as long as the slowest one and nothing waits for a whole map to be loaded.
+    """
+
+    def __init__(self, workers: int = SEARCH_WORKERS, chunk_size: int = DATA_CHUNK_SIZE):
+        """Executor
+
+        Args:
+            workers (int, optional): maps searched at the same time. Defaults to SEARCH_WORKERS.
+            chunk_size (int, optional): rows per chunk. Defaults to DATA_CHUNK_SIZE.
+        """
+        self.workers = max(1, workers)
+        self.chunk_size = chunk_size
+        self.kill_event = threading.Event()
+
+    def put_result(self, result_queue: queue.Queue, item: tuple) -> bool:
+        """Puts a result in the queue, waiting while it is full
+
+        Returns:
+            bool: False if the search was stopped
+        """
+        while not self.kill_event.is_set():
+            try:
+                result_queue.put(item, timeout=QUEUE_PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def search_one(self, job_index: int, db_path: str, sql: str, result_queue: queue.Queue):
+        """Streams the rows of one query to the queue, the job ends with a None chunk
+
+        Args:
+            job_index (int): position of the job
+            db_path (str): database file
+            sql (str): query
+            result_queue (queue.Queue): (job_index, chunk) results
+        """
+        a_reader = None
+        try:
+            # a connection of its own, the pool threads do not keep readers open after the search
+            a_reader = SQLiteDatabase(db_path, False, None, None, "reader")
+            for chunk in a_reader.iter_data_sql_command(sql, (), self.chunk_size):
+                if not self.put_result(result_queue, (job_index, chunk)):
+                    return
+        except Exception as eee:  # pylint: disable=broad-except
+            print(f"Search in {db_path} failed: {eee}")
+        finally:
+            if a_reader is not None:
+                a_reader.close_connection()
+            self.put_result(result_queue, (job_index, None))
+
+    def iter_search(self, job_list: list):
+        """Searches all the jobs in parallel
+
+        Args:
+            job_list (list[tuple]): (database file, query)
+
+        Yields:
+            tuple: (job_index, chunk of rows), chunk is None when the job finished
+        """
+        self.kill_event.clear()
+        if len(job_list) == 0:
+            return
+        result_queue = queue.Queue(maxsize=self.workers * SEARCH_QUEUE_SIZE)
+        pending = len(job_list)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(self.workers, pending))
+        try:
+            for job_index, (db_path, sql) in enumerate(job_list):
+                executor.submit(self.search_one, job_index, db_path, sql, result_queue)
+            while pending > 0:
+                job_index, chunk = result_queue.get()
+                if chunk is None:
+                    pending = pending - 1
+                yield job_index, chunk
+        finally:
+            # the caller may stop before the end
+            self.kill_event.set()
+            executor.shutdown(wait=True)
+
+    def stop(self):
+        """Stops the running searches"""
+        self.kill_event.set()
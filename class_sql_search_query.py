@@ -1,6 +1,8 @@
 import re
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
+
+from class_sqlite_database import SQLiteDatabase
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
@@ -278,6 +280,19 @@ ALLOWED_DICT={"id":{'operators':['!=','<>','=','==','>=','<=','<','>'],'format':
               "dt_file_modified":{'operators':['!=','<>','=','==','>=','<=','<','>','~='],'format':str(datetime)},
               }
 ALLOWED_OPERATIONS=list(ALLOWED_DICT.keys())
+# LIKE predicates of get_sql_for_operation that a trigram search index can answer, string literals are skipped
+SEARCH_INDEX_PREDICATE=re.compile(
+    r"""(?P<literal>'[^']*'|"[^"]*")"""
+    r"|(?<![\w.])(?:UPPER\((?P<upper_column>filename|filepath)\)|(?P<column>filename|filepath))"
+    r""" (?P<negated>NOT )?LIKE (?P<pattern>'[^']*'|"[^"]*")"""
+)
+SEARCH_INDEX_MIN_TEXT=3 # trigram index: patterns need 3 characters without wildcards
+# date predicates of get_sql_for_operation, on a typed map the dates are nanoseconds since epoch
+TYPED_DATE_PREDICATE=re.compile(
+    r"""(?P<literal>'[^']*'|"[^"]*")"""
+    r"|(?<![\w.])(?:(?P<function>DATE|TIME|UPPER)\()?(?P<column>dt_\w+)(?(function)\))"
+    r"(?: (?P<operator>>=|<=|=|<|>) '(?P<value>[^']*)')?"
+)
 
 class SQLSearchGenerator:
     def __init__(self):
@@ -780,6 +795,8 @@ class SQLSearchGenerator:
 
     @staticmethod
     def quotes(operation:str,operator:str,q_txt:str):
+        # DATE(operation) and TIME(operation) have the format of the operation
+        operation=re.sub(r"^(?:DATE|TIME)\((\w+)\)$",r"\1",operation)
         if operation in ALLOWED_OPERATIONS:
             if ALLOWED_DICT[operation]['format'] in [str(int),str(float)]:
                 return q_txt
@@ -825,6 +842,82 @@ class SQLSearchGenerator:
             sql=sql+ f"{operation} {' OR ' if operator=='||' else ' AND '} {self.quotes(operation,operator,q_txt)}"
         return sql
 
+    @staticmethod
+    def route_to_search_index(sql:str,search_table:str)->str:
+        """Routes the LIKE and NOT LIKE of filename and filepath ('=', '~=', '!=', '<>' operators) through
+        the trigram search index of a map. The index gives the candidate ids and the original predicate is kept,
+        so the rows found are the same as without the index. Patterns with less than SEARCH_INDEX_MIN_TEXT
+        characters between wildcards are not routed, the index can not narrow them.
+
+        Args:
+            sql (str): where sql of get_sql_from_text_input
+            search_table (str): quoted search index table of the map, with rowid the id of the map
+
+        Returns:
+            str: where sql using the search index
+        """
+        if not sql:
+            return sql
+        def route_predicate(match):
+            if match.group('literal') is not None:
+                return match.group(0)
+            pattern=match.group('pattern')
+            if not re.search(f"[^%_]{{{SEARCH_INDEX_MIN_TEXT}}}",pattern[1:-1]):
+                return match.group(0)
+            column=match.group('upper_column') or match.group('column')
+            like_sql=match.group(0).replace(' NOT LIKE ',' LIKE ')
+            routed_sql=f"(id IN (SELECT rowid FROM {search_table} WHERE {column} LIKE {pattern}) AND {like_sql})"
+            if match.group('negated'):
+                return 'NOT '+routed_sql
+            return routed_sql
+        return SEARCH_INDEX_PREDICATE.sub(route_predicate,sql)
+
+    @staticmethod
+    def route_to_typed_storage(sql:str)->str:
+        """Converts the date predicates of a where sql for the storage of a typed map, where the dates are
+        nanoseconds since epoch. Comparisons with a date become numeric comparisons, and DATE() comparisons
+        numeric ranges of the day, so the date indexes are used. Other uses of a date column read its text.
+
+        Args:
+            sql (str): where sql of get_sql_from_text_input
+
+        Returns:
+            str: where sql on the typed storage
+        """
+        if not sql:
+            return sql
+        def route_predicate(match):
+            if match.group('literal') is not None:
+                return match.group(0)
+            column=match.group('column')
+            function=match.group('function')
+            operator=match.group('operator')
+            if operator is not None and function is None:
+                value_ns=SQLiteDatabase.datetime_to_ns(match.group('value'))
+                if value_ns is not None:
+                    return f"{column} {operator} {value_ns}"
+            if operator is not None and function == 'DATE':
+                try:
+                    day=datetime.fromisoformat(match.group('value'))
+                except ValueError:
+                    day=None
+                if day is not None:
+                    day_start=SQLiteDatabase.datetime_to_ns(day)
+                    next_day=SQLiteDatabase.datetime_to_ns(day+timedelta(days=1))
+                    day_ranges={'>=':f"{column} >= {day_start}",
+                                '>':f"{column} >= {next_day}",
+                                '<':f"{column} < {day_start}",
+                                '<=':f"{column} < {next_day}",
+                                '=':f"({column} >= {day_start} AND {column} < {next_day})"}
+                    return day_ranges[operator]
+            date_sql=f"fm_ns_to_datetime({column})"
+            if function is not None:
+                date_sql=f"{function}({date_sql})"
+            if operator is not None:
+                date_sql=f"{date_sql} {operator} '{match.group('value')}'"
+            return date_sql
+        return TYPED_DATE_PREDICATE.sub(route_predicate,sql)
+
     def get_where_sql_of_operations(self,the_operations:list,and_dict:dict,or_dict:dict,sub_dict:dict,sql:str=None):
         """Generates SQL string for where using The operations list for all operation types
 
@@ -6,47 +6,150 @@
 """
 
 import os
-import sqlite3
 import time
+import hashlib
+import uuid
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+from urllib.request import pathname2url
 from cryptography.fernet import Fernet
 
-WAIT_TIME_WRITING = 0.05  # seconds to wait after writting
+from class_encrypted_container import EncryptedContainer, CONTAINER_SUFFIX
+
+# pragmas set on each connection
+CONNECTION_PROFILES = {
+    "writer": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -65536,  # KiB
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,  # ms
+        "recursive_triggers": 1,  # the directory tree of the normalized maps adds the parents recursively
+    },
+    "reader": {
+        "cache_size": -32768,  # KiB
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,  # ms
+        "query_only": 1,
+        "read_uncommitted": 1,  # in-memory sessions: readers do not lock the shared cache tables
+    },
+}
+# "memory": encrypted databases are decrypted into an in-memory database shared by the connections of the process,
+# "disk": into the database file
+SESSION_TYPES = ["memory", "disk"]
+ENCRYPTED_SESSION = "memory"
+DATA_CHUNK_SIZE = 10000  # rows fetched at once when streaming query results
+WRITE_RETRIES = 5  # times a write is retried while the database is busy
+WRITE_RETRY_WAIT = 0.1  # seconds, multiplied by the attempt number
+# all the connections of the process writing on the same file share a lock
+_WRITE_LOCKS = {}
+_WRITE_LOCKS_LOCK = threading.Lock()
+# in-memory sessions open in the process: {database file: shared cache uri}
+_MEMORY_SESSIONS = {}
+# connections of the process encrypting a database decrypted on disk: {database file: count},
+# the file is encrypted when the last one closes
+_DISK_SESSIONS = {}
+# schema generation of each database file, incremented by the DDL of any connection of the process
+_SCHEMA_GENERATIONS = {}
+# sql functions of each connection, used by the triggers and views of the normalized and typed maps
+SQL_FUNCTIONS = {
+    "fm_path_parent": "path_parent",
+    "fm_path_name": "path_name",
+    "fm_datetime_to_ns": "datetime_to_ns",
+    "fm_ns_to_datetime": "ns_to_datetime",
+}
+# range of a sqlite INTEGER, dates as nanoseconds since epoch out of it (after 2262) are kept at the limits
+EPOCH_NS_MIN = -(2**63)
+EPOCH_NS_MAX = 2**63 - 1
+# temporary tables of the id sets, only visible to the connection that loaded them
+ID_SET_PREFIX = "__id_set_"
+ID_SET_DEFAULT = "ids"
 
 
 class SQLiteDatabase:
     """Class to handle SQLite3 databases"""
 
-    def __init__(self, db_path, encrypt=False, akey=None, password=None):
+    def __init__(self, db_path, encrypt=False, akey=None, password=None, profile="writer", session=ENCRYPTED_SESSION):
+        """Database connection
+
+        Args:
+            db_path (str): database file
+            encrypt (bool, optional): encrypt the file when closing. Defaults to False.
+            akey (bytes, optional): encryption key. Defaults to None.
+            password (str, optional): password. Defaults to None.
+            profile (str, optional): one of CONNECTION_PROFILES, "reader" connections are read only.
+            Defaults to "writer".
+            session (str, optional): one of SESSION_TYPES, where an encrypted database is decrypted.
+            Defaults to ENCRYPTED_SESSION.
+        """
+        if profile not in CONNECTION_PROFILES:
+            raise ValueError(f"Connection profile {profile} not in {list(CONNECTION_PROFILES)}")
+        if session not in SESSION_TYPES:
+            raise ValueError(f"Session {session} not in {SESSION_TYPES}")
+        if session == "memory" and not hasattr(sqlite3.Connection, "deserialize"):
+            # python < 3.11
+            session = "disk"
         self.conn = None
         self.db_path = db_path
+        self.profile = profile
         self.encrypt = encrypt
         self.key = akey
         self.password = password
         self.db_is_encrypted = False
         if encrypt and akey:
             self.db_is_encrypted = True
+        self.session = session
+        # shared cache uri when connected to an in-memory session, the owner loaded it and saves it
+        self.memory_uri = None
+        self.session_owner = False
+        # counted in _DISK_SESSIONS
+        self.disk_session_owner = False
+        # table list, column descriptions and statements, valid while the schema generation does not change
+        self.schema_cache = {}
+        self.schema_generation = None
+        self.transaction_depth = 0
+        self.write_lock = self.get_write_lock(db_path)
+        self._readers = threading.local()
+        self._reader_list = []
         self.create_connection()
 
+    def generate_key(self) -> bool:
+        """Generates an encryption key if there is none
+
+        Returns:
+            bool: if a new key was generated.
+        """
+        if self.key:
+            return False
+        self.key = Fernet.generate_key()
+        return True
+
+    def get_container_path(self) -> str:
+        """Encrypted container kept next to the database file while it is decrypted"""
+        return self.db_path + CONTAINER_SUFFIX
+
     def encrypt_db(self):
-        """Encrypt AES-256 the database.
+        """Encrypt AES-256 the database in a chunked container, only the blocks changed since decrypting
+        are encrypted again. Call it with the connection closed, close_connection does it when encrypt is set.
 
         Returns:
             bool: if a new key was generated.
         """
         self.encrypt = True
-        new_key = False
         # Generate a new encryption key and wrap it in a Fernet object
-        if self.encrypt and not self.key:
-            self.key = Fernet.generate_key()
-            new_key = True
-        if self.encrypt:
-            fernet = Fernet(self.key)
-
-            # Encrypt the database file using AES-256 encryption
-            with open(self.db_path, "rb") as fff:
-                encrypted_data = fernet.encrypt(fff.read())
-            with open(self.db_path, "wb") as fff:
-                fff.write(encrypted_data)
+        new_key = self.generate_key()
+        self.checkpoint()
+        if EncryptedContainer.file_format(self.db_path) not in ["sqlite", "empty"]:
+            # already encrypted
+            return new_key
+        container_path = self.get_container_path()
+        EncryptedContainer(container_path, self.key).encrypt_from(self.db_path)
+        os.replace(container_path, self.db_path)
+        EncryptedContainer.sync_directory(self.db_path)
         return new_key
 
     def set_key(self, akey):
@@ -58,18 +161,25 @@ class SQLiteDatabase:
         self.key = akey
 
     def decrypt_db(self):
-        """Decrypt the database file using AES-256 encryption."""
-        if self.key:
+        """Decrypt the database file using AES-256 encryption.
+        A chunked container is moved next to the database and decrypted block by block, files of the
+        whole file encryption are decrypted in memory and converted to a container when encrypting again.
+        A database already decrypted (opened by another connection or left by a crash) is not touched."""
+        if not self.key:
+            return
+        file_format = EncryptedContainer.file_format(self.db_path)
+        if file_format == "container":
+            container_path = self.get_container_path()
+            os.replace(self.db_path, container_path)
+            EncryptedContainer(container_path, self.key).decrypt_to(self.db_path)
+        elif file_format == "fernet":
             fernet = Fernet(self.key)
             # Decrypt the database file using AES-256 encryption
             with open(self.db_path, "rb") as fff:
                 encrypted_data = fff.read()
-            try:
-                decrypted_data = fernet.decrypt(encrypted_data)
-                with open(self.db_path, "wb") as fff:
-                    fff.write(decrypted_data)
-            except Exception as eee:
-                raise eee
+            decrypted_data = fernet.decrypt(encrypted_data)
+            with open(self.db_path, "wb") as fff:
+                fff.write(decrypted_data)
 
     def save_key_to_file(self, key_path):
         """Save the key in a file
@@ -89,14 +199,304 @@ class SQLiteDatabase:
             self.key = fff.read()
 
     def create_connection(self):
-        """Create a new connection to the database"""
-        if self.db_is_encrypted:
+        """Create a new connection to the database.
+        Connections to a database with an in-memory session open in the process join the session."""
+        self.memory_uri = _MEMORY_SESSIONS.get(self.path_key(self.db_path))
+        if self.memory_uri is None and self.db_is_encrypted:
+            if self.session == "memory" and self.profile == "writer":
+                self.open_memory_session()
+                return
             self.decrypt_db()
         try:
-            self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
-            print(f"Connected to {self.db_path}")
+            if self.memory_uri:
+                self.conn = sqlite3.connect(self.memory_uri, uri=True, check_same_thread=False)
+            elif self.profile == "reader":
+                uri = f"file:{pathname2url(os.path.abspath(self.db_path))}?mode=ro"
+                self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            else:
+                self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+                print(f"Connected to {self.db_path}")
+            self.set_pragmas(CONNECTION_PROFILES[self.profile])
+            self.register_functions()
         except sqlite3.Error as eee:
             print(f"Could not connect to {self.db_path} {eee}")
+            return
+        if self.encrypt and not self.memory_uri and not self.disk_session_owner:
+            with _WRITE_LOCKS_LOCK:
+                key = self.path_key(self.db_path)
+                _DISK_SESSIONS[key] = _DISK_SESSIONS.get(key, 0) + 1
+            self.disk_session_owner = True
+
+    def set_pragmas(self, pragma_dict: dict):
+        """Sets the pragmas of the connection
+
+        Args:
+            pragma_dict (dict): {pragma: value}
+        """
+        c = self.conn.cursor()
+        try:
+            for pragma, value in pragma_dict.items():
+                c.execute(f"PRAGMA {pragma} = {value}")
+        finally:
+            c.close()
+
+    def register_functions(self):
+        """Registers the sql functions of SQL_FUNCTIONS in the connection"""
+        for sql_name, method_name in SQL_FUNCTIONS.items():
+            self.conn.create_function(sql_name, 1, getattr(self, method_name), deterministic=True)
+
+    @staticmethod
+    def path_parent(path: str) -> str:
+        """Parent directory of a map filepath, None for the root ('', '/' or '\\')"""
+        if path is None:
+            return None
+        path = str(path)
+        stripped = path.rstrip("/\\")
+        if stripped == "":
+            return None
+        sep_index = max(stripped.rfind("/"), stripped.rfind("\\"))
+        if sep_index < 0:
+            return ""
+        if sep_index == 0:
+            return stripped[0]
+        return stripped[:sep_index]
+
+    @staticmethod
+    def path_name(path: str) -> str:
+        """Last name of a map filepath, the path itself for the root"""
+        if path is None:
+            return None
+        path = str(path)
+        stripped = path.rstrip("/\\")
+        if stripped == "":
+            return path
+        return stripped[max(stripped.rfind("/"), stripped.rfind("\\")) + 1 :]
+
+    @staticmethod
+    def datetime_to_ns(value) -> int:
+        """Nanoseconds since epoch of a date as the maps store it, a datetime or its text in local time.
+        Integers are already nanoseconds and are returned as they are.
+
+        Args:
+            value (datetime|str|int): date
+
+        Returns:
+            int: nanoseconds since epoch, None if the value is not a date
+        """
+        if value is None or isinstance(value, int):
+            return value
+        if isinstance(value, datetime):
+            a_datetime = value
+        else:
+            try:
+                a_datetime = datetime.fromisoformat(str(value).strip())
+            except ValueError:
+                return None
+        try:
+            seconds = int(a_datetime.replace(microsecond=0).timestamp())
+        except (OverflowError, OSError, ValueError):
+            return None
+        return min(max(seconds * 10**9 + a_datetime.microsecond * 1000, EPOCH_NS_MIN), EPOCH_NS_MAX)
+
+    @staticmethod
+    def ns_to_datetime(value) -> str:
+        """Text of a date stored as nanoseconds since epoch, as sqlite stores a datetime of the maps
+
+        Args:
+            value (int): nanoseconds since epoch
+
+        Returns:
+            str: local date "YYYY-MM-DD HH:MM:SS[.ffffff]", the value itself if it is not a number
+        """
+        if value is None:
+            return None
+        try:
+            seconds, rest = divmod(int(value), 10**9)
+        except (TypeError, ValueError):
+            return value
+        try:
+            return str(datetime.fromtimestamp(seconds) + timedelta(microseconds=rest // 1000))
+        except (OverflowError, OSError, ValueError):
+            return None
+
+    def open_memory_session(self):
+        """Decrypts the database into an in-memory database shared by the connections of the process.
+        The plain database is never written to disk, save_memory_session encrypts it back."""
+        key = self.path_key(self.db_path)
+        # a new name for each session, connections left open by a previous session keep their own database
+        name = f"filemapper_{hashlib.sha1(key.encode()).hexdigest()[:16]}_{uuid.uuid4().hex[:8]}"
+        uri = f"file:{name}?mode=memory&cache=shared"
+        try:
+            plain_data = self.read_plain_data()
+            self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            if len(plain_data) > 0:
+                # deserialized databases are private to the connection, they are copied to the shared one
+                loader = sqlite3.connect(":memory:")
+                loader.deserialize(plain_data)
+                loader.backup(self.conn)
+                loader.close()
+            del plain_data
+            self.set_pragmas(CONNECTION_PROFILES[self.profile])
+            self.register_functions()
+        except sqlite3.Error as eee:
+            print(f"Could not open {self.db_path} in memory {eee}")
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+            return
+        _MEMORY_SESSIONS[key] = uri
+        self.memory_uri = uri
+        self.session_owner = True
+        print(f"Connected to {self.db_path} (in memory)")
+
+    def read_plain_data(self) -> bytes:
+        """Plain database from the encrypted file, decrypted in memory
+
+        Returns:
+            bytes: serialized database, empty for a new database
+        """
+        file_format = EncryptedContainer.file_format(self.db_path)
+        if file_format == "container":
+            return EncryptedContainer(self.db_path, self.key).decrypt_bytes()
+        if file_format == "fernet":
+            with open(self.db_path, "rb") as fff:
+                return Fernet(self.key).decrypt(fff.read())
+        if file_format == "sqlite":
+            # left decrypted by a disk session
+            with open(self.db_path, "rb") as fff:
+                return fff.read()
+        return b""
+
+    def save_memory_session(self):
+        """Serializes the in-memory session and encrypts it in the database file, only the changed blocks.
+        The database file is the only copy, the container is written to a temporary file, synced and moved over it
+        (see EncryptedContainer.encrypt_stream), a crash while saving leaves the previous save."""
+        if not self.session_owner or self.conn is None:
+            return
+        with self.write_lock:
+            plain_data = self.conn.serialize()
+        EncryptedContainer(self.db_path, self.key).encrypt_bytes(plain_data)
+        container_path = self.get_container_path()
+        if os.path.exists(container_path):
+            # container of a previous disk session
+            os.remove(container_path)
+
+    @staticmethod
+    def path_key(db_path: str) -> str:
+        """Same key for all the paths of a database file"""
+        return os.path.normcase(os.path.abspath(db_path))
+
+    @staticmethod
+    def get_write_lock(db_path: str) -> threading.RLock:
+        """Lock shared by all the connections of the process to the same database file"""
+        with _WRITE_LOCKS_LOCK:
+            key = SQLiteDatabase.path_key(db_path)
+            if key not in _WRITE_LOCKS:
+                _WRITE_LOCKS[key] = threading.RLock()
+            return _WRITE_LOCKS[key]
+
+    def reader(self) -> "SQLiteDatabase":
+        """Read only connection to the same database for the calling thread.
+        For the UI, searches and comparisons, so they do not wait for the writers (WAL mode).
+
+        Returns:
+            SQLiteDatabase: read only database, this one if it is already a reader.
+        """
+        if self.profile == "reader":
+            return self
+        a_reader = getattr(self._readers, "db", None)
+        if a_reader is None or a_reader.conn is None:
+            # the file is already decrypted by this connection
+            a_reader = SQLiteDatabase(self.db_path, False, None, None, "reader")
+            self._readers.db = a_reader
+            with self.write_lock:
+                self._reader_list.append(a_reader)
+        return a_reader
+
+    def close_readers(self):
+        """Closes the read only connections given by reader"""
+        with self.write_lock:
+            for a_reader in self._reader_list:
+                a_reader.close_connection()
+            self._reader_list = []
+        self._readers = threading.local()
+
+    def attach_database(self, db_path: str, schema: str) -> bool:
+        """Attaches another database file to this connection, so one query can join its tables.
+        Read only on a reader connection. Databases with an in-memory session are attached through its shared
+        cache uri, other encrypted files can not be attached.
+
+        Args:
+            db_path (str): database file
+            schema (str): name of the attached database in the queries, schema."table"
+
+        Returns:
+            bool: True if attached
+        """
+        try:
+            session_uri = _MEMORY_SESSIONS.get(self.path_key(db_path))
+            if session_uri:
+                db_path = session_uri
+            elif self.profile == "reader":
+                db_path = f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro"
+            self.conn.execute(f"ATTACH DATABASE ? AS {self.quotes(schema)}", (db_path,))
+        except sqlite3.Error as eee:
+            print(f"Could not attach {db_path}: {eee}")
+            return False
+        return True
+
+    def detach_database(self, schema: str):
+        """Detaches a database attached with attach_database
+
+        Args:
+            schema (str): name of the attached database
+        """
+        try:
+            self.conn.execute(f"DETACH DATABASE {self.quotes(schema)}")
+        except sqlite3.Error as eee:
+            print(f"Could not detach {schema}: {eee}")
+
+    @staticmethod
+    def is_busy_error(eee: sqlite3.Error) -> bool:
+        """True if the error is because another connection is writing"""
+        txt = str(eee).lower()
+        return "locked" in txt or "busy" in txt
+
+    def execute_write(self, sql: str, parameters=(), many: bool = False) -> int:
+        """Executes a writing statement holding the write lock of the database file,
+        retrying while the database is busy. Commits unless inside a transaction.
+
+        Args:
+            sql (str): statement
+            parameters (tuple | list, optional): parameters, list of parameters if many. Defaults to ().
+            many (bool, optional): executemany. Defaults to False.
+
+        Raises:
+            sqlite3.Error: when the statement fails
+
+        Returns:
+            int: rows changed
+        """
+        with self.write_lock:
+            attempt = 0
+            while True:
+                c = self.conn.cursor()
+                try:
+                    if many:
+                        c.executemany(sql, parameters)
+                    else:
+                        c.execute(sql, parameters)
+                    rowcount = c.rowcount
+                    self.commit()
+                    return rowcount
+                except sqlite3.OperationalError as eee:
+                    # inside a transaction the whole transaction has to be repeated
+                    if not self.is_busy_error(eee) or self.transaction_depth > 0 or attempt >= WRITE_RETRIES:
+                        raise
+                    attempt = attempt + 1
+                finally:
+                    c.close()
+                time.sleep(WRITE_RETRY_WAIT * attempt)
 
     def create_table(self, table_name: str, columns: list[tuple], temporary: bool = False):
         """Creates table if it does not exist
@@ -116,11 +516,10 @@ class SQLiteDatabase:
 
         # Create the table
         try:
-            c = self.conn.cursor()
             temp = ""
             if temporary:
                 temp = "TEMPORARY "
-            sql = "CREATE " + temp + "TABLE "
+            sql = "CREATE " + temp + "TABLE IF NOT EXISTS "
             sql = sql + self.quotes(table_name) + " (id INTEGER PRIMARY KEY AUTOINCREMENT"
             for a_tup in columns:
                 (column_name, data_type, not_null_constraint) = a_tup
@@ -133,12 +532,10 @@ class SQLiteDatabase:
                         sql = sql + "NOT NULL"
 
             sql = sql + ");"
-            c.execute(sql)
-            self.commit()
-        except sqlite3.OperationalError:
-            pass
+            self.execute_write(sql)
         except sqlite3.Error as eee:
-            print(f"Error Creating table: {eee}")
+            self.write_error(eee, "Error Creating table: ")
+        self.forget_schema()
 
     def clone_table(self, table_name: str, clone_table_name: str):
         """Creates a clone of the table
@@ -174,26 +571,15 @@ class SQLiteDatabase:
                 type_cols.append((col[1],col[2],col[3]))
             
         self.create_table(clone_table_name,type_cols,False)
-        data=self.get_data_from_table(table_name)
-        sqltxt = str(column_name_list)
-        sqltxt = sqltxt.replace("'", "")
-        sqltxt = sqltxt.replace(",", ", ")
-        sqltxt = sqltxt.replace("[", "(")
-        sqltxt = sqltxt.replace("]", ")")
-        val = sqltxt
-        for ccc in column_name_list:
-            val = val.replace(ccc, "?")
-        sqltxt = sqltxt + " VALUES " + val
+        columns_txt = ", ".join(column_name_list)
         try:
-            c = self.conn.cursor()
-            # Update the specified column with the given value for all rows that match the condition
-            for row_data in data:
-                c.execute(f"INSERT INTO {self.quotes(clone_table_name)} {sqltxt}", row_data)
-            self.commit()
-        except sqlite3.OperationalError:
-            pass
+            # copy all rows inside sqlite, keeping the ids
+            self.execute_write(
+                f"INSERT INTO {self.quotes(clone_table_name)} ({columns_txt}) "
+                f"SELECT {columns_txt} FROM {self.quotes(table_name)}"
+            )
         except sqlite3.Error as eee:
-            print(f"Error Creating cloned table: {eee}")
+            self.write_error(eee, "Error Creating cloned table: ")
 
     def send_sql_command(self, sql, table_to_lock=None):
         """Send any sql command, if a specific table needs to be locked then specify the table_name.
@@ -204,25 +590,122 @@ class SQLiteDatabase:
         """
         _ = table_to_lock
         try:
-            c = self.conn.cursor()
-            c.execute(sql)
-            self.commit()
-        except sqlite3.OperationalError:
-            pass
+            self.execute_write(sql)
         except sqlite3.Error as eee:
-            print(f"Error Executing sql:\n{sql}\nError: {eee}")
+            self.write_error(eee, f"Error Executing sql:\n{sql}\nError: ")
         finally:
-            # Release all resources
-            c.close()
+            # the command may change any table structure
+            self.forget_schema()
 
     def commit(self):
-        """Commit any pending changes"""
-        if self.conn is not None:
+        """Commit any pending changes, inside a transaction the commit is done when the transaction ends"""
+        if self.conn is not None and self.transaction_depth == 0:
             self.conn.commit()
 
+    @contextmanager
+    def transaction(self):
+        """Groups writes in a single commit, all of them are rolled back if an exception is raised.
+        Transactions can be nested, the outermost one commits, a failed inner one only rolls back its own writes
+        (savepoint). The writing methods of this class
+        raise their sqlite3.Error inside a transaction instead of printing it.
+
+        Usage:
+            with db.transaction():
+                db.delete_rows(table, id_list)
+                db.insert_rows(table, rows)
+
+        Yields:
+            sqlite3.Connection: the connection
+        """
+        with self.write_lock:
+            self.transaction_depth = self.transaction_depth + 1
+            savepoint = None
+            if self.transaction_depth > 1:
+                # an inner transaction is a savepoint, its writes are undone if it fails and the caller goes on
+                if not self.conn.in_transaction:
+                    # otherwise releasing the savepoint would commit
+                    self.conn.execute("BEGIN")
+                savepoint = f"sp_{self.transaction_depth}"
+                self.conn.execute(f"SAVEPOINT {savepoint}")
+            try:
+                yield self.conn
+            except BaseException:
+                self.transaction_depth = self.transaction_depth - 1
+                if savepoint is not None:
+                    try:
+                        self.conn.execute(f"ROLLBACK TO {savepoint}")
+                        self.conn.execute(f"RELEASE {savepoint}")
+                    except sqlite3.Error as eee:
+                        # sqlite already rolled back the whole transaction
+                        print(f"Could not roll back to {savepoint}: {eee}")
+                else:
+                    self.conn.rollback()
+                # rolled back DDL
+                self.forget_schema()
+                raise
+            self.transaction_depth = self.transaction_depth - 1
+            if savepoint is not None:
+                self.conn.execute(f"RELEASE {savepoint}")
+            self.commit()
+
+    def write_error(self, eee: sqlite3.Error, message: str = ""):
+        """Prints a writing error, raises it inside a transaction to roll it back"""
+        if self.transaction_depth > 0:
+            raise eee
+        print(f"{message}{eee}")
+
+    def forget_schema(self):
+        """Drops the cached schema of all the connections of the process to this database,
+        called after any statement that can change tables or columns"""
+        key = self.path_key(self.db_path)
+        with _WRITE_LOCKS_LOCK:
+            _SCHEMA_GENERATIONS[key] = _SCHEMA_GENERATIONS.get(key, 0) + 1
+
+    def get_schema_cache(self) -> dict:
+        """Schema cache of the connection, emptied when the schema generation of the database changed
+
+        Returns:
+            dict: {"tables": list or None, "views": list or None, "descriptions": {table: description},
+            "sql": {key: statement}}
+        """
+        generation = _SCHEMA_GENERATIONS.get(self.path_key(self.db_path), 0)
+        if generation != self.schema_generation:
+            self.schema_cache = {"tables": None, "views": None, "descriptions": {}, "sql": {}}
+            self.schema_generation = generation
+        return self.schema_cache
+
+    def get_insert_columns(self, table: str) -> list:
+        """Columns of the table without id, from the schema cache
+
+        Args:
+            table (str): table name
+
+        Returns:
+            list: column names, empty if the table does not exist
+        """
+        return [desc[1] for desc in self.describe_table_in_db(table) if desc[1] != "id"]
+
     def close_connection(self):
-        """Close the current connection"""
-        if self.encrypt:
+        """Close the current connection. The write ahead log is merged into the file and the file is closed
+        before encrypting it."""
+        self.close_readers()
+        if self.memory_uri:
+            # in-memory session, only the owner encrypts it, the database is gone when all its connections close
+            if self.session_owner:
+                self.save_memory_session()
+                _MEMORY_SESSIONS.pop(self.path_key(self.db_path), None)
+                self.session_owner = False
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+            return
+        last_owner = self.release_disk_session()
+        if last_owner:
+            self.checkpoint()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        if last_owner:
             if self.encrypt_db():
                 # if there is no prior encryption key will store it before it exits
                 # without the key db is useless
@@ -231,19 +714,54 @@ class SQLiteDatabase:
                 fnnoext, _ = os.path.splitext(fn)
                 fpath = fpath.replace(fn, "")
                 self.save_key_to_file(fpath + fnnoext + "_key.txt")
-        if self.conn is not None:
-            self.conn.close()
+
+    def release_disk_session(self) -> bool:
+        """Releases the disk session of the connection
+
+        Returns:
+            bool: True if it was the last connection of the process encrypting the database, it encrypts it
+        """
+        if not self.encrypt:
+            return False
+        if not self.disk_session_owner:
+            # encryption asked for after connecting, encrypts unless other connections are open
+            return _DISK_SESSIONS.get(self.path_key(self.db_path), 0) == 0
+        with _WRITE_LOCKS_LOCK:
+            key = self.path_key(self.db_path)
+            count = _DISK_SESSIONS.get(key, 1) - 1
+            if count > 0:
+                _DISK_SESSIONS[key] = count
+            else:
+                _DISK_SESSIONS.pop(key, None)
+        self.disk_session_owner = False
+        return count <= 0
+
+    def checkpoint(self):
+        """Merges the write ahead log into the database file and leaves WAL mode,
+        so the file holds the whole database (before encrypting or copying it).
+        An in-memory session is encrypted into the database file."""
+        if self.memory_uri:
+            self.save_memory_session()
+            return
+        if self.conn is None or self.profile != "writer":
+            return
+        self.close_readers()
+        with self.write_lock:
+            try:
+                self.set_pragmas({"wal_checkpoint": "TRUNCATE", "journal_mode": "DELETE"})
+            except sqlite3.Error as eee:
+                print(f"Could not checkpoint {self.db_path}: {eee}")
 
     def delete_table_from_db(self, table_name,log_print=True):
-        """Delete a table from the database"""
+        """Delete a table or a view from the database"""
+        drop_type = "VIEW" if table_name in self.views_in_db() else "TABLE"
         try:
-            c = self.conn.cursor()
-            c.execute("DROP TABLE IF EXISTS " + self.quotes(table_name))
+            self.execute_write(f"DROP {drop_type} IF EXISTS " + self.quotes(table_name))
+            self.forget_schema()
             if log_print:
                 print(f"Table {table_name} deleted")
-            self.commit()
         except sqlite3.Error as eee:
-            print(eee)
+            self.write_error(eee)
 
     @staticmethod
     def quotes(txt: str) -> str:
@@ -265,35 +783,27 @@ class SQLiteDatabase:
     def rename_column_in_table(self, table_name, column_name, new_column_name):
         """Rename a column in the database"""
         try:
-            c = self.conn.cursor()
-            c.execute(
-                "ALTER TABLE IF EXISTS "
+            self.execute_write(
+                "ALTER TABLE "
                 + self.quotes(table_name)
                 + " RENAME COLUMN "
                 + self.quotes(column_name)
                 + " TO "
                 + self.quotes(new_column_name)
             )
+            self.forget_schema()
             print(f"Column {column_name} renamed to {new_column_name}")
-            self.commit()
         except sqlite3.Error as eee:
-            print(eee)
-        finally:
-            # Release all resources
-            c.close()
+            self.write_error(eee)
 
     def remove_column_from_table(self, table_name, column_name):
         """Remove a column from the database"""
         try:
-            c = self.conn.cursor()
-            c.execute("ALTER TABLE IF EXISTS " + self.quotes(table_name) + " DROP COLUMN " + self.quotes(column_name))
+            self.execute_write("ALTER TABLE " + self.quotes(table_name) + " DROP COLUMN " + self.quotes(column_name))
+            self.forget_schema()
             print(f"Column {column_name} removed")
-            self.commit()
         except sqlite3.Error as eee:
-            print(eee)
-        finally:
-            # Release all resources
-            c.close()
+            self.write_error(eee)
 
     def get_column_list_of_table(self, table) -> list:
         """Returns a list with all columns in table
@@ -311,20 +821,36 @@ class SQLiteDatabase:
         return db_cols
 
     def tables_in_db(self):
-        """Get the list of tables in the database
+        """Get the list of tables and views in the database, from the schema cache
 
         Returns:
             list: table names
         """
-        c = self.conn.cursor()
-        tables_tup_list = c.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()
-        # DB Returns list of tuples
-        tables = []
-        for a_table in tables_tup_list:
-            if isinstance(a_table, tuple):
-                if len(a_table) > 0:
-                    tables.append(a_table[0])
-        return tables
+        return list(self.get_schema_objects()["tables"])
+
+    def views_in_db(self):
+        """Get the list of views in the database, from the schema cache
+
+        Returns:
+            list: view names
+        """
+        return list(self.get_schema_objects()["views"])
+
+    def get_schema_objects(self) -> dict:
+        """Tables and views of the schema cache, read from sqlite_master when the cache is empty
+
+        Returns:
+            dict: {"tables": tables and views, "views": views}
+        """
+        schema_cache = self.get_schema_cache()
+        if schema_cache["tables"] is None:
+            c = self.conn.cursor()
+            tables_tup_list = c.execute("SELECT name, type FROM sqlite_master WHERE type IN ('table', 'view')").fetchall()
+            c.close()
+            # DB Returns list of tuples
+            schema_cache["tables"] = [a_table[0] for a_table in tables_tup_list]
+            schema_cache["views"] = [a_table[0] for a_table in tables_tup_list if a_table[1] == "view"]
+        return schema_cache
 
     def print_all_rows(self, table):
         """Prints all rows in table
@@ -338,6 +864,14 @@ class SQLiteDatabase:
         for row in rows:
             print(row)
 
+    def get_select_sql(self, table: str, column_filter: str = "*", where: str = None) -> str:
+        """SELECT query of get_data_from_table and iter_data_from_table"""
+        sql = "SELECT "
+        sql = sql + column_filter + " FROM " + self.quotes(table)
+        if where:
+            sql = sql + " WHERE " + where
+        return sql
+
     def get_data_from_table(self, table: str, column_filter: str = "*", where: str = None) -> list:
         """returns the data in the rows
 
@@ -350,10 +884,7 @@ class SQLiteDatabase:
             list: data in table
         """
         d_data = []
-        sql = "SELECT "
-        sql = sql + column_filter + " FROM " + self.quotes(table)
-        if where:
-            sql = sql + " WHERE " + where
+        sql = self.get_select_sql(table, column_filter, where)
         try:
             c = self.conn.cursor()
             c.execute(sql)
@@ -365,10 +896,11 @@ class SQLiteDatabase:
             #     c.close()
         return d_data
 
-    def get_data_sql_command(self, sql: str) -> list:
+    def get_data_sql_command(self, sql: str, parameters: tuple = ()) -> list:
         """returns the data from any sql query
         Args:
             sql (str): sql query
+            parameters (tuple, optional): query parameters. Defaults to ().
 
         Returns:
             list: data in table
@@ -376,12 +908,53 @@ class SQLiteDatabase:
         d_data = []
         try:
             c = self.conn.cursor()
-            c.execute(sql)
+            c.execute(sql, parameters)
             d_data = c.fetchall()
         except sqlite3.Error as eee:
             print(eee)
         return d_data
 
+    def iter_data_sql_command(self, sql: str, parameters: tuple = (), chunk_size: int = DATA_CHUNK_SIZE):
+        """Streams the data of any sql query in chunks, only one chunk of rows is in memory at a time.
+        Use a reader connection when writing to the database while iterating.
+
+        Args:
+            sql (str): sql query
+            parameters (tuple, optional): query parameters. Defaults to ().
+            chunk_size (int, optional): rows per chunk. Defaults to DATA_CHUNK_SIZE.
+
+        Yields:
+            list[tuple]: chunk of rows
+        """
+        c = self.conn.cursor()
+        try:
+            c.execute(sql, parameters)
+            while True:
+                chunk = c.fetchmany(chunk_size)
+                if len(chunk) == 0:
+                    break
+                yield chunk
+        except sqlite3.Error as eee:
+            print(eee)
+        finally:
+            c.close()
+
+    def iter_data_from_table(
+        self, table: str, column_filter: str = "*", where: str = None, chunk_size: int = DATA_CHUNK_SIZE
+    ):
+        """Streams the data in the rows in chunks, as get_data_from_table without loading the whole table
+
+        Args:
+            table (str):table to look at
+            column_filter (str, optional): filter. Defaults to "*".
+            where (str, optional): add condition statement. Defaults to None.
+            chunk_size (int, optional): rows per chunk. Defaults to DATA_CHUNK_SIZE.
+
+        Yields:
+            list[tuple]: chunk of rows
+        """
+        yield from self.iter_data_sql_command(self.get_select_sql(table, column_filter, where), (), chunk_size)
+
     def delete_data_from_table(self, table: str, where: str = None):
         """Delete data in the rows
 
@@ -394,14 +967,136 @@ class SQLiteDatabase:
         if where:
             sql = sql + " WHERE " + where
         try:
-            c = self.conn.cursor()
-            c.execute(sql)
-            self.commit()
+            self.execute_write(sql)
         except sqlite3.Error as eee:
-            print(eee)
-        finally:
-            # Release all resources
-            c.close()
+            self.write_error(eee)
+
+    def delete_rows(self, table: str, id_list: list) -> bool:
+        """Deletes many rows by id in a single commit
+
+        Args:
+            table (str): table
+            id_list (list[int]): ids to delete
+
+        Returns:
+            bool: True if deleted
+        """
+        return self.delete_by_id_set(table, id_list) >= 0
+
+    def get_id_set_table(self, set_name: str = ID_SET_DEFAULT) -> str:
+        """Quoted temporary table of an id set"""
+        return "temp." + self.quotes(f"{ID_SET_PREFIX}{set_name}__")
+
+    def load_id_set(self, id_list: list, set_name: str = ID_SET_DEFAULT) -> str:
+        """Loads ids into a temporary table of this connection, replacing the ids of the set.
+        Tables are then filtered by the set in a single statement instead of one query per id.
+        Needs a writing connection, query only readers can not create the temporary table.
+
+        Args:
+            id_list (list[int]): ids, repeated ids are loaded once
+            set_name (str, optional): name of the set. Defaults to ID_SET_DEFAULT.
+
+        Returns:
+            str: condition selecting the rows of the ids, "id IN (SELECT id FROM set)"
+        """
+        s_q = self.get_id_set_table(set_name)
+        with self.transaction():
+            self.execute_write(f"CREATE TEMP TABLE IF NOT EXISTS {s_q} (id INTEGER PRIMARY KEY)")
+            self.execute_write(f"DELETE FROM {s_q}")
+            self.execute_write(f"INSERT OR IGNORE INTO {s_q} (id) VALUES (?)", [(an_id,) for an_id in id_list], True)
+        return f"id IN (SELECT id FROM {s_q})"
+
+    def drop_id_set(self, set_name: str = ID_SET_DEFAULT):
+        """Removes the temporary table of an id set"""
+        try:
+            self.execute_write(f"DROP TABLE IF EXISTS {self.get_id_set_table(set_name)}")
+        except sqlite3.Error as eee:
+            self.write_error(eee)
+
+    def get_id_set_where(self, id_list: list, where: str = None, set_name: str = ID_SET_DEFAULT) -> str:
+        """Loads the id set and adds its condition to where"""
+        id_where = self.load_id_set(id_list, set_name)
+        if where:
+            return f"({where}) AND {id_where}"
+        return id_where
+
+    def select_by_id_set(self, table: str, id_list: list, column_filter: str = "*", where: str = None) -> list:
+        """Rows of the ids in a single query
+
+        Args:
+            table (str): table
+            id_list (list[int]): ids
+            column_filter (str, optional): columns. Defaults to "*".
+            where (str, optional): additional condition. Defaults to None.
+
+        Returns:
+            list[tuple]: rows ordered by id
+        """
+        try:
+            id_where = self.get_id_set_where(id_list, where)
+        except sqlite3.Error as eee:
+            self.write_error(eee)
+            return []
+        return self.get_data_from_table(table, column_filter, id_where + " ORDER BY id")
+
+    def sum_by_id_set(self, table: str, column: str, id_list: list, where: str = None):
+        """Sum of a column over the rows of the ids
+
+        Args:
+            table (str): table
+            column (str): column to add
+            id_list (list[int]): ids
+            where (str, optional): additional condition. Defaults to None.
+
+        Returns:
+            int | float: sum, 0 when no row matches
+        """
+        d_data = self.select_by_id_set(table, id_list, f"COALESCE(SUM({column}), 0)", where)
+        if len(d_data) > 0:
+            return d_data[0][0]
+        return 0
+
+    def update_by_id_set(self, table: str, column: str, new_value, id_list: list, where: str = None) -> int:
+        """Sets a value on the rows of the ids in a single statement
+
+        Args:
+            table (str): table
+            column (str): column to set
+            new_value (any): value
+            id_list (list[int]): ids
+            where (str, optional): additional condition. Defaults to None.
+
+        Returns:
+            int: rows changed, -1 on error
+        """
+        try:
+            with self.transaction():
+                id_where = self.get_id_set_where(id_list, where)
+                return self.execute_write(
+                    f"UPDATE {self.quotes(table)} SET {self.quotes(column)} = ? WHERE {id_where}", (new_value,)
+                )
+        except sqlite3.Error as eee:
+            self.write_error(eee)
+        return -1
+
+    def delete_by_id_set(self, table: str, id_list: list, where: str = None) -> int:
+        """Deletes the rows of the ids in a single statement
+
+        Args:
+            table (str): table
+            id_list (list[int]): ids
+            where (str, optional): additional condition. Defaults to None.
+
+        Returns:
+            int: rows deleted, -1 on error
+        """
+        try:
+            with self.transaction():
+                id_where = self.get_id_set_where(id_list, where)
+                return self.execute_write(f"DELETE FROM {self.quotes(table)} WHERE {id_where}")
+        except sqlite3.Error as eee:
+            self.write_error(eee)
+        return -1
 
     def edit_value_in_table(self, table_name: str, an_id: int, column_name: str, new_value):
         """Edits a value in a table.
@@ -413,47 +1108,51 @@ class SQLiteDatabase:
             new_value (_type_): value
         """
         try:
-            c = self.conn.cursor()
             # Update the specified column with the given value for all rows that match the condition
-            c.execute(
+            self.execute_write(
                 f"UPDATE {self.quotes(table_name)} SET {self.quotes(column_name)} = ? WHERE id = ?", (new_value, an_id)
             )
-            # print("Row updated successfully")
-            self.commit()
-            time.sleep(WAIT_TIME_WRITING)
             return True
         except sqlite3.Error as eee:
-            print(eee)
+            self.write_error(eee)
             return False
-        finally:
-            # Release all resources
-            c.close()
     
-    def edit_column_in_table(self, table_name: str, column_name: str, new_column_values):
-        """Edits a complete column of the table with new values.
+    def edit_values_in_table(self, table_name: str, column_name, id_value_list: list[tuple]):
+        """Edits column values for many ids in a single commit.
 
         Args:
             table_name (str): table
-            column_name (str): column item
-            new_column_values (_type_): values of column
+            column_name (str | list[str]): column item, or list of columns set in the same UPDATE
+            id_value_list (list[tuple]): (id, new_value) pairs. When column_name is a list
+            new_value is a tuple with one value per column.
         """
+        if isinstance(column_name, str):
+            column_list = [column_name]
+            value_list = [(new_value, an_id) for an_id, new_value in id_value_list]
+        else:
+            column_list = list(column_name)
+            value_list = [tuple(new_values) + (an_id,) for an_id, new_values in id_value_list]
         try:
-            description=self.describe_table_in_db(table_name)
-            c = self.conn.cursor()
-            # Create an UPDATE query that updates all rows in the specified table and sets the given column to the provided value.
-            update_query = f"UPDATE {self.quotes(table_name)} SET {column_name} = ?"
-            
-            # Use a tuple of values for updating multiple columns at once
-            c.executemany(update_query, [(new_value,) for new_value in new_column_values])
-            self.commit()
-            time.sleep(WAIT_TIME_WRITING)
+            self.execute_write(self.get_update_sql(table_name, column_list), value_list, True)
             return True
         except sqlite3.Error as eee:
-            print(eee)
+            self.write_error(eee)
             return False
-        finally:
-            # Release all resources
-            c.close()
+
+    def edit_column_in_table(self, table_name: str, column_name: str, new_column_values):
+        """Edits a complete column of the table with new values.
+
+        Args:
+            table_name (str): table
+            column_name (str): column item
+            new_column_values (_type_): values of column, in the order of the rows (ascending id)
+        """
+        id_list = [an_id for (an_id,) in self.get_data_from_table(table_name, "id", "1=1 ORDER BY id")]
+        if len(id_list) != len(new_column_values):
+            print(f"Values size is not correct {len(new_column_values)} != {len(id_list)} rows")
+            return False
+        # one value per row in a single commit
+        return self.edit_values_in_table(table_name, column_name, list(zip(id_list, new_column_values)))
 
     def table_exists(self, table: str) -> bool:
         """Table exists
@@ -465,16 +1164,13 @@ class SQLiteDatabase:
             bool: True if the table exists, False otherwise.
         """
         try:
-            c = self.conn.cursor()
-            sql = f"SELECT 1 FROM sqlite_master WHERE type='table' AND name={self.quotes(table)}"
-            c.execute(sql)
-            return len(c.fetchall()) > 0
-        except (sqlite3.OperationalError, ValueError) as eee:
+            return table in self.tables_in_db()
+        except (sqlite3.OperationalError, ValueError, AttributeError) as eee:
             print("No table:", eee)
             return False
 
     def describe_table_in_db(self, table: str) -> list:
-        """returns the column structure of the table
+        """returns the column structure of the table, from the schema cache
 
         Args:
             table (str): table name
@@ -488,6 +1184,9 @@ class SQLiteDatabase:
                 Default value,
                 Primary key flag)
         """
+        descriptions = self.get_schema_cache()["descriptions"]
+        if table in descriptions:
+            return list(descriptions[table])
         if not self.table_exists(table):
             return []
         # Get the column names and types of the table
@@ -499,12 +1198,9 @@ class SQLiteDatabase:
             # print(table,": ",description)
         except sqlite3.OperationalError as eee:
             print("No description:", eee)
-        # Print a string with the table name, column names, and data types
-        # result = f"{table}: \n"
-        # for row in description:
-        #     result += f"- {row[0]} ({row[1]})\n"
-        # print(result)
-        return description
+        if len(description) > 0:
+            descriptions[table] = description
+        return list(description)
 
     def add_data_to_table_id(self, table: str, an_id: int, sample_data: tuple):
         """Add data to a table
@@ -514,43 +1210,40 @@ class SQLiteDatabase:
             id (int): the id
             sample_data (tuple): must match with columns name
         """
-        description = self.describe_table_in_db(table)
-        if len(description) == 0:
+        insert_columns = self.get_insert_columns(table)
+        if len(insert_columns) == 0:
             print("No data in table")
             return False
-        column_name_list = []
-        data_type_list = []
-        for desc in description:
-            column_name_list.append(desc[1])
-            data_type_list.append(desc[2])
-
-        sqltxt = str(column_name_list)
-        sqltxt = sqltxt.replace("'", "")
-        sqltxt = sqltxt.replace(",", ", ")
-        sqltxt = sqltxt.replace("[", "(")
-        sqltxt = sqltxt.replace("]", ")")
-        val = sqltxt
-        for ccc in column_name_list:
-            val = val.replace(ccc, "?")
-        sqltxt = sqltxt + " VALUES " + val
+        column_name_list = ["id"] + insert_columns
+        sqltxt = self.get_insert_sql(table, column_name_list)
+        if len(sample_data) != len(column_name_list) - 1:
+            print(f"id or data size is not correct {column_name_list} != {sample_data}")
+            return False
         try:
-            c = self.conn.cursor()
-            # Update the specified column with the given value for all rows that match the condition
-            if len(sample_data) == len(column_name_list) - 1:
-
-                c.execute(f"INSERT INTO {self.quotes(table)} {sqltxt}", (an_id,) + sample_data)
-            else:
-                print(f"id or data size is not correct {column_name_list} != {sample_data}")
-                return False
-            self.commit()
+            self.execute_write(sqltxt, (an_id,) + sample_data)
             return True
-            # print("Row updated successfully")
         except sqlite3.Error as eee:
-            print(eee)
+            self.write_error(eee)
             return False
-        finally:
-            # Release all resources
-            c.close()
+
+    def get_insert_sql(self, table: str, column_name_list: list) -> str:
+        """INSERT statement with a placeholder for each column, from the schema cache"""
+        sql_cache = self.get_schema_cache()["sql"]
+        key = ("INSERT", table, tuple(column_name_list))
+        if key not in sql_cache:
+            columns_txt = ", ".join(column_name_list)
+            values_txt = ", ".join(["?"] * len(column_name_list))
+            sql_cache[key] = f"INSERT INTO {self.quotes(table)} ({columns_txt}) VALUES ({values_txt})"
+        return sql_cache[key]
+
+    def get_update_sql(self, table: str, column_list: list) -> str:
+        """UPDATE by id statement with a placeholder for each column, from the schema cache"""
+        sql_cache = self.get_schema_cache()["sql"]
+        key = ("UPDATE", table, tuple(column_list))
+        if key not in sql_cache:
+            set_txt = ", ".join([f"{self.quotes(column)} = ?" for column in column_list])
+            sql_cache[key] = f"UPDATE {self.quotes(table)} SET {set_txt} WHERE id = ?"
+        return sql_cache[key]
 
     def insert_data_to_table(self, table: str, sample_data: list[tuple]):
         """Add data to a table
@@ -560,62 +1253,58 @@ class SQLiteDatabase:
             table (str): Table name
             sample_data (list[tuple]): must match with columns name
         """
-        description = self.describe_table_in_db(table)
-        if len(description) == 0:
+        if len(self.get_insert_columns(table)) == 0:
             print("No data in table")
             return False
-        column_name_list = []
-        data_type_list = []
-        for desc in description:
-            if desc[1] != "id":
-                column_name_list.append(desc[1])
-                data_type_list.append(desc[2])
-
-        sqltxt = str(column_name_list)
-        sqltxt = sqltxt.replace("'", "")
-        sqltxt = sqltxt.replace(",", ", ")
-        sqltxt = sqltxt.replace("[", "(")
-        sqltxt = sqltxt.replace("]", ")")
-        val = sqltxt
-        for ccc in column_name_list:
-            val = val.replace(ccc, "?")
-        sqltxt = sqltxt + " VALUES " + val
+        return self.insert_rows(table, sample_data)
+
+    def insert_rows(self, table: str, rows: list[tuple], column_name_list: list = None) -> bool:
+        """Inserts many rows with a single statement and a single commit.
+
+        Args:
+            table (str): Table name
+            rows (list[tuple]): rows, must match with the columns
+            column_name_list (list, optional): columns of the rows. Defaults to None, all columns except id.
+
+        Returns:
+            bool: True if inserted
+        """
+        if column_name_list is None:
+            column_name_list = self.get_insert_columns(table)
+        for row in rows:
+            if len(row) != len(column_name_list):
+                print(f"Data Size is not correct {column_name_list} != {row}")
+                return False
         try:
-            c = self.conn.cursor()
-            # Update the specified column with the given value for all rows that match the condition
-            for row in sample_data:
-                if len(row) == len(column_name_list):
-                    c.execute(f"INSERT INTO {self.quotes(table)} {sqltxt}", row)
-                else:
-                    print(f"Data Size is not correct {column_name_list} != {row}")
-                    return False
-            self.commit()
-            time.sleep(WAIT_TIME_WRITING)
+            self.execute_write(self.get_insert_sql(table, column_name_list), rows, True)
             return True
-            # print("Row updated successfully")
         except sqlite3.Error as eee:
-            print(eee)
+            self.write_error(eee)
             return False
-        finally:
-            # Release all resources
-            c.close()
 
-    def get_next_available_id(self, table: str) -> int:
-        """Gets the next id that is available in a table
+    def get_next_available_id(self, table: str, sequence_table: str = None) -> int:
+        """Gets the next id that is available in a table, after the highest id ever given.
+        Ids of deleted rows are not handed out again (as AUTOINCREMENT), see reenumerate_id_sequence.
 
         Args:
-            table (str): table
+            table (str): table or view
+            sequence_table (str, optional): AUTOINCREMENT table giving the ids of a view. Defaults to None, table.
 
         Returns:
             int: next available id
         """
-        id_list = self.get_data_from_table(table, "id")
-        jjj = 0
-        for iii, idtup in enumerate(id_list):
-            jjj = iii
-            if iii + 1 < idtup[0]:
-                return iii + 1
-        return jjj + 2
+        if sequence_table is None:
+            sequence_table = table
+        sql = f"SELECT COALESCE(MAX(id), 0) FROM {self.quotes(table)}"
+        parameters = ()
+        if self.table_exists("sqlite_sequence"):
+            # the last row may have been deleted, the sequence still holds its id
+            sql = f"SELECT MAX(({sql}), COALESCE((SELECT seq FROM sqlite_sequence WHERE name = ?), 0))"
+            parameters = (sequence_table,)
+        d_data = self.get_data_sql_command(sql, parameters)
+        if len(d_data) > 0 and d_data[0][0] is not None:
+            return d_data[0][0] + 1
+        return 1
 
     def get_number_or_rows_in_table(self, table: str) -> int:
         """Get number of rows"""
@@ -630,24 +1319,34 @@ class SQLiteDatabase:
             #     print("Debug---->>>",data)
         return None
 
-    def reenumerate_id_sequence(self, table: str)->list:
-        """Reorganized ids in sequential order in the table
+    def reenumerate_id_sequence(self, table: str) -> list:
+        """Compacts the ids of the table to 1..n keeping the row order.
+        Ids are stable otherwise: deleted rows leave gaps that AUTOINCREMENT does not reuse, so selection maps
+        and comparisons keep referring to the same rows. Use it only as an explicit compaction,
+        only the rows after the first gap are updated, in a single commit.
 
         Args:
             table (str): the table
         Returns:
             (list[tuple]): (id, old_id) old ids list, Before changing id
         """
+        t_q = self.quotes(table)
+        old_id_data = self.get_data_sql_command(f"SELECT ROW_NUMBER() OVER (ORDER BY id), id FROM {t_q}")
+        # ascending order: the new id is always free, its row already moved down
+        id_changes = [(new_id, old_id) for new_id, old_id in old_id_data if new_id != old_id]
+        if len(id_changes) == 0:
+            return old_id_data
         try:
-            self.rename_column_in_table(table,"id","old_id")
-            sql=f"ALTER TABLE IF EXISTS {self.quotes(table)} ADD COLUMN id INTEGER PRIMARY KEY AUTOINCREMENT"
-            self.send_sql_command(sql,table)
-            old_id_data=self.get_data_from_table(table,"id, old_id")
-            self.remove_column_from_table(table,"old_id")
+            with self.transaction():
+                self.execute_write(f"UPDATE {t_q} SET id = ? WHERE id = ?", id_changes, True)
+                self.execute_write(
+                    f"UPDATE sqlite_sequence SET seq = (SELECT COALESCE(MAX(id), 0) FROM {t_q}) WHERE name = ?",
+                    (table,),
+                )
             return old_id_data
         except sqlite3.Error as eee:
             print(eee)
-        return []    
+        return []
 
     def add_column_to_table(self, table: str, column: str, column_type: str):
         """Add columns to table
@@ -667,16 +1366,80 @@ class SQLiteDatabase:
         """
         # Connect to the database
         try:
-            c = self.conn.cursor()
-            # Add age and lastname columns to the users table
             if column_type not in ["INTEGER", "REAL", "TEXT", "BLOB", "DATE", "TIME", "DATETIME", "BOOLEAN"]:
                 column_type = "TEXT"
-            c.execute(f"ALTER TABLE IF EXISTS {self.quotes(table)} ADD COLUMN {column} {column_type}")
+            self.execute_write(f"ALTER TABLE {self.quotes(table)} ADD COLUMN {column} {column_type}")
+            self.forget_schema()
         except sqlite3.Error as eee:
-            print(eee)
-        finally:
-            # Release all resources
-            c.close()
+            self.write_error(eee)
+
+    def create_index(self, table: str, column_list: list, index_name: str = None, unique: bool = False) -> str:
+        """Creates an index on the columns of a table if not existing
+
+        Args:
+            table (str): Table name
+            column_list (list[str]): indexed columns
+            index_name (str, optional): Defaults to None, idx_<table>_<columns>.
+            unique (bool, optional): unique index. Defaults to False.
+
+        Returns:
+            str: index name, None if not created
+        """
+        if index_name is None:
+            index_name = f"idx_{table}_{'_'.join(column_list)}"
+        unique_txt = ""
+        if unique:
+            unique_txt = "UNIQUE "
+        try:
+            self.execute_write(
+                f"CREATE {unique_txt}INDEX IF NOT EXISTS {self.quotes(index_name)} "
+                f"ON {self.quotes(table)} ({', '.join(column_list)})"
+            )
+            return index_name
+        except sqlite3.Error as eee:
+            self.write_error(eee, f"Index {index_name} not created: ")
+        return None
+
+    def drop_index(self, index_name: str):
+        """Removes an index"""
+        try:
+            self.execute_write(f"DROP INDEX IF EXISTS {self.quotes(index_name)}")
+        except sqlite3.Error as eee:
+            self.write_error(eee)
+
+    def list_indexes(self, table: str = None) -> list[tuple]:
+        """Indexes created in the database, automatic indexes of primary keys and unique constraints are not listed
+
+        Args:
+            table (str, optional): only the indexes of this table. Defaults to None.
+
+        Returns:
+            list[tuple]: (index name, table, [columns])
+        """
+        sql = "SELECT name, tbl_name FROM sqlite_master WHERE type='index' AND sql IS NOT NULL"
+        if table:
+            sql = sql + f" AND tbl_name={self.quotes(table)}"
+        index_list = []
+        for index_name, tbl_name in self.get_data_sql_command(sql):
+            info = self.get_data_sql_command(f"PRAGMA index_info({self.quotes(index_name)})")
+            index_list.append((index_name, tbl_name, [column for _, _, column in info]))
+        return index_list
+
+    def rebuild_indexes(self, table: str = None):
+        """Rebuilds the indexes and updates the statistics used by the query planner
+
+        Args:
+            table (str, optional): only the indexes of this table. Defaults to None, all.
+        """
+        try:
+            if table:
+                self.execute_write(f"REINDEX {self.quotes(table)}")
+                self.execute_write(f"ANALYZE {self.quotes(table)}")
+            else:
+                self.execute_write("REINDEX")
+                self.execute_write("ANALYZE")
+        except sqlite3.Error as eee:
+            self.write_error(eee)
 
 
 # Example usage
@@ -702,8 +1465,9 @@ if __name__ == "__main__":
 
         db.insert_data_to_table("files", [("insert1.test", "555")])
         db.delete_data_from_table("files", where="id = 51")
+        # id 51 is not reused, the next id follows the highest one
         print("Next available:", db.get_next_available_id("files"))
-        db.add_data_to_table_id("files", db.get_next_available_id("files"), ("insertaddat51.test", 51))
+        db.add_data_to_table_id("files", db.get_next_available_id("files"), ("insertaddatnext.test", 62))
         db.print_all_rows("files")
         print("Next available:", db.get_next_available_id("files"))
         print(db.get_number_or_rows_in_table("files"))
@@ -712,6 +1476,17 @@ if __name__ == "__main__":
         print(db.get_number_or_rows_in_table("files"))
         db.reenumerate_id_sequence("files")
         db.print_all_rows("files")
+        # a failed inner transaction only undoes its own writes
+        rows_before = db.get_number_or_rows_in_table("files")
+        with db.transaction():
+            db.insert_data_to_table("files", [("outer.test", 1)])
+            try:
+                with db.transaction():
+                    db.insert_data_to_table("files", [("inner.test", 2)])
+                    raise ValueError("inner transaction failed")
+            except ValueError as eee:
+                print(eee)
+        print("Nested rollback:", db.get_number_or_rows_in_table("files") == rows_before + 1)
         print(db.get_number_or_rows_in_table("files"))
         # db.rename_column_in_table('table2', 'old_column', 'new_column')
         # db.remove_column_from_table('table3', 'column4')
@@ -0,0 +1,88 @@
+'''
+F.Garcia
+18.10.2026
+Map rows writing thread.
+Owns the database connection while mapping, takes rows from a queue and writes them in batches.
+'''
+import queue
+import threading
+import logging
+import time
+
+from class_sqlite_database import SQLiteDatabase
+
+DATA_WRITE_BATCH = 2000  # rows written to the database in one commit
+QUEUE_GET_TIMEOUT = 0.5  # seconds to wait for rows before checking the kill event
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+formatter=logging.Formatter('[%(levelname)s] (%(threadName)-10s) %(message)s')
+ahandler=logging.StreamHandler()
+ahandler.setLevel(logging.INFO)
+ahandler.setFormatter(formatter)
+log.addHandler(ahandler)
+
+
+class MapWriterThread(threading.Thread):
+    """
+        A thread that is the only writer of a map table while mapping.
+        Rows arrive in row_queue, a None row marks the end of the data.
+    """
+    def __init__(self,db:SQLiteDatabase,table:str,row_queue:queue.Queue,kill_event:threading.Event,batch_size:int=DATA_WRITE_BATCH):
+        threading.Thread.__init__(self, name="Map writer thread")
+        self.db=db
+        self.table=table
+        self.row_queue=row_queue
+        self.killer_event=kill_event
+        self.batch_size=batch_size
+        self.rows_written=0
+        self.error=None
+
+    def write_batch(self,data:list)->bool:
+        """Writes the rows in one insert, retries once.
+
+        Args:
+            data (list[tuple]): rows
+
+        Returns:
+            bool: True if written
+        """
+        if len(data)==0:
+            return True
+        if not self.db.insert_data_to_table(self.table,data):
+            time.sleep(0.333)
+            if not self.db.insert_data_to_table(self.table,data):
+                return False
+        self.rows_written=self.rows_written+len(data)
+        return True
+
+    def run(self):
+        """thread loop"""
+        data=[]
+        try:
+            while True:
+                try:
+                    row=self.row_queue.get(timeout=QUEUE_GET_TIMEOUT)
+                except queue.Empty:
+                    if self.killer_event.is_set():
+                        break
+                    # write what is there while the scanners are slow
+                    if len(data)>0 and not self.write_batch(data):
+                        raise ValueError(f"Could not insert data in {self.table}")
+                    data=[]
+                    continue
+                if row is None:
+                    break
+                data.append(row)
+                if len(data)>=self.batch_size:
+                    if not self.write_batch(data):
+                        raise ValueError(f"Could not insert data in {self.table}")
+                    data=[]
+            if not self.write_batch(data):
+                raise ValueError(f"Could not insert data in {self.table}")
+        except Exception as eee:  # pylint: disable=broad-exception-caught
+            self.error=eee
+            log.error(eee)
+            log.error("Map writer fatal error! exiting thread!")
+            # stop the scanners
+            self.killer_event.set()
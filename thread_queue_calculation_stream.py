@@ -11,14 +11,15 @@ import queue
 import logging
 import time
 import re
-import hashlib
 #import io
 from common import *
 from datetime import datetime
 
 from class_file_manipulate import FileManipulate
-from class_sqlite_database import SQLiteDatabase
-from class_data_manage import DataManage
+from class_sqlite_database import SQLiteDatabase, DATA_CHUNK_SIZE
+from class_hash_engine import HashEngine, HASH_BLOCK_SIZE, HASH_ALGORITHMS
+from class_hash_cache import HashCache
+from class_map_layout import MapLayout
 from rich import print
 from rich.progress import Progress
 sys.path.append(os.path.realpath("."))
@@ -33,99 +34,85 @@ ahandler.setLevel(logging.INFO)
 ahandler.setFormatter(formatter)
 log.addHandler(ahandler)
  
+HASH_WORKERS = 4  # threads hashing files, hashlib releases the GIL while hashing
+RESULT_BATCH = 500  # hash results written to the database in one commit
+FILE_QUEUE_SIZE = 2 * DATA_CHUNK_SIZE  # files waiting for a worker, the feeder waits when the queue is full
+QUEUE_WAIT = 0.5  # seconds waiting on the file queue before checking the kill event
+
 class QueueCalcStream(threading.Thread):
     """
-        A thread class to buffer and deliver the Gcode for streaming
+        A thread owning a pool of hashing workers. Workers take files from the queue and put
+        the results in a results queue that this thread writes to the database in batches.
     """                  
-    def __init__(self,db_info:dict,table:str,mount:str,cycle_time:float,kill_event:threading.Event,Pbar_Stream=None,table_column='md5'):
+    def __init__(self,db_info:dict,table:str,mount:str,cycle_time:float,kill_event:threading.Event,Pbar_Stream=None,table_column:str|list='md5',workers:int=HASH_WORKERS,buffer_size:int=HASH_BLOCK_SIZE,reader:str='auto',serial:str=None):
         threading.Thread.__init__(self, name="Stream Calculate thread")        
         
         self.db = SQLiteDatabase(db_info["name"],db_info["encrypt"],db_info["key"],db_info["pwd"])
         self.cycle_time=cycle_time
         self.killer_event = kill_event
         self.table=table
-        self.queue_pathfile = queue.Queue()  
-        self.queue_id = queue.Queue()   
-        self.queue_size = queue.Queue()   
+        self.queue_files = queue.Queue(maxsize=FILE_QUEUE_SIZE)
+        self.feeding_done = threading.Event()
+        self.queue_results = queue.Queue()   
         self.Pbarini=0
         self.Pbarend=100   
         self.pbar_stream=Pbar_Stream 
         self.mount=mount     
-        self.d_m=None     
         self.is_data=True
         self.calculation_finished=False    
         self.items_total=0
+        self.items_done=0
         self.processing_file=''
         self.table_column=table_column
+        self.workers=max(1,workers)
+        self.buffer_size=buffer_size
+        self.reader=reader
+        self.worker_list=[]
+        # device serial of the mount, the hash cache is only used when known
+        self.serial=serial
+        self.hash_cache=HashCache(self.db)
 
-    
     @staticmethod
-    def calculate_md5(file_path):
+    def calculate_md5(file_path,kill_event:threading.Event=None):
         """
         Calculate the MD5 hash of a file.
         
         Args:
             file_path (str): The path to the file for which the MD5 hash is calculated.
+            kill_event (threading.Event, optional): stop reading when set. Defaults to None.
             
         Returns:
             str: The MD5 sum as a hexadecimal string.
         """
-        try:
-            md5 = hashlib.md5()
-            with open(file_path, 'rb') as f:           
-                for chunk in iter(lambda: f.read(4096), b""):
-                    md5.update(chunk)  
-            return md5.hexdigest()
-        except (PermissionError):
-            return ':::NoPermission:::'
-        except (FileNotFoundError):
-            print(f"File {file_path} not found.")
-            return ':::FileNotFound:::'
-            exit(1)
+        return HashEngine.calculate(file_path,'md5',kill_event)
 
     @staticmethod
-    def calculate_sha1(file_path):
+    def calculate_sha1(file_path,kill_event:threading.Event=None):
         """
         Calculate the SHA128 hash of a file.
         
         Args:
             file_path (str): The path to the file for which the MD5 hash is calculated.
+            kill_event (threading.Event, optional): stop reading when set. Defaults to None.
             
         Returns:
             str: The SHA128 hash as a string.
         """
-        try:
-            with open(file_path, 'rb') as f:
-                sha1 = hashlib.sha1()
-                while chunk := f.read(4096):
-                    sha1.update(chunk)  
-                return sha1.hexdigest()
-
-        except FileNotFoundError:
-            print(f"File {file_path} not found.")
-            exit(1)
+        return HashEngine.calculate(file_path,'sha1',kill_event)
 
     @staticmethod
-    def calculate_sha256(file_path):
+    def calculate_sha256(file_path,kill_event:threading.Event=None):
         """
         Calculate the SHA256 hash of a file.
         
         Args:
             file_path (str): The path to the file for which the MD5 hash is calculated.
+            kill_event (threading.Event, optional): stop reading when set. Defaults to None.
             
         Returns:
             str: The SHA256 hash as a string.
         """
-        try:
-            with open(file_path, 'rb') as f:
-                sha256 = hashlib.sha256()
-                while chunk := f.read(4096):
-                    sha256.update(chunk)   
-                return sha256.hexdigest()
-
-        except FileNotFoundError:
-            print(f"File {file_path} not found.")
-            exit(1)   
+        return HashEngine.calculate(file_path,'sha256',kill_event)
 
     def Pbar_Set_Status(self,Pbar,val):
         """Sets the value of The progress bar. If it is called from QT,can set the object, else will use rich progressbar"""
@@ -146,111 +133,205 @@ class QueueCalcStream(threading.Thread):
         Per=round(Perini+(sss/Numsss)*(Perend-Perini),2)        
         return Per   
 
+    def get_result_columns(self)->list:
+        """Columns where the results are written, table_column can be one column or a list of them"""
+        if isinstance(self.table_column,str):
+            column_list=[self.table_column]
+        else:
+            column_list=list(self.table_column)
+        result_columns=[]
+        for column in column_list:
+            if column in HASH_ALGORITHMS and column not in result_columns:
+                result_columns.append(column)
+        if len(result_columns)==0:
+            return ['md5']
+        return result_columns
+
+    def get_result_column(self)->str:
+        """First column where the results are written"""
+        return self.get_result_columns()[0]
+
+    def get_calculate_where(self)->str:
+        """Rows to calculate: md5 to calculate, or safety hash columns still empty or to calculate"""
+        where_list=[]
+        for column in self.get_result_columns():
+            if column=='md5':
+                where_list.append('md5="***Calculate***"')
+            else:
+                where_list.append(f'{column} IS NULL OR {column}="***Calculate***"')
+        return ' OR '.join(where_list)
+
+    def add_missing_result_columns(self):
+        """Adds the safety hash columns to the table if missing"""
+        field_list=self.db.get_column_list_of_table(self.table)
+        for column in self.get_result_columns():
+            if column not in field_list:
+                MapLayout(self.db).add_map_column(self.table,column,'TEXT')
+
     def fill_queue_with_files(self):
-        """Fills the queue with the filenames"""
+        """Counts the files to calculate, the queue is filled by feed_queue_with_files while the workers hash"""
         tables=self.db.tables_in_db()
         if self.table not in tables:
             log.error(f'{self.table} is not in database!')
             self.is_data=False
             return
-        data=self.db.get_data_from_table(self.table,'*','md5="***Calculate***"')
-        if len(data)==0:
-            self.is_data=False
-            return
-        self.is_data=True
-        field_list=self.db.get_column_list_of_table(self.table)
-        self.d_m=DataManage(data,field_list)
-        self.items_total=len(self.d_m.df['filename'])
-        for filepath,filename,an_id,size in zip(self.d_m.df['filepath'],self.d_m.df['filename'],self.d_m.df['id'],self.d_m.df['size']):
-            line=os.path.join(self.mount,filepath,filename)
-            self.queue_pathfile.put(line)  
-            self.queue_id.put(an_id)
-            self.queue_size.put(size)
-            pass
-    
-    def calculate_for_next_file_in_queue(self):
-        try:        
-            line=self.queue_pathfile.get_nowait()
-            an_id=self.queue_id.get_nowait()
-            size=self.queue_size.get_nowait()
+        self.add_missing_result_columns()
+        count=self.db.get_data_sql_command(f"SELECT COUNT(*) FROM {self.db.quotes(self.table)} WHERE {self.get_calculate_where()}")
+        self.items_total=count[0][0] if len(count)>0 else 0
+        self.is_data=self.items_total>0
+
+    def feed_queue_with_files(self):
+        """Feeder loop: streams the files to calculate (id, path and file, size) into the bounded queue,
+        chunk by chunk from a read only connection, so the map is never loaded in memory."""
+        a_reader=self.db.reader()
+        try:
+            # only the queued columns
+            for chunk in a_reader.iter_data_from_table(self.table,'id, filepath, filename, size',self.get_calculate_where()):
+                for an_id,filepath,filename,size in chunk:
+                    line=os.path.join(self.mount,filepath,filename)
+                    while not self.killer_event.is_set():
+                        try:
+                            self.queue_files.put((an_id,line,size),timeout=QUEUE_WAIT)
+                            break
+                        except queue.Full:
+                            pass
+                    if self.killer_event.is_set():
+                        return
+        finally:
+            self.feeding_done.set()
+            a_reader.close_connection()
+
+    def hash_worker(self):
+        """Worker loop: hashes files in queue until empty or killed. Each worker has its own engine and buffer.
+        With several result columns every file is read once for all the digests."""
+        result_columns=self.get_result_columns()
+        engine=HashEngine(result_columns[0],self.buffer_size,self.reader)
+        while not self.killer_event.is_set():
+            try:
+                an_id,line,size=self.queue_files.get(timeout=QUEUE_WAIT)
+            except queue.Empty:
+                if self.feeding_done.is_set() and self.queue_files.empty():
+                    return
+                continue
             self.processing_file=line
-            size_str=F_M.get_size_str_formatted(size)
+            stat_result=None
+            if self.serial:
+                try:
+                    stat_result=os.stat(line)
+                except OSError:
+                    stat_result=None
+            cached=[self.hash_cache.get(self.serial,stat_result,column) for column in result_columns]
+            if None not in cached:
+                value=cached[0] if len(result_columns)==1 else tuple(cached)
+                self.queue_results.put((an_id,value,size,line))
+                continue
             if size > 349175808:
-                print(f"[yellow]Calculating... {size_str} {line}")
-            if self.table_column=='md5':
-                md5=self.calculate_md5(line)
-                self.db.edit_value_in_table(self.table,an_id,'md5',md5)
-            elif self.table_column=='sha1':
-                md5=self.calculate_sha1(line)
-                self.db.edit_value_in_table(self.table,an_id,'sha1',md5)
-            elif self.table_column=='sha256':
-                md5=self.calculate_sha256(line)
-                self.db.edit_value_in_table(self.table,an_id,'sha256',md5)
+                print(f"[yellow]Calculating... {F_M.get_size_str_formatted(size)} {line}")
+            if len(result_columns)==1:
+                value=engine.hash_file(line,self.killer_event)
             else:
-                md5=self.calculate_md5(line)
-                self.db.edit_value_in_table(self.table,an_id,'md5',md5)
+                hash_dict=engine.hash_file_multi(line,result_columns,self.killer_event)
+                value=None
+                if hash_dict is not None:
+                    value=tuple(hash_dict[column] for column in result_columns)
+            if value is not None:
+                if len(result_columns)==1:
+                    self.hash_cache.put(self.serial,stat_result,{result_columns[0]:value})
+                else:
+                    self.hash_cache.put(self.serial,stat_result,dict(zip(result_columns,value)))
+                self.queue_results.put((an_id,value,size,line))
+
+    def start_workers(self):
+        """Starts the feeder and the hashing workers"""
+        self.feeding_done.clear()
+        self.worker_list=[]
+        a_feeder=threading.Thread(target=self.feed_queue_with_files,name="Hash feeder",daemon=True)
+        a_feeder.start()
+        self.worker_list.append(a_feeder)
+        for iii in range(self.workers):
+            a_worker=threading.Thread(target=self.hash_worker,name=f"Hash worker {iii}",daemon=True)
+            a_worker.start()
+            self.worker_list.append(a_worker)
+
+    def workers_alive(self)->bool:
+        """True while any worker is hashing"""
+        for a_worker in self.worker_list:
+            if a_worker.is_alive():
+                return True
+        return False
+
+    def write_results_in_queue(self)->int:
+        """Drains the results queue and writes all results in a single batch.
+
+        Returns:
+            int: number of results written
+        """
+        id_value_list=[]
+        while len(id_value_list)<RESULT_BATCH:
+            try:
+                an_id,value,size,line=self.queue_results.get_nowait()
+            except queue.Empty:
+                break
+            id_value_list.append((an_id,value))
+            self.items_done=self.items_done+1
+            size_str=F_M.get_size_str_formatted(size)
             if not self.pbar_stream:
-                print(f"{self.items_total-self.queue_id.qsize()}/{self.items_total} ({md5}) ({an_id}) {size_str} {line}")
+                print(f"{self.items_done}/{self.items_total} ({value}) ({an_id}) {size_str} {line}")
             else:
-                log.info(f"{self.items_total-self.queue_id.qsize()}/{self.items_total} ({md5}) ({an_id}) {size_str} {line}")
-        except queue.Empty:                    
-            pass    
-
+                log.info(f"{self.items_done}/{self.items_total} ({value}) ({an_id}) {size_str} {line}")
+        if len(id_value_list)>0:
+            result_columns=self.get_result_columns()
+            if len(result_columns)==1:
+                self.db.edit_values_in_table(self.table,result_columns[0],id_value_list)
+            else:
+                # all digest columns in one UPDATE
+                self.db.edit_values_in_table(self.table,result_columns,id_value_list)
+            self.hash_cache.flush()
+        return len(id_value_list)
 
     def run(self):
         """thread loop"""                
         print('[green]'+'<'*10+'Successfully Started calculation Thread'+'>'*10)
-        count=0
-        has_filled_data=False
         with Progress() as progress:
             if not self.pbar_stream:
                 exit_key="ctrl+c"
                 if os.name == 'nt':
                     exit_key="F12"
                 task1 = progress.add_task(f"[blue]{self.table} [red](Press {exit_key} to Exit)", total=100)
-            while not self.killer_event.wait(self.cycle_time):   
-                try:
-                    if not has_filled_data and self.queue_pathfile.empty():
-                        self.fill_queue_with_files()
-                        has_filled_data=True
-                    elif has_filled_data and self.queue_pathfile.empty():
-                        self.is_data = False
-                    if not self.is_data and self.queue_pathfile.empty():
-                        self.calculation_finished=True
-                        self.killer_event.set()
-                        break
-                    else:
-                        self.calculate_for_next_file_in_queue()
-                    
-                    count=count+1
-                    # print(count)
-
+            try:
+                self.fill_queue_with_files()
+                if self.is_data:
+                    self.start_workers()
+                while True:
+                    written=self.write_results_in_queue()
                     # set progressbar status
-                    items_left=self.items_total-self.queue_id.qsize()
-                    per=self.Get_Progress_Percentage(items_left,self.items_total,0,100)
+                    per=self.Get_Progress_Percentage(self.items_done,self.items_total,0,100)
                     if not self.pbar_stream:
-                        #progress.update(task1, advance=1)
                         progress.update(task1, completed=per)
                     else:
-                        self.Pbar_Set_Status(self.pbar_stream,per)     
-                except KeyboardInterrupt:
-                    self.killer_event.set()
-                    log.info('User Cancel')     
-                except Exception as e:
-                    self.killer_event.set()
-                    log.error(e)
-                    log.error("Stream calculation fatal error! exiting thread!")                                         
-                    raise  
-        if self.killer_event.is_set():
+                        self.Pbar_Set_Status(self.pbar_stream,per)
+                    if not self.workers_alive() and self.queue_results.empty():
+                        self.calculation_finished=not self.killer_event.is_set()
+                        break
+                    if written<RESULT_BATCH:
+                        # wait for results, quits waiting if killed
+                        self.killer_event.wait(self.cycle_time)
+            except KeyboardInterrupt:
+                self.killer_event.set()
+                log.info('User Cancel')     
+            except Exception as e:
+                self.killer_event.set()
+                log.error(e)
+                log.error("Stream calculation fatal error! exiting thread!")                                         
+                raise  
+        self.hash_cache.close()
+        if self.killer_event.is_set() and not self.calculation_finished:
             log.info("Stream calculation Killing event Detected!")                        
         log.info("Stream calculation Ended successfully!")  
         if self.pbar_stream:           
             self.Pbar_Set_Status(self.pbar_stream,100)    
          
         self.killer_event.set()   
-        #  self.db.print_all_rows(self.table)
-        #self.quit() 
-    
 
 
 def main():    